@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Measures the transactions per second of the SMTP protocol.
+
+The client is connected to the server through in-memory streams, see
+:mod:`bonzo.loopback`, so the measure doesn't include the cost of sockets.
+"""
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from bonzo.server import SMTPServer
+from bonzo.smtp import Application, RequestHandler
+from bonzo.testing import connect_loopback
+
+MESSAGE = (b'Subject: Benchmark\r\n\r\n' +
+           b'This is a line of the message.\r\n' * 100)
+
+
+class Handler(RequestHandler):
+
+    def data(self):
+        pass
+
+
+@gen.coroutine
+def run(server, transactions):
+    stream = connect_loopback(server)
+    yield stream.read_until(b'\r\n')
+    stream.write(b'HELO client\r\n')
+    yield stream.read_until(b'\r\n')
+    for _ in range(transactions):
+        stream.write(b'MAIL FROM:mail@example.com\r\n'
+                     b'RCPT TO:rcpt@example.com\r\n')
+        yield stream.read_until(b'\r\n')
+        yield stream.read_until(b'\r\n')
+        stream.write(b'DATA\r\n')
+        yield stream.read_until(b'\r\n')
+        stream.write(MESSAGE + b'.\r\n')
+        yield stream.read_until(b'\r\n')
+    stream.close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--transactions', type='int', default=10000)
+    parser.add_option('--callback', action='store_true', default=False,
+                      help='use a plain request callback instead of an '
+                           'application')
+    options, _ = parser.parse_args()
+    if options.callback:
+        server = SMTPServer(lambda request: request.finish())
+    else:
+        server = SMTPServer(Application(Handler))
+    start = time.time()
+    IOLoop.current().run_sync(lambda: run(server, options.transactions))
+    elapsed = time.time() - start
+    sys.stdout.write('%d transactions in %.2f s: %.0f per second\n' % (
+        options.transactions, elapsed, options.transactions / elapsed))
+
+
+if __name__ == '__main__':
+    main()
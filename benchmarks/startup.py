@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Measures the startup of Bonzo.
+
+- Import time: seconds taken by ``import bonzo.server`` in a new interpreter,
+  minus the startup of the interpreter and Tornado.
+- Time to first banner: seconds from the start of a new process running a
+  server until a client receives its ``220`` welcome message.
+
+Every measure is the median of ``--runs`` runs. The script exits with an error
+when a measure exceeds its ``--max-import`` or ``--max-banner`` limit, so it
+can guard against regressions in continuous integration.
+"""
+import optparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CODE = """
+import sys, time
+sys.path.insert(0, %r)
+import tornado.ioloop, tornado.tcpserver
+start = time.time()
+%s
+sys.stdout.write(repr(time.time() - start))
+"""
+
+SERVER_CODE = """
+import sys
+sys.path.insert(0, %r)
+import tornado.ioloop
+import bonzo.server
+
+server = bonzo.server.SMTPServer(lambda request: request.finish())
+server.listen(%d, '127.0.0.1')
+tornado.ioloop.IOLoop.current().start()
+"""
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure_import(statement='import bonzo.server'):
+    code = IMPORT_CODE % (ROOT, statement)
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def measure_banner(timeout=10):
+    port = unused_port()
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c',
+                                SERVER_CODE % (ROOT, port)])
+    try:
+        while time.time() - start < timeout:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port))
+            except socket.error:
+                time.sleep(0.001)
+                continue
+            try:
+                banner = sock.makefile('rb').readline()
+            finally:
+                sock.close()
+            if not banner.startswith(b'220 '):
+                raise RuntimeError('Unexpected banner: %r' % banner)
+            return time.time() - start
+        raise RuntimeError('The server did not start')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--runs', type='int', default=11)
+    parser.add_option('--max-import', type='float', default=None,
+                      help='maximum import time in seconds')
+    parser.add_option('--max-banner', type='float', default=None,
+                      help='maximum time to first banner in seconds')
+    options, _ = parser.parse_args()
+    results = [
+        ('import bonzo.server', options.max_import,
+         median([measure_import() for _ in range(options.runs)])),
+        ('time to first banner', options.max_banner,
+         median([measure_banner() for _ in range(options.runs)])),
+    ]
+    failed = False
+    for name, limit, value in results:
+        status = ''
+        if limit is not None and value > limit:
+            status = ' (limit %.1f ms exceeded)' % (limit * 1000)
+            failed = True
+        sys.stdout.write('%s: %.1f ms%s\n' % (name, value * 1000, status))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Compares the transactions per second of local clients connected through
+TCP on the loopback interface and through a Unix socket.
+
+The server runs on a separate process listening on both, see
+:meth:`bonzo.server.SMTPServer.listen_unix`, and ``--connections`` clients
+send ``--transactions`` messages each on every kind of socket.
+"""
+import optparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+MESSAGE = (b'Subject: Benchmark\r\n\r\n' +
+           b'This is a line of the message.\r\n' * 100)
+
+SERVER_CODE = """
+import sys
+sys.path.insert(0, %r)
+import tornado.ioloop
+import bonzo.server
+
+server = bonzo.server.SMTPServer(lambda request: request.finish())
+server.listen(%d, '127.0.0.1')
+server.listen_unix(%r)
+tornado.ioloop.IOLoop.current().start()
+"""
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@gen.coroutine
+def connect(family, address):
+    while True:
+        stream = IOStream(socket.socket(family))
+        try:
+            yield stream.connect(address)
+        except Exception:
+            # The server is starting
+            yield gen.sleep(0.01)
+            continue
+        raise gen.Return(stream)
+
+
+@gen.coroutine
+def run(family, address, transactions):
+    stream = yield connect(family, address)
+    yield stream.read_until(b'\r\n')
+    stream.write(b'HELO client\r\n')
+    yield stream.read_until(b'\r\n')
+    for _ in range(transactions):
+        stream.write(b'MAIL FROM:mail@example.com\r\n'
+                     b'RCPT TO:rcpt@example.com\r\n')
+        yield stream.read_until(b'\r\n')
+        yield stream.read_until(b'\r\n')
+        stream.write(b'DATA\r\n')
+        yield stream.read_until(b'\r\n')
+        stream.write(MESSAGE + b'.\r\n')
+        yield stream.read_until(b'\r\n')
+    stream.close()
+
+
+def measure(family, address, connections, transactions):
+    @gen.coroutine
+    def clients():
+        yield [run(family, address, transactions)
+               for _ in range(connections)]
+    # Warm up, and wait for the server
+    IOLoop.current().run_sync(lambda: run(family, address, 1))
+    start = time.time()
+    IOLoop.current().run_sync(clients)
+    return connections * transactions / (time.time() - start)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--transactions', type='int', default=2000)
+    parser.add_option('-c', '--connections', type='int', default=10)
+    options, _ = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'smtp.sock')
+    port = unused_port()
+    process = subprocess.Popen([sys.executable, '-c',
+                                SERVER_CODE % (ROOT, port, path)])
+    try:
+        tcp = measure(socket.AF_INET, ('127.0.0.1', port),
+                      options.connections, options.transactions)
+        unix = measure(socket.AF_UNIX, path, options.connections,
+                       options.transactions)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(directory)
+    sys.stdout.write('TCP loopback: %.0f transactions per second\n' % tcp)
+    sys.stdout.write('Unix socket: %.0f transactions per second (%+.0f%%)\n'
+                     % (unix, (unix / tcp - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
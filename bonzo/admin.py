@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""An HTTP endpoint for monitoring and controlling a running server, on the
+IOLoop of the server.
+
+:class:`AdminApplication` is a :class:`tornado.web.Application` with:
+
+- ``GET /stats``: the statistics of :meth:`SMTPServer.get_stats
+  <bonzo.server.SMTPServer.get_stats>` and :meth:`Application.get_stats
+  <bonzo.smtp.Application.get_stats>` as JSON. They are read from counters
+  kept by the connections, the connections aren't walked.
+- ``POST /drain``: :meth:`~bonzo.server.SMTPServer.drain` the server, with an
+  optional ``timeout`` argument.
+- ``POST /log-level``: sets the ``level`` of the ``logger`` arguments, the
+  root logger by default.
+- ``POST /profile``: starts the :class:`~bonzo.profiler.SamplingProfiler`,
+  for an optional ``duration``.
+
+The ``POST`` requests must have an ``X-Admin-Token`` header, with the
+``token`` of the application when it has one, otherwise with any value.
+Browsers don't send this header in the forms posted by other sites, and
+don't send it cross-origin without asking the endpoint first, which doesn't
+allow it.
+
+It's started by :meth:`Application.listen <bonzo.smtp.Application.listen>`
+with the ``admin_port`` setting, and the ``admin_token`` setting. It listens
+on ``127.0.0.1`` unless the ``admin_address`` setting says otherwise.
+"""
+import hmac
+import logging
+
+from tornado import web
+from tornado.escape import utf8
+
+_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+_TOKEN_HEADER = 'X-Admin-Token'
+
+
+def _equals(a, b):
+    compare_digest = getattr(hmac, 'compare_digest', None)
+    if compare_digest is None:  # pragma: no cover
+        return a == b
+    return compare_digest(a, b)
+
+
+class _AdminHandler(web.RequestHandler):
+
+    def initialize(self, smtp_server, smtp_application, profiler, token):
+        self.smtp_server = smtp_server
+        self.smtp_application = smtp_application
+        self.profiler = profiler
+        self.token = token
+
+    def prepare(self):
+        if self.request.method == 'GET':
+            return
+        value = self.request.headers.get(_TOKEN_HEADER)
+        if value is None or (self.token is not None and
+                             not _equals(utf8(value), utf8(self.token))):
+            raise web.HTTPError(403, 'Invalid %s header' % _TOKEN_HEADER)
+
+    def get_float_argument(self, name, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            raise web.HTTPError(400, 'Invalid %s: %s' % (name, value))
+
+
+class StatsHandler(_AdminHandler):
+
+    def get(self):
+        stats = self.smtp_server.get_stats()
+        get_stats = getattr(self.smtp_application, 'get_stats', None)
+        if get_stats is not None:
+            stats['application'] = get_stats()
+        self.write(stats)
+
+
+class DrainHandler(_AdminHandler):
+
+    def post(self):
+        self.smtp_server.drain(self.get_float_argument('timeout', 30))
+        self.set_status(202)
+        self.write({'draining': True})
+
+
+class LogLevelHandler(_AdminHandler):
+
+    def post(self):
+        name = self.get_argument('logger', '')
+        level = self.get_argument('level').upper()
+        if level not in _LEVELS:
+            raise web.HTTPError(400, 'Invalid level: %s' % level)
+        logging.getLogger(name).setLevel(level)
+        self.write({'logger': name, 'level': level})
+
+
+class ProfileHandler(_AdminHandler):
+
+    def post(self):
+        if self.profiler is None:
+            raise web.HTTPError(404, 'No profiler')
+        self.profiler.start(self.get_float_argument('duration'))
+        self.set_status(202)
+        self.write({'running': True})
+
+
+class AdminApplication(web.Application):
+    """The admin endpoint of ``smtp_server``, and of ``application``, its
+    request callback, when it's an :class:`~bonzo.smtp.Application`.
+
+    :arg profiler: Optional :class:`~bonzo.profiler.SamplingProfiler`
+        started by ``POST /profile``.
+    :arg str token: Optional secret expected in the ``X-Admin-Token`` header
+        of the ``POST`` requests.
+    """
+
+    def __init__(self, smtp_server, application=None, profiler=None,
+                 token=None, **settings):
+        args = {
+            'smtp_server': smtp_server,
+            'smtp_application': application,
+            'profiler': profiler,
+            'token': token,
+        }
+        web.Application.__init__(self, [
+            (r'/stats', StatsHandler, args),
+            (r'/drain', DrainHandler, args),
+            (r'/log-level', LogLevelHandler, args),
+            (r'/profile', ProfileHandler, args),
+        ], **settings)
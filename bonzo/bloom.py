@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Bloom filters for screening recipient addresses."""
+import hashlib
+import math
+import struct
+import threading
+
+from tornado.concurrent import Future
+from tornado.escape import utf8
+from tornado.ioloop import IOLoop
+
+
+class BloomFilter(object):
+    """A compact set membership test with false positives but no false
+    negatives.
+
+    :arg int capacity: Expected number of keys to be added.
+    :arg float error_rate: Acceptable ratio of false positives once
+        ``capacity`` keys were added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) /
+                                  (math.log(2) ** 2)))
+        hashes = float(self.size) / capacity * math.log(2)
+        self.hashes = max(int(round(hashes)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_iterable(cls, keys, error_rate=0.01):
+        """Returns a filter sized for and containing every key in ``keys``."""
+        keys = list(keys)
+        bloom = cls(len(keys), error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key):
+        digest = hashlib.md5(utf8(key)).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        """Adds ``key`` to the filter."""
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+def read_addresses(path):
+    """Yields the addresses of a file with one address per line, skipping
+    blank lines and ``#`` comments.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+class RecipientFilter(object):
+    """Screens recipient addresses with a :class:`BloomFilter`.
+
+    Addresses are compared case-insensitively. Until the filter is loaded
+    every address is considered a possible recipient.
+
+    :arg addresses: An optional iterable of valid addresses.
+    :arg string path: An optional path to a file of valid addresses, see
+        :func:`read_addresses`. It's used by :meth:`reload` when no other path
+        is given.
+    :arg float error_rate: False positive ratio of the underlying filter.
+    """
+
+    def __init__(self, addresses=None, path=None, error_rate=0.01):
+        self.path = path
+        self.error_rate = error_rate
+        self.bloom = None
+        if addresses is not None:
+            self.load(addresses)
+        elif path is not None:
+            self.load(read_addresses(path))
+
+    def _build(self, addresses):
+        return BloomFilter.from_iterable((a.lower() for a in addresses),
+                                         self.error_rate)
+
+    def load(self, addresses):
+        """Replaces the filter with one built from ``addresses``."""
+        self.bloom = self._build(addresses)
+
+    def reload(self, path=None, io_loop=None):
+        """Rebuilds the filter from ``path`` on a separate thread, so the
+        IOLoop is not blocked, and swaps it in on the IOLoop. Returns a
+        :class:`~tornado.concurrent.Future` resolved when the new filter is in
+        use.
+        """
+        path = path or self.path
+        io_loop = io_loop or IOLoop.current()
+        future = Future()
+
+        def swap(bloom, error):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                self.path = path
+                self.bloom = bloom
+                future.set_result(bloom)
+
+        def build():
+            try:
+                bloom = self._build(read_addresses(path))
+            except Exception as e:
+                io_loop.add_callback(swap, None, e)
+            else:
+                io_loop.add_callback(swap, bloom, None)
+
+        thread = threading.Thread(target=build)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def __contains__(self, address):
+        bloom = self.bloom
+        return bloom is None or address.lower() in bloom
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Accounting of the memory and the handlers used by the messages in flight.
+"""
+import collections
+
+from tornado.ioloop import IOLoop
+
+
+class MemoryBudget(object):
+    """Tracks the bytes of the messages being received or waiting for their
+    handlers against a ``limit``.
+
+    Once the budget is exhausted, readers :meth:`wait` until enough bytes are
+    released. To guarantee progress, a single reader at a time can keep
+    reading while the budget is exhausted, see :meth:`may_read`.
+
+    :arg int limit: Number of bytes available.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._owner = None
+        self._waiters = collections.deque()
+
+    @property
+    def exhausted(self):
+        """Whether every available byte is used."""
+        return self.used >= self.limit
+
+    def acquire(self, size):
+        """Accounts ``size`` bytes as used."""
+        self.used += size
+
+    def release(self, size):
+        """Accounts ``size`` bytes as freed, waking up the waiting readers when
+        the budget is no longer exhausted.
+        """
+        self.used -= size
+        if not self.exhausted:
+            self._wake_up()
+
+    def may_read(self, reader):
+        """Returns whether ``reader`` can keep reading. Only the first reader
+        asking while the budget is exhausted can, until :meth:`end_read` is
+        called for it.
+        """
+        if not self.exhausted:
+            return True
+        if self._owner is None:
+            self._owner = reader
+        return self._owner is reader
+
+    def end_read(self, reader):
+        """Called when ``reader`` finished reading its message."""
+        if self._owner is reader:
+            self._owner = None
+            self._wake_up()
+
+    def wait(self, callback):
+        """Runs ``callback`` on the IOLoop when bytes were released."""
+        self._waiters.append(callback)
+
+    def _wake_up(self):
+        waiters = self._waiters
+        self._waiters = collections.deque()
+        io_loop = IOLoop.current()
+        for callback in waiters:
+            io_loop.add_callback(callback)
+
+    def to_dict(self):
+        """Returns a dictionary with the current usage of the budget."""
+        return {
+            'limit': self.limit,
+            'used': self.used,
+            'waiting': len(self._waiters),
+        }
+
+
+class RequestBudget(object):
+    """Tracks the requests passed to the request callback and not answered
+    yet against a ``limit``.
+
+    Once the budget is exhausted, connections :meth:`wait` before reading
+    from their sockets and before passing a new request to the request
+    callback, until a request is answered. Unlike :class:`MemoryBudget` no
+    reader is allowed to keep reading, the budget is freed by the handlers.
+
+    :arg int limit: Number of requests handled at a time.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = 0
+        self._waiters = collections.deque()
+
+    @property
+    def exhausted(self):
+        """Whether ``limit`` requests are pending."""
+        return self.pending >= self.limit
+
+    def acquire(self):
+        """Accounts a request passed to the request callback."""
+        self.pending += 1
+
+    def release(self):
+        """Accounts a request answered, waking up the waiting connections when
+        the budget is no longer exhausted.
+        """
+        self.pending -= 1
+        if not self.exhausted and self._waiters:
+            waiters = self._waiters
+            self._waiters = collections.deque()
+            io_loop = IOLoop.current()
+            for callback in waiters:
+                io_loop.add_callback(callback)
+
+    def wait(self, callback):
+        """Runs ``callback`` on the IOLoop when a request was answered."""
+        self._waiters.append(callback)
+
+    def to_dict(self):
+        """Returns a dictionary with the current usage of the budget."""
+        return {
+            'limit': self.limit,
+            'pending': self.pending,
+            'waiting': len(self._waiters),
+        }
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Caches for the results of asynchronous lookups."""
+import collections
+import functools
+import time
+
+from tornado.concurrent import Future
+
+
+class TTLCache(object):
+    """A least-recently-used cache whose entries expire after a time to live.
+
+    :arg int maxsize: Maximum number of entries kept in the cache, the least
+        recently used entry is evicted when it is exceeded.
+    :arg float ttl: Number of seconds an entry is considered valid.
+    :arg timer: A callable that returns the current time in seconds, defaults
+        to :func:`time.time`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the value cached for ``key`` or ``default`` if it is
+        missing or expired.
+        """
+        try:
+            expires, value = self._entries.pop(key)
+        except KeyError:
+            return default
+        if expires <= self.timer():
+            return default
+        self._entries[key] = (expires, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Stores ``value`` for ``key``, optionally with a custom ``ttl``."""
+        if ttl is None:
+            ttl = self.ttl
+        self._entries.pop(key, None)
+        if ttl <= 0:
+            return
+        self._entries[key] = (self.timer() + ttl, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Removes ``key`` from the cache if it is present."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all the entries from the cache."""
+        self._entries.clear()
+
+    def __contains__(self, key):
+        missing = object()
+        return self.get(key, missing) is not missing
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LookupCache(object):
+    """Wraps a lookup function with a :class:`TTLCache`.
+
+    Calling an instance returns a :class:`~tornado.concurrent.Future` with the
+    result of ``lookup(key)``. Results are cached for ``ttl`` seconds, or for
+    ``negative_ttl`` seconds when the result is false, and concurrent calls
+    for the same key are coalesced into a single call to ``lookup``.
+    Exceptions are propagated to every waiting caller and never cached.
+
+    :arg lookup: A callable receiving a key and returning either a value or a
+        :class:`~tornado.concurrent.Future`.
+    :arg int maxsize: Maximum number of cached results.
+    :arg float ttl: Time to live of the true results.
+    :arg float negative_ttl: Time to live of the false results, defaults to
+        ``ttl``.
+    """
+
+    def __init__(self, lookup, maxsize=1024, ttl=300, negative_ttl=None,
+                 timer=time.time):
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.cache = TTLCache(maxsize, ttl, timer)
+        self._pending = {}
+
+    def __call__(self, key):
+        missing = object()
+        value = self.cache.get(key, missing)
+        if value is not missing:
+            future = Future()
+            future.set_result(value)
+            return future
+        future = self._pending.get(key)
+        if future is not None:
+            return future
+        future = self._pending[key] = Future()
+        try:
+            result = self.lookup(key)
+        except Exception as e:
+            self._reject(key, future, e)
+            return future
+        if isinstance(result, Future):
+            result.add_done_callback(functools.partial(self._on_lookup, key,
+                                                       future))
+        else:
+            self._resolve(key, future, result)
+        return future
+
+    def invalidate(self, key):
+        """Forgets the cached result for ``key``."""
+        self.cache.discard(key)
+
+    def _on_lookup(self, key, future, result):
+        try:
+            value = result.result()
+        except Exception as e:
+            self._reject(key, future, e)
+        else:
+            self._resolve(key, future, value)
+
+    def _resolve(self, key, future, value):
+        del self._pending[key]
+        self.cache.set(key, value, self.ttl if value else self.negative_ttl)
+        future.set_result(value)
+
+    def _reject(self, key, future, exception):
+        del self._pending[key]
+        future.set_exception(exception)
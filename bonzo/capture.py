@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Capture of the bytes sent by SMTP clients, for replaying them with
+:mod:`bonzo.replay`.
+
+A :class:`SessionRecorder` passed as the ``recorder`` argument of
+:class:`~bonzo.server.SMTPServer` writes every chunk received from the
+clients, with the time it was received, to a binary file:
+
+.. code-block:: python
+
+   recorder = SessionRecorder('/var/tmp/sessions.bin')
+   server = SMTPServer(application, recorder=recorder)
+
+The file starts with a header and is followed by events: a session opened, a
+chunk of bytes received on it, or the session closed. Every event is a fixed
+size record with the session number, the kind of event, the microseconds
+since the recorder was created and the length of the bytes that follow it.
+"""
+import struct
+import time
+
+_MAGIC = b'BZCAP1'
+_EVENT = struct.Struct('!IBQI')
+
+OPEN = 0
+DATA = 1
+CLOSE = 2
+
+
+class SessionRecorder(object):
+    """Writes the sessions of the clients to ``path``.
+
+    :arg str path: Path of the capture file, it's replaced when it exists.
+    """
+
+    def __init__(self, path, timer=time.time):
+        self.path = path
+        self.timer = timer
+        self._start = timer()
+        self._sessions = 0
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+
+    def _write(self, session, kind, data=b''):
+        if self._file is None:
+            return
+        offset = int((self.timer() - self._start) * 1000000)
+        self._file.write(_EVENT.pack(session, kind, offset, len(data)))
+        if data:
+            self._file.write(data)
+
+    def open(self):
+        """Starts a session and returns its number."""
+        self._sessions += 1
+        self._write(self._sessions, OPEN)
+        return self._sessions
+
+    def record(self, session, data):
+        """Records the bytes received on ``session``."""
+        self._write(session, DATA, data)
+
+    def close_session(self, session):
+        """Records the end of ``session``."""
+        self._write(session, CLOSE)
+
+    def close(self):
+        """Closes the capture file, next events are ignored."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CapturedSession(object):
+    """A session read from a capture file.
+
+    .. attribute:: start
+
+       Seconds since the start of the capture when the session was opened.
+
+    .. attribute:: events
+
+       List of ``(seconds, data)`` tuples with the bytes received and the
+       seconds since the session was opened.
+    """
+
+    def __init__(self, number, start):
+        self.number = number
+        self.start = start
+        self.events = []
+        self.closed = False
+
+    @property
+    def size(self):
+        """Number of bytes received on the session."""
+        return sum(len(data) for _, data in self.events)
+
+    def __repr__(self):
+        return '%s (number=%d, events=%d, size=%d)' % (
+            self.__class__.__name__, self.number, len(self.events), self.size)
+
+
+def read_sessions(path):
+    """Returns the list of :class:`CapturedSession` of the capture file in
+    ``path``, ordered by their start.
+    """
+    sessions = {}
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError('Invalid capture file: %s' % path)
+        while True:
+            header = f.read(_EVENT.size)
+            if len(header) < _EVENT.size:
+                # The end of the file, or a truncated event
+                break
+            number, kind, offset, size = _EVENT.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                break
+            seconds = offset / 1000000.0
+            if kind == OPEN:
+                sessions[number] = CapturedSession(number, seconds)
+                continue
+            session = sessions.get(number)
+            if session is None:
+                continue
+            if kind == DATA:
+                session.events.append((seconds - session.start, data))
+            elif kind == CLOSE:
+                session.closed = True
+    return sorted(sessions.values(), key=lambda s: (s.start, s.number))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Streaming compression of stored messages.
+
+A :class:`Codec` compresses and decompresses iterables of chunks, and a
+:class:`CompressionPolicy` chooses the codec of every stored object by its
+size and content type. :mod:`lzma` is used when it's available.
+"""
+import zlib
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+INCOMPRESSIBLE_TYPES = ('image/', 'audio/', 'video/', 'application/zip',
+                        'application/gzip', 'application/x-gzip',
+                        'application/x-bzip2', 'application/x-xz',
+                        'application/x-7z-compressed',
+                        'application/x-rar-compressed')
+"""Prefixes of the content types that are already compressed."""
+
+
+class _Identity(object):
+
+    def compress(self, data):
+        return bytes(data)
+
+    decompress = compress
+
+    def flush(self):
+        return b''
+
+
+class Codec(object):
+    """A codec storing the data as is. Subclasses override
+    :meth:`compressor` and :meth:`decompressor`.
+    """
+
+    name = 'identity'
+
+    def compressor(self):
+        """Returns an object with the ``compress`` and ``flush`` methods of
+        :func:`zlib.compressobj`.
+        """
+        return _Identity()
+
+    def decompressor(self):
+        """Returns an object with the ``decompress`` method of
+        :func:`zlib.decompressobj`.
+        """
+        return _Identity()
+
+    def iter_compress(self, chunks):
+        """Yields the compressed data of the iterable ``chunks``."""
+        compressor = self.compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        data = compressor.flush()
+        if data:
+            yield data
+
+    def iter_decompress(self, chunks):
+        """Yields the decompressed data of the iterable ``chunks``."""
+        decompressor = self.decompressor()
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        flush = getattr(decompressor, 'flush', None)
+        if flush is not None:
+            data = flush()
+            if data:
+                yield data
+
+
+class ZlibCodec(Codec):
+    """Compresses with :mod:`zlib` at ``level``."""
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class LZMACodec(Codec):
+    """Compresses with :mod:`lzma` at ``preset``, slower than
+    :class:`ZlibCodec` but with higher ratios.
+    """
+
+    name = 'lzma'
+
+    def __init__(self, preset=6):
+        if lzma is None:
+            raise RuntimeError('The lzma module is not available')
+        self.preset = preset
+
+    def compressor(self):
+        return lzma.LZMACompressor(preset=self.preset)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+def get_codec(name):
+    """Returns a codec able to decompress the data written by the codec of
+    ``name``.
+    """
+    if name == Codec.name:
+        return Codec()
+    elif name == ZlibCodec.name:
+        return ZlibCodec()
+    elif name == LZMACodec.name:
+        return LZMACodec()
+    raise ValueError('Unknown codec: %s' % name)
+
+
+class CompressionPolicy(object):
+    """Chooses the codec of the objects to store.
+
+    Objects smaller than ``min_size`` bytes, or with a content type starting
+    with any of ``skip_types``, are stored as is. Objects of at least
+    ``large_size`` bytes use ``large_codec`` when it's given, and the rest use
+    ``codec``, a :class:`ZlibCodec` by default.
+    """
+
+    def __init__(self, min_size=1024, codec=None, large_codec=None,
+                 large_size=1024 * 1024, skip_types=INCOMPRESSIBLE_TYPES):
+        self.min_size = min_size
+        self.codec = codec or ZlibCodec()
+        self.large_codec = large_codec
+        self.large_size = large_size
+        self.skip_types = tuple(skip_types)
+        self.identity = Codec()
+
+    def choose(self, size, content_type=None):
+        """Returns the codec for an object of ``size`` bytes and
+        ``content_type``.
+        """
+        if size < self.min_size:
+            return self.identity
+        if content_type and content_type.lower().startswith(self.skip_types):
+            return self.identity
+        if self.large_codec is not None and size >= self.large_size:
+            return self.large_codec
+        return self.codec
@@ -26,6 +26,27 @@ class SMTPError(Exception):
             return message
         return message + ' (' + (self.log_message % self.args) + ')'
 
+    @property
+    def wire(self):
+        """The reply of the error as written to the client, ``<code>
+        <message><CR><LF>`` encoded as bytes.
+        """
+        wire = self.__dict__.get('_wire')
+        if wire is None:
+            reply = '%d %s\r\n' % (self.status_code, self.message)
+            wire = self._wire = reply.encode('utf-8')
+        return wire
+
+
+class ServiceUnavailable(SMTPError):
+    """Used to return a ``421`` status code before closing the connection.
+    """
+
+    def __init__(self):
+        super(ServiceUnavailable, self).__init__(421, 'Service not available, '
+                                                      'closing transmission '
+                                                      'channel')
+
 
 class InternalConfusion(SMTPError):
     """Used to return a ``451`` status code.
@@ -73,3 +94,65 @@ class BadSequence(SMTPError):
 
     def __init__(self, message):
         super(BadSequence, self).__init__(503, message)
+
+
+class MailboxUnavailable(SMTPError):
+    """Used to return a ``550`` status code.
+
+    :arg string message: Message to be written to the stream and to response to
+        the client.
+    """
+
+    def __init__(self, message='Requested action not taken: mailbox '
+                               'unavailable'):
+        super(MailboxUnavailable, self).__init__(550, message)
+
+
+class Greylisted(SMTPError):
+    """Used to return a ``451`` status code to greylisted clients.
+    """
+
+    def __init__(self):
+        super(Greylisted, self).__init__(451, 'Greylisted, please try again '
+                                              'later')
+
+
+class InsufficientStorage(SMTPError):
+    """Used to return a ``452`` status code.
+    """
+
+    def __init__(self):
+        super(InsufficientStorage, self).__init__(452, 'Insufficient system '
+                                                       'storage')
+
+
+class LineTooLong(SMTPError):
+    """Used to return a ``500`` status code when a command line is too long.
+    """
+
+    def __init__(self):
+        super(LineTooLong, self).__init__(500, 'Line too long')
+
+
+class TooManyRecipients(SMTPError):
+    """Used to return a ``452`` status code when a message has too many
+    recipients.
+    """
+
+    def __init__(self):
+        super(TooManyRecipients, self).__init__(452, 'Too many recipients')
+
+
+_wires = {}
+
+
+def wire(error_class):
+    """Returns the :attr:`SMTPError.wire` reply of ``error_class``, a
+    subclass of :class:`SMTPError` taking no arguments. It's built once, so
+    the errors with a fixed reply can be written without being instantiated.
+    """
+    try:
+        return _wires[error_class]
+    except KeyError:
+        value = _wires[error_class] = error_class().wire
+        return value
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Filters for accepting or rejecting the SMTP transactions on every phase.
+
+A filter is a subclass of :class:`Filter` overriding the methods of the phases
+it is interested in. Filters are chained on a :class:`FilterChain`, which is
+usually created by :class:`~bonzo.smtp.Application` from its ``filters``
+setting:
+
+.. code-block:: python
+
+   class BlockSender(filters.Filter):
+
+       def mail(self, connection, address):
+           if address.endswith('@spam.example.com'):
+               self.reject('Sender rejected')
+
+   application = smtp.Application(Handler, filters=[BlockSender()])
+"""
+import functools
+import sys
+import time
+
+from tornado.concurrent import Future
+
+from bonzo import errors
+from bonzo.stats import Histogram
+
+PHASES = ('connect', 'helo', 'mail', 'rcpt', 'headers', 'body')
+"""Names of the phases a filter can act on, in the order they run."""
+
+
+class Filter(object):
+    """Subclass this class and override the phase methods to make a filter.
+
+    Every phase method accepts the transaction by returning ``None``, or a
+    :class:`~tornado.concurrent.Future` resolving to ``None``, and rejects it
+    by raising an :class:`~bonzo.errors.SMTPError`, e.g. using
+    :meth:`tempfail` or :meth:`reject`. The rejection is written to the
+    client instead of the reply of the current command.
+    """
+
+    @property
+    def name(self):
+        """Name of the filter used to label its latencies."""
+        return self.__class__.__name__
+
+    def tempfail(self, message='Requested action aborted: try again later'):
+        """Rejects the transaction with a ``451`` status code."""
+        raise errors.SMTPError(451, message)
+
+    def reject(self, message='Requested action not taken'):
+        """Rejects the transaction with a ``550`` status code."""
+        raise errors.SMTPError(550, message)
+
+    def connect(self, connection):
+        """Called when a client connects, before the welcome message."""
+        pass
+
+    def helo(self, connection, hostname):
+        """Called when a ``HELO`` command is received."""
+        pass
+
+    def mail(self, connection, address):
+        """Called when a ``MAIL`` command is received."""
+        pass
+
+    def rcpt(self, connection, address):
+        """Called when a ``RCPT`` command is received."""
+        pass
+
+    def headers(self, connection, headers):
+        """Called when the message is received, before :meth:`body`, with an
+        instance of :class:`email.message.Message` holding only the headers.
+        """
+        pass
+
+    def body(self, connection, data):
+        """Called with the message data before passing it to the request
+        callback.
+        """
+        pass
+
+
+def _overrides(obj, name):
+    method = getattr(type(obj), name, None)
+    base = getattr(Filter, name)
+    return (method is not None and
+            getattr(method, '__func__', method) is not
+            getattr(base, '__func__', base))
+
+
+class FilterChain(object):
+    """Runs the phases of a list of :class:`Filter` instances in order.
+
+    The latency of every filter on every phase is measured on a
+    :class:`~bonzo.stats.Histogram` of the :attr:`latencies` dictionary,
+    keyed by ``(filter name, phase)``.
+    """
+
+    def __init__(self, filters, timer=time.time):
+        self.filters = list(filters)
+        self.timer = timer
+        self.latencies = {}
+        self.stages = {}
+        for phase in PHASES:
+            stages = []
+            for f in self.filters:
+                if not _overrides(f, phase):
+                    continue
+                histogram = self.latencies.setdefault((f.name, phase),
+                                                      Histogram())
+                stages.append((getattr(f, phase), histogram))
+            self.stages[phase] = stages
+
+    def has(self, phase):
+        """Returns whether any filter acts on ``phase``."""
+        return bool(self.stages.get(phase))
+
+    def run(self, phase, *args):
+        """Runs the filters of ``phase`` with ``args``. Returns a
+        :class:`~tornado.concurrent.Future` resolved when every filter
+        accepted the transaction, or failed with the first rejection.
+        """
+        future = Future()
+        self._run_stages(iter(self.stages.get(phase, ())), args, future)
+        return future
+
+    def _run_stages(self, stages, args, future):
+        for method, histogram in stages:
+            start = self.timer()
+            try:
+                result = method(*args)
+            except Exception:
+                histogram.add(self.timer() - start)
+                future.set_exc_info(sys.exc_info())
+                return
+            if isinstance(result, Future):
+                result.add_done_callback(functools.partial(
+                    self._on_stage, histogram, start, stages, args, future))
+                return
+            histogram.add(self.timer() - start)
+        future.set_result(None)
+
+    def _on_stage(self, histogram, start, stages, args, future, result):
+        histogram.add(self.timer() - start)
+        try:
+            result.result()
+        except Exception:
+            future.set_exc_info(sys.exc_info())
+        else:
+            self._run_stages(stages, args, future)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""In-memory greylisting of (client network, sender, recipient) triplets."""
+import array
+import hashlib
+import os
+import socket
+import struct
+import time
+
+from tornado.escape import utf8
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+if 'Q' in getattr(array, 'typecodes', ''):
+    _KEY_TYPECODE = 'Q'
+else:
+    _KEY_TYPECODE = 'L'  # pragma: no cover
+_KEY_MASK = (1 << (8 * array.array(_KEY_TYPECODE).itemsize)) - 1
+_SNAPSHOT_HEADER = struct.Struct('<5sII')
+_SNAPSHOT_MAGIC = b'BZGL1'
+# Marks the entries of the table being rehashed set again since, so moved
+_MOVED = 0xffffffff
+
+
+class TripletTable(object):
+    """An open addressing hash table of integer keys to pairs of timestamps.
+
+    Keys and timestamps are kept in :class:`array.array` instances, so every
+    slot takes a fixed number of bytes whatever the number of entries. The key
+    ``0`` is reserved to mark empty slots.
+
+    When the table grows, the entries are rehashed incrementally: the arrays
+    of the previous size are kept and :meth:`set` moves ``MIGRATE_BATCH`` of
+    their slots, or :meth:`migrate` more of them, until all are moved. Until
+    then, :meth:`get` looks up the keys not moved yet in the previous arrays.
+
+    :arg int capacity: Number of entries the table is initially sized for, it
+        grows when needed.
+    """
+
+    MAX_LOAD = 0.7
+    MIGRATE_BATCH = 64
+
+    def __init__(self, capacity=1024):
+        size = 8
+        while size * self.MAX_LOAD < capacity:
+            size <<= 1
+        self._allocate(size)
+        self.count = 0
+        self._old = None
+        self._migrated = 0
+
+    def _allocate(self, size):
+        self.size = size
+        self.mask = size - 1
+        self.keys = array.array(_KEY_TYPECODE, [0]) * size
+        self.first = array.array('I', [0]) * size
+        self.last = array.array('I', [0]) * size
+
+    def _slot(self, key):
+        keys = self.keys
+        mask = self.mask
+        i = key & mask
+        while keys[i] and keys[i] != key:
+            i = (i + 1) & mask
+        return i
+
+    def _old_slot(self, key):
+        # Slot of key in the previous arrays, when it's not moved yet
+        if self._old is None:
+            return None
+        keys, first, last, mask = self._old
+        i = key & mask
+        while keys[i]:
+            if keys[i] == key:
+                if i < self._migrated or last[i] == _MOVED:
+                    return None
+                return i
+            i = (i + 1) & mask
+        return None
+
+    def get(self, key):
+        """Returns the ``(first, last)`` timestamps of ``key`` or ``None``."""
+        i = self._slot(key)
+        if self.keys[i]:
+            return self.first[i], self.last[i]
+        i = self._old_slot(key)
+        if i is None:
+            return None
+        return self._old[1][i], self._old[2][i]
+
+    def set(self, key, first, last):
+        """Sets the timestamps of ``key``, adding it when it's missing."""
+        i = self._slot(key)
+        if not self.keys[i]:
+            j = self._old_slot(key)
+            if j is not None:
+                self._old[2][j] = _MOVED
+            else:
+                if (self.count + 1) > self.size * self.MAX_LOAD:
+                    self._resize(self.size << 1)
+                    i = self._slot(key)
+                self.count += 1
+            self.keys[i] = key
+        self.first[i] = first
+        self.last[i] = last
+        if self._old is not None:
+            self.migrate(self.MIGRATE_BATCH)
+
+    def _resize(self, size):
+        self.migrate()
+        self._old = (self.keys, self.first, self.last, self.mask)
+        self._migrated = 0
+        self._allocate(size)
+
+    @property
+    def migrating(self):
+        """Whether entries are left to move after the table grew."""
+        return self._old is not None
+
+    def migrate(self, count=None):
+        """Moves the entries of the next ``count`` slots of the previous
+        arrays after the table grew, of all of them by default.
+        """
+        if self._old is None:
+            return
+        keys, first, last, mask = self._old
+        start = self._migrated
+        end = len(keys) if count is None else min(start + count, len(keys))
+        for i in range(start, end):
+            key = keys[i]
+            if key and last[i] != _MOVED:
+                j = self._slot(key)
+                self.keys[j] = key
+                self.first[j] = first[i]
+                self.last[j] = last[i]
+        self._migrated = end
+        if end == len(keys):
+            self._old = None
+
+    def remove_slot(self, i):
+        """Empties the slot ``i``, shifting back the entries of its probe
+        sequence so no tombstones are needed.
+        """
+        keys, first, last, mask = self.keys, self.first, self.last, self.mask
+        j = i
+        while True:
+            j = (j + 1) & mask
+            key = keys[j]
+            if not key:
+                break
+            if ((j - (key & mask)) & mask) >= ((j - i) & mask):
+                keys[i], first[i], last[i] = key, first[j], last[j]
+                i = j
+        keys[i] = first[i] = last[i] = 0
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+
+class Greylist(object):
+    """Greylists the (client network, sender, recipient) triplets.
+
+    The first delivery attempt of a triplet is temporarily rejected; retries
+    after ``delay`` seconds, and before ``retry_window`` seconds, are accepted
+    and the triplet is then accepted until it is not seen for ``expire``
+    seconds. IPv4 clients are grouped by their ``/24`` network and IPv6
+    clients by their ``/64`` network.
+
+    Expired triplets are removed by incremental sweeps of ``sweep_batch``
+    slots every ``sweep_interval`` seconds once :meth:`start` is called.
+    ``capacity`` is the number of triplets the table is sized for. It grows
+    past it without blocking, see :class:`TripletTable`, but the arrays of
+    both sizes are then kept until the entries are moved, so large
+    deployments should size it for the expected number of triplets.
+    When ``snapshot_path`` is given, the table is restored from it on creation
+    when it exists and saved to it by :meth:`stop`.
+    """
+
+    def __init__(self, delay=300, retry_window=4 * 3600, expire=36 * 86400,
+                 capacity=1024, sweep_interval=1, sweep_batch=4096,
+                 snapshot_path=None, timer=time.time):
+        self.delay = delay
+        self.retry_window = retry_window
+        self.expire = expire
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.snapshot_path = snapshot_path
+        self.timer = timer
+        self.table = TripletTable(capacity)
+        self._cursor = 0
+        self._sweeper = None
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    @staticmethod
+    def network(remote_ip):
+        """Returns the network of ``remote_ip`` used to group clients."""
+        if ':' in remote_ip:
+            try:
+                packed = socket.inet_pton(socket.AF_INET6, remote_ip)
+            except (socket.error, ValueError):
+                return remote_ip
+            return packed[:8]
+        return remote_ip.rsplit('.', 1)[0]
+
+    def key(self, remote_ip, sender, recipient):
+        """Returns the hashed key of a triplet."""
+        digest = hashlib.md5(utf8(self.network(remote_ip)))
+        digest.update(b'\0' + utf8(sender.lower()))
+        digest.update(b'\0' + utf8(recipient.lower()))
+        return (struct.unpack('<Q', digest.digest()[:8])[0] & _KEY_MASK) or 1
+
+    def _expired(self, first, last, now):
+        if last:
+            return now - last > self.expire
+        return now - first > self.retry_window
+
+    def check(self, remote_ip, sender, recipient):
+        """Records a delivery attempt and returns ``True`` when the triplet is
+        accepted.
+        """
+        key = self.key(remote_ip, sender, recipient)
+        now = int(self.timer())
+        entry = self.table.get(key)
+        if entry is None or self._expired(entry[0], entry[1], now):
+            self.table.set(key, now, 0)
+            return False
+        first, last = entry
+        if not last and now - first < self.delay:
+            return False
+        self.table.set(key, first, now)
+        return True
+
+    def sweep(self, count=None):
+        """Checks the next ``count`` slots of the table, removing the expired
+        triplets, after moving the entries of as many slots when the table
+        grew. Returns the number of removed triplets.
+        """
+        table = self.table
+        table.migrate(count or self.sweep_batch)
+        now = int(self.timer())
+        removed = 0
+        for _ in range(min(count or self.sweep_batch, table.size)):
+            i = self._cursor & table.mask
+            if (table.keys[i] and
+                    self._expired(table.first[i], table.last[i], now)):
+                # The slot is filled back by the shifted entries, so it is
+                # checked again without moving the cursor.
+                table.remove_slot(i)
+                removed += 1
+            else:
+                self._cursor = i + 1
+        return removed
+
+    def start(self, io_loop=None):
+        """Starts sweeping the expired triplets periodically."""
+        if self._sweeper is None:
+            self._sweeper = PeriodicCallback(
+                self.sweep, self.sweep_interval * 1000,
+                io_loop=io_loop or IOLoop.current())
+            self._sweeper.start()
+
+    def stop(self):
+        """Stops the periodic sweeps and saves the snapshot when a
+        ``snapshot_path`` was given.
+        """
+        if self._sweeper is not None:
+            self._sweeper.stop()
+            self._sweeper = None
+        if self.snapshot_path:
+            self.save(self.snapshot_path)
+
+    def save(self, path):
+        """Writes the table to ``path``, replacing the file atomically."""
+        table = self.table
+        table.migrate()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, table.size,
+                                          table.count))
+            table.keys.tofile(f)
+            table.first.tofile(f)
+            table.last.tofile(f)
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        """Restores the table written by :meth:`save` to ``path``."""
+        with open(path, 'rb') as f:
+            header = f.read(_SNAPSHOT_HEADER.size)
+            magic, size, count = _SNAPSHOT_HEADER.unpack(header)
+            if magic != _SNAPSHOT_MAGIC:
+                raise ValueError('Invalid greylist snapshot: %s' % path)
+            table = TripletTable()
+            table._allocate(size)
+            table.keys = array.array(_KEY_TYPECODE)
+            table.keys.fromfile(f, size)
+            table.first = array.array('I')
+            table.first.fromfile(f, size)
+            table.last = array.array('I')
+            table.last.fromfile(f, size)
+            table.count = count
+        self.table = table
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self.table)
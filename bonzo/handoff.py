@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Handoff of listening sockets to a new process.
+
+:func:`spawn` starts a new process inheriting the listening sockets of the
+server, e.g. with a new version of the code, and the new process takes them
+with :func:`inherited_sockets`, so no connection is refused while the old
+process drains its connections. See :meth:`~bonzo.server.SMTPServer.reexec`.
+"""
+import os
+import socket
+import sys
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+LISTEN_FDS = 'BONZO_LISTEN_FDS'
+"""Name of the environment variable with the inherited sockets, a comma
+separated list of ``fd:family`` items."""
+
+_inherited = None
+
+
+def _set_inheritable(fd):
+    if hasattr(os, 'set_inheritable'):
+        os.set_inheritable(fd, True)
+    else:  # pragma: no cover
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+
+
+def spawn(sockets, argv=None):
+    """Starts a process running ``argv``, the command line of the current
+    process by default, inheriting the listening ``sockets``. Returns the
+    :class:`subprocess.Popen` instance of the process.
+    """
+    import subprocess
+    if argv is None:
+        argv = [sys.executable] + sys.argv
+    items = []
+    for sock in sockets:
+        _set_inheritable(sock.fileno())
+        items.append('%d:%d' % (sock.fileno(), sock.family))
+    env = dict(os.environ)
+    env[LISTEN_FDS] = ','.join(items)
+    return subprocess.Popen(argv, env=env, close_fds=False)
+
+
+def _load():
+    global _inherited
+    if _inherited is None:
+        _inherited = []
+        # Removed so processes started by this one don't take the sockets
+        value = os.environ.pop(LISTEN_FDS, '')
+        for item in value.split(','):
+            if not item:
+                continue
+            fd, family = [int(n) for n in item.split(':')]
+            sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+            os.close(fd)
+            sock.setblocking(False)
+            _inherited.append(sock)
+    return _inherited
+
+
+def _port(sock):
+    name = sock.getsockname()
+    # The path of Unix sockets
+    return name[1] if isinstance(name, tuple) else name
+
+
+def inherited_sockets(port=None):
+    """Returns the sockets inherited from the process that started this one,
+    only the ones listening on ``port``, or on the path of a Unix socket,
+    when it's given. Every socket is returned once.
+    """
+    sockets = _load()
+    taken = [sock for sock in sockets if port is None or _port(sock) == port]
+    for sock in taken:
+        sockets.remove(sock)
+    return taken
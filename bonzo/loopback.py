@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""In-memory streams for running the SMTP protocol without sockets.
+
+:func:`stream_pair` returns two connected :class:`LoopbackStream` instances.
+They implement the part of the :class:`~tornado.iostream.IOStream` interface
+used by :class:`~bonzo.server.SMTPConnection` and by clients, so a server can
+be driven without binding ports, e.g. with
+:func:`bonzo.testing.connect_loopback`. Callbacks run on the IOLoop, like the
+ones of sockets, but no system call is ever made.
+"""
+import socket
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado import stack_context
+
+
+class _Socket(object):
+    """Stands for the socket of a stream, only its address family."""
+
+    def __init__(self, family):
+        self.family = family
+
+
+class LoopbackStream(object):
+    """One end of an in-memory stream, see :func:`stream_pair`.
+
+    Writes are delivered to the read buffer of the peer at once, so
+    :meth:`writing` is always false.
+    """
+
+    read_chunk_size = 65536
+
+    def __init__(self, io_loop=None, family=socket.AF_INET):
+        self.io_loop = io_loop or IOLoop.current()
+        self.socket = _Socket(family)
+        self.peer = None
+        self.error = None
+        self._buffer = b''
+        self._closed = False
+        self._peer_closed = False
+        self._close_callback = None
+        self._read = None
+
+    def _run_callback(self, callback, *args):
+        self.io_loop.add_callback(callback, *args)
+
+    def _set_read(self, kind, argument, callback):
+        if self._closed:
+            raise StreamClosedError()
+        if self._read is not None:
+            raise RuntimeError('Already reading')
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+            future = None
+        else:
+            future = Future()
+        self._read = (kind, argument, callback, future)
+        self._try_read()
+        return future
+
+    def _try_read(self):
+        if self._read is None:
+            return
+        kind, argument, callback, future = self._read
+        buffer = self._buffer
+        size = None
+        if kind == 'bytes':
+            num_bytes, partial = argument
+            if len(buffer) >= num_bytes or (partial and buffer):
+                size = min(len(buffer), num_bytes)
+        elif kind == 'until':
+            i = buffer.find(argument)
+            if i >= 0:
+                size = i + len(argument)
+        elif self._peer_closed or self._closed:
+            size = len(buffer)
+        if size is None:
+            if self._peer_closed:
+                # The read can't be satisfied, like a socket closed by the peer
+                self.close()
+            return
+        self._read = None
+        data, self._buffer = buffer[:size], buffer[size:]
+        if future is not None:
+            future.set_result(data)
+        else:
+            self._run_callback(callback, data)
+        if kind == 'close':
+            self.close()
+
+    def read_bytes(self, num_bytes, callback=None, partial=False):
+        """Reads ``num_bytes`` bytes, or any bytes available up to
+        ``num_bytes`` when ``partial`` is true.
+        """
+        return self._set_read('bytes', (num_bytes, partial), callback)
+
+    def read_until(self, delimiter, callback=None):
+        """Reads until ``delimiter``, including it."""
+        return self._set_read('until', delimiter, callback)
+
+    def read_until_close(self, callback=None):
+        """Reads every byte until the stream is closed."""
+        return self._set_read('close', None, callback)
+
+    def reading(self):
+        """Returns whether a read is pending."""
+        return self._read is not None
+
+    def write(self, data, callback=None):
+        """Writes ``data`` to the peer."""
+        if self._closed:
+            raise StreamClosedError()
+        if data:
+            self.peer._receive(bytes(data))
+        if callback is not None:
+            self._run_callback(stack_context.wrap(callback))
+            return None
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def writing(self):
+        """Returns whether a write is pending, never."""
+        return False
+
+    def _receive(self, data):
+        if not self._closed:
+            self._buffer += data
+            self._try_read()
+
+    def set_close_callback(self, callback):
+        """Sets a callback to run when the stream is closed."""
+        self._close_callback = stack_context.wrap(callback)
+
+    def set_nodelay(self, value):
+        pass
+
+    def closed(self):
+        """Returns whether the stream is closed."""
+        return self._closed
+
+    def close(self, exc_info=False):
+        """Closes the stream, the peer sees it closed by the remote end."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._read is not None and self._read[0] == 'close':
+            self._try_read()
+        if self._read is not None:
+            future = self._read[3]
+            self._read = None
+            if future is not None:
+                future.set_exception(StreamClosedError())
+        if self._close_callback is not None:
+            callback, self._close_callback = self._close_callback, None
+            self._run_callback(callback)
+        if self.peer is not None:
+            self.peer._on_peer_close()
+
+    def _on_peer_close(self):
+        self._peer_closed = True
+        if self._read is not None:
+            self._try_read()
+        elif not self._buffer:
+            self.close()
+
+
+def stream_pair(io_loop=None, family=socket.AF_INET):
+    """Returns two connected :class:`LoopbackStream` instances."""
+    first = LoopbackStream(io_loop, family)
+    second = LoopbackStream(io_loop, family)
+    first.peer = second
+    second.peer = first
+    return first, second
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""Streaming parsing of MIME messages.
+
+Unlike :func:`email.message_from_string`, the parser in this module never
+builds the whole tree of the message: it finds the parts of the message as its
+bytes are fed, keeping only their headers and their offsets, and the payload
+of every part is decoded lazily, chunk by chunk:
+
+.. code-block:: python
+
+   for part in mime.iter_parts(raw_message):
+       if part.filename:
+           for chunk in part.iter_payload():
+               scan(chunk)
+"""
+import binascii
+import email.parser
+
+_CRLF = b'\r\n'
+_HEADERS_END = b'\r\n\r\n'
+_DELIMITER = b'\r\n--'
+
+
+class MIMEPart(object):
+    """A leaf part of a MIME message.
+
+    .. attribute:: path
+
+       Tuple with the index of the part on every level of the message, it's
+       empty for a message without parts.
+
+    .. attribute:: start
+    .. attribute:: end
+
+       Offsets of the encoded payload of the part on :attr:`source`.
+    """
+
+    def __init__(self, raw_headers, start, end, path, source=None):
+        self.raw_headers = raw_headers
+        self.start = start
+        self.end = end
+        self.path = path
+        self.source = source
+        self._headers = None
+
+    @property
+    def headers(self):
+        """An instance of :class:`email.message.Message` holding only the
+        headers of the part.
+        """
+        if self._headers is None:
+            self._headers = email.parser.HeaderParser().parsestr(
+                self.raw_headers.decode('utf-8', 'replace'), headersonly=True)
+        return self._headers
+
+    @property
+    def content_type(self):
+        """The lowercased content type of the part, e.g. ``text/plain``."""
+        return self.headers.get_content_type()
+
+    @property
+    def filename(self):
+        """The filename of the part, or ``None``."""
+        return self.headers.get_filename()
+
+    @property
+    def encoding(self):
+        """The lowercased content transfer encoding of the part."""
+        return self.headers.get('Content-Transfer-Encoding',
+                                '7bit').strip().lower()
+
+    @property
+    def size(self):
+        """The size of the encoded payload."""
+        return self.end - self.start
+
+    def iter_payload(self, chunk_size=65536, decode=True):
+        """Yields the payload of the part in chunks, decoded from base64 or
+        quoted-printable unless ``decode`` is false. Only a chunk is decoded
+        at a time.
+        """
+        view = memoryview(self.source)[self.start:self.end]
+        encoding = self.encoding if decode else None
+        if encoding == 'base64':
+            return _iter_base64(view, chunk_size)
+        elif encoding == 'quoted-printable':
+            return _iter_quoted_printable(view, chunk_size)
+        return _iter_chunks(view, chunk_size)
+
+    def read(self, decode=True):
+        """Returns the whole payload of the part."""
+        return b''.join(self.iter_payload(decode=decode))
+
+    def __repr__(self):
+        return '%s (path=%r, content_type=%r, size=%d)' % (
+            self.__class__.__name__, self.path, self.content_type, self.size)
+
+
+def _iter_chunks(view, chunk_size):
+    for i in range(0, len(view), chunk_size):
+        yield bytes(view[i:i + chunk_size])
+
+
+def _iter_base64(view, chunk_size):
+    carry = b''
+    for chunk in _iter_chunks(view, chunk_size):
+        chunk = carry + b''.join(chunk.split())
+        n = len(chunk) - len(chunk) % 4
+        carry = chunk[n:]
+        if n:
+            try:
+                yield binascii.a2b_base64(chunk[:n])
+            except binascii.Error:
+                pass
+    if carry.rstrip(b'='):
+        try:
+            yield binascii.a2b_base64(carry + b'=' * (-len(carry) % 4))
+        except binascii.Error:
+            pass
+
+
+def _iter_quoted_printable(view, chunk_size):
+    carry = b''
+    for chunk in _iter_chunks(view, chunk_size):
+        chunk = carry + chunk
+        i = chunk.rfind(b'\n') + 1
+        if not i:
+            # A long line, split it out of any '=XX' escape
+            i = len(chunk)
+            escape = chunk.find(b'=', i - 2)
+            if escape >= 0:
+                i = escape
+        carry = chunk[i:]
+        if i:
+            yield binascii.a2b_qp(chunk[:i])
+    if carry:
+        yield binascii.a2b_qp(carry)
+
+
+class MIMEParser(object):
+    """An incremental parser of MIME messages with ``<CR><LF>`` line endings.
+
+    Bytes are passed to :meth:`feed` as they are received, and every call
+    returns the list of :class:`MIMEPart` completed so far. The parser only
+    buffers the headers of the current part, or a few bytes of its payload
+    while looking for a boundary, so its memory use is independent of the size
+    of the message. The returned parts have no :attr:`~MIMEPart.source`, it
+    has to be set to the whole message before reading their payloads.
+
+    :arg int max_header_size: Maximum size of the headers of a part, longer
+        headers are truncated and the rest is considered payload.
+    """
+
+    HEADERS = 0
+    BODY = 1
+
+    def __init__(self, max_header_size=65536):
+        self.max_header_size = max_header_size
+        self.offset = 0
+        self._buffer = b''
+        self._state = self.HEADERS
+        self._boundaries = []
+        self._counters = []
+        self._current = None
+        self._closed = False
+
+    def feed(self, data):
+        """Parses ``data``, returning the list of completed parts."""
+        self._buffer += data
+        parts = []
+        self._parse(parts)
+        return parts
+
+    def close(self):
+        """Finishes the parsing, returning the list of completed parts."""
+        parts = []
+        self._closed = True
+        self._parse(parts)
+        end = self.offset + len(self._buffer)
+        if self._current is not None:
+            parts.append(self._end_part(end))
+        self.offset = end
+        self._buffer = b''
+        return parts
+
+    def _parse(self, parts):
+        while True:
+            if self._state == self.HEADERS:
+                if not self._parse_headers():
+                    break
+            elif not self._parse_body(parts):
+                break
+
+    def _consume(self, size):
+        self._buffer = self._buffer[size:]
+        self.offset += size
+
+    def _parse_headers(self):
+        buffer = self._buffer
+        if buffer.startswith(_CRLF):
+            self._start_part(b'', 2)
+            return True
+        i = buffer.find(_HEADERS_END)
+        if i < 0 and self._closed:
+            if buffer:
+                self._start_part(buffer, len(buffer))
+            return False
+        if i < 0:
+            if len(buffer) <= self.max_header_size:
+                return False
+            i = buffer.rfind(_CRLF, 0, self.max_header_size)
+            if i < 0:
+                i = self.max_header_size
+            self._start_part(buffer[:i], i)
+            return True
+        self._start_part(buffer[:i + 2], i + 4)
+        return True
+
+    def _start_part(self, raw_headers, body_start):
+        path = tuple(self._counters)
+        part = MIMEPart(raw_headers, self.offset + body_start, None, path)
+        headers = part.headers
+        boundary = None
+        if headers.get_content_maintype() == 'multipart':
+            boundary = headers.get_boundary()
+        if boundary:
+            self._boundaries.append(b'--' + boundary.encode('utf-8'))
+            self._counters.append(-1)
+            self._current = None
+        else:
+            self._current = part
+        # The <CR><LF> of the blank line may be part of the next delimiter
+        scan = max(body_start - 2, 0)
+        self._consume(scan)
+        self._state = self.BODY
+
+    def _end_part(self, end):
+        part = self._current
+        part.end = max(end, part.start)
+        self._current = None
+        return part
+
+    def _parse_body(self, parts):
+        buffer = self._buffer
+        if not self._boundaries:
+            self._consume(len(buffer))
+            return False
+        longest = max(len(b) for b in self._boundaries)
+        i = buffer.find(_DELIMITER)
+        while i >= 0:
+            if not self._closed and len(buffer) < i + 2 + longest + 2:
+                # Not enough bytes to compare with the boundaries
+                self._consume(i)
+                return False
+            match = self._match(buffer, i + 2)
+            if match is not None:
+                level, after, closing = match
+                if closing:
+                    line_end = after
+                else:
+                    line_end = buffer.find(_CRLF, after)
+                    if line_end < 0 and self._closed:
+                        line_end = len(buffer) - 2
+                    elif line_end < 0:
+                        if len(buffer) - after > self.max_header_size:
+                            # Not a delimiter line, ignore it
+                            i = buffer.find(_DELIMITER, i + 1)
+                            continue
+                        self._consume(i)
+                        return False
+                    if buffer[after:line_end].strip():
+                        i = buffer.find(_DELIMITER, i + 1)
+                        continue
+                if self._current is not None:
+                    parts.append(self._end_part(self.offset + i))
+                del self._boundaries[level + 1:]
+                del self._counters[level + 1:]
+                if closing:
+                    del self._boundaries[level]
+                    del self._counters[level]
+                    self._consume(line_end)
+                    return True
+                self._counters[level] += 1
+                self._consume(line_end + 2)
+                self._state = self.HEADERS
+                return True
+            i = buffer.find(_DELIMITER, i + 1)
+        # Keep the bytes that may start a delimiter
+        self._consume(max(len(buffer) - 3, 0))
+        return False
+
+    def _match(self, buffer, start):
+        for level in range(len(self._boundaries) - 1, -1, -1):
+            boundary = self._boundaries[level]
+            end = start + len(boundary)
+            if buffer[start:end] == boundary:
+                return level, end, buffer[end:end + 2] == b'--'
+        return None
+
+
+def iter_parts(source, chunk_size=65536):
+    """Yields the :class:`MIMEPart` instances of the message in ``source``, a
+    bytes-like object, parsing it in chunks of ``chunk_size`` bytes.
+    """
+    parser = MIMEParser()
+    view = memoryview(source)
+    for i in range(0, len(view), chunk_size):
+        for part in parser.feed(bytes(view[i:i + chunk_size])):
+            part.source = source
+            yield part
+    for part in parser.close():
+        part.source = source
+        yield part
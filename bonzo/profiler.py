@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""A sampling profiler of the IOLoop thread, for profiling running servers.
+
+While a :class:`SamplingProfiler` runs, a thread samples the stack of the
+IOLoop thread every ``interval`` seconds, labelled with the SMTP phase and
+the handler running, see :func:`bonzo.watchdog.describe`. After
+``duration`` seconds it stops and writes the samples as collapsed stacks,
+one line per stack with its count, the input of flame graph tools like
+``flamegraph.pl``::
+
+    phase:DATA;handler:Handler;start (ioloop.py:733);...;data (app.py:12) 41
+
+It's started with :meth:`SamplingProfiler.start`, or by a signal:
+
+.. code:: python
+
+    profiler = SamplingProfiler('/tmp/bonzo-%(pid)d-%(time)d.txt')
+    profiler.install(signal.SIGUSR2)
+
+Then ``kill -USR2 <pid>`` profiles the server for the next ``duration``
+seconds.
+"""
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.log import gen_log
+
+from bonzo.watchdog import describe
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+def collapse(frame):
+    """Returns the stack of ``frame`` as a collapsed stack, from the outermost
+    frame and prefixed by the SMTP phase and the handler running.
+    """
+    handler, phase = describe(frame)
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append('handler:%s' % (handler or '-'))
+    names.append('phase:%s' % (phase or '-'))
+    names.reverse()
+    return ';'.join(names)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of the IOLoop thread for ``duration`` seconds, every
+    ``interval`` seconds, and writes the collapsed stacks to ``path``.
+
+    :arg str path: Path of the output file, formatted with the ``pid`` of
+        the process and the ``time`` the profile started, as in
+        ``'bonzo-%(pid)d-%(time)d.txt'``.
+    """
+
+    def __init__(self, path='bonzo-%(pid)d-%(time)d.txt', duration=30,
+                 interval=0.01, io_loop=None):
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.io_loop = io_loop or IOLoop.current()
+        self._thread = None
+        self._future = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        """Whether the profiler is sampling."""
+        return self._future is not None
+
+    def start(self, duration=None):
+        """Starts sampling for ``duration`` seconds, :attr:`duration` by
+        default, it's called on the thread running the IOLoop. Returns a
+        :class:`~tornado.concurrent.Future` resolved with the path of the
+        output file once written. Calling it while running returns the
+        future of the running profile.
+        """
+        if self._future is not None:
+            return self._future
+        self._future = Future()
+        path = self.path % {'pid': os.getpid(), 'time': int(time.time())}
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.current_thread().ident, path,
+                  duration or self.duration))
+        self._thread.daemon = True
+        self._thread.start()
+        gen_log.info('Profiling the IOLoop to %s', path)
+        return self._future
+
+    def stop(self):
+        """Stops sampling before the end of the duration, the samples taken
+        are written."""
+        self._stopped.set()
+
+    def install(self, signum=signal.SIGUSR2):
+        """Starts the profiler when the process receives ``signum``."""
+        signal.signal(signum, lambda signum, frame:
+                      self.io_loop.add_callback_from_signal(self.start))
+
+    def _sample(self, thread_id, path, duration):
+        stacks = collections.Counter()
+        end = time.time() + duration
+        try:
+            while not self._stopped.wait(self.interval):
+                frame = sys._current_frames().get(thread_id)
+                if frame is None:
+                    break
+                stacks[collapse(frame)] += 1
+                del frame
+                if time.time() >= end:
+                    break
+            with open(path, 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write('%s %d\n' % (stack, count))
+        except Exception:
+            self.io_loop.add_callback(self._finish, None, sys.exc_info())
+        else:
+            self.io_loop.add_callback(self._finish, path, None)
+
+    def _finish(self, path, exc_info):
+        future, self._future = self._future, None
+        self._thread = None
+        if exc_info is not None:
+            gen_log.error('Profiling failed', exc_info=exc_info)
+            future.set_exc_info(exc_info)
+        else:
+            gen_log.info('Profile written to %s', path)
+            future.set_result(path)
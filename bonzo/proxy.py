@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Parsing of the PROXY protocol header sent by load balancers, like HAProxy,
+with the address of the client before the bytes of the client.
+
+Both the text format of version 1 and the binary format of version 2 are
+supported, see http://www.haproxy.org/download/1.8/doc/proxy-protocol.txt.
+:class:`~bonzo.server.SMTPServer` parses the header when created with
+``proxy_protocol``.
+"""
+import socket
+import struct
+
+V1_PREFIX = b'PROXY '
+V1_MAX_SIZE = 107
+"""Maximum size of a version 1 header, including the ``<CR><LF>``."""
+
+V2_SIGNATURE = b'\r\n\r\n\x00\r\nQUIT\n'
+_V2_HEADER = struct.Struct('!12sBBH')
+_V2_INET = struct.Struct('!4s4sHH')
+_V2_INET6 = struct.Struct('!16s16sHH')
+
+MAX_SIZE = 1024
+"""Maximum size of a header accepted, version 2 headers may carry additional
+information after the addresses."""
+
+
+class ProxyProtocolError(ValueError):
+    """Raised when the bytes received aren't a valid PROXY protocol
+    header."""
+
+
+def _parse_v1(data):
+    end = data.find(b'\r\n')
+    if end < 0:
+        if len(data) >= V1_MAX_SIZE:
+            raise ProxyProtocolError('Header too long')
+        return None
+    if end + 2 > V1_MAX_SIZE:
+        raise ProxyProtocolError('Header too long')
+    fields = data[:end].split(b' ')
+    if fields[1:2] == [b'UNKNOWN']:
+        return None, end + 2
+    if len(fields) != 6 or fields[1] not in (b'TCP4', b'TCP6'):
+        raise ProxyProtocolError('Invalid header: %r' % data[:end])
+    family = socket.AF_INET if fields[1] == b'TCP4' else socket.AF_INET6
+    try:
+        host = fields[2].decode('ascii')
+        socket.inet_pton(family, host)
+        port = int(fields[4])
+    except (ValueError, UnicodeDecodeError, socket.error):
+        raise ProxyProtocolError('Invalid address: %r' % data[:end])
+    if not 0 <= port <= 65535:
+        raise ProxyProtocolError('Invalid port: %d' % port)
+    return (host, port), end + 2
+
+
+def _parse_v2(data):
+    if len(data) < _V2_HEADER.size:
+        return None
+    _, version_command, family, length = _V2_HEADER.unpack_from(data)
+    size = _V2_HEADER.size + length
+    if version_command >> 4 != 2:
+        raise ProxyProtocolError('Unsupported version: %d' %
+                                 (version_command >> 4))
+    if size > MAX_SIZE:
+        raise ProxyProtocolError('Header too long')
+    if len(data) < size:
+        return None
+    command = version_command & 0x0f
+    if command == 0:
+        # LOCAL, e.g. health checks of the balancer
+        return None, size
+    if command != 1:
+        raise ProxyProtocolError('Unsupported command: %d' % command)
+    address_family = family >> 4
+    if address_family == 1 and length >= _V2_INET.size:
+        source, _, port, _ = _V2_INET.unpack_from(data, _V2_HEADER.size)
+        return (socket.inet_ntop(socket.AF_INET, source), port), size
+    if address_family == 2 and length >= _V2_INET6.size:
+        source, _, port, _ = _V2_INET6.unpack_from(data, _V2_HEADER.size)
+        return (socket.inet_ntop(socket.AF_INET6, source), port), size
+    # Unix sockets and unspecified families don't have a client address
+    return None, size
+
+
+def parse(data):
+    """Parses the PROXY protocol header at the start of ``data``.
+
+    Returns ``None`` when more bytes are needed, otherwise a tuple with the
+    ``(host, port)`` address of the client, or ``None`` when the balancer
+    doesn't tell it, and the size of the header. Raises
+    :class:`ProxyProtocolError` when ``data`` doesn't start with a valid
+    header.
+    """
+    if data.startswith(V2_SIGNATURE):
+        return _parse_v2(data)
+    if data.startswith(V1_PREFIX):
+        return _parse_v1(data)
+    size = min(len(data), len(V1_PREFIX))
+    if (V2_SIGNATURE.startswith(data[:len(V2_SIGNATURE)]) or
+            data[:size] == V1_PREFIX[:size]):
+        return None
+    raise ProxyProtocolError('Missing header')
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Replay of the sessions captured by :class:`~bonzo.capture.SessionRecorder`
+against an SMTP server, for load testing it with real traffic.
+
+Every session is opened at the time it was captured and sends its bytes with
+the captured timing, divided by ``speed``, or as fast as possible when
+``speed`` is ``0``. At most ``concurrency`` sessions are open at a time. From
+the command line::
+
+    python -m bonzo.replay sessions.bin --port 2525 --speed 10
+
+The latency of a reply is measured from the time its command, or the end of
+its message, was sent.
+"""
+import collections
+import datetime
+import optparse
+import sys
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+from bonzo.capture import read_sessions
+
+
+def _sleep(io_loop, seconds):
+    future = Future()
+    io_loop.add_timeout(io_loop.time() + seconds,
+                        lambda: future.set_result(None))
+    return future
+
+
+class ReplayResult(object):
+    """The outcome of :meth:`Replayer.run`.
+
+    .. attribute:: latencies
+
+       Seconds from sending every command until its reply was received.
+    """
+
+    def __init__(self):
+        self.sessions = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.replies = 0
+        self.latencies = []
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        """Seconds the replay lasted."""
+        return self.end - self.start
+
+    @property
+    def throughput(self):
+        """Sessions completed per second."""
+        return self.sessions / max(self.duration, 1e-9)
+
+    def percentile(self, percentile):
+        """Returns the ``percentile`` of the latencies."""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+    def summary(self):
+        """Returns the results as text."""
+        return ('%d sessions (%d errors) in %.2f s: %.1f sessions per second, '
+                '%.1f replies per second\nlatency: p50 %.2f ms, p99 %.2f ms, '
+                'max %.2f ms\n' % (
+                    self.sessions, self.errors, self.duration,
+                    self.throughput, self.replies / max(self.duration, 1e-9),
+                    self.percentile(50) * 1000, self.percentile(99) * 1000,
+                    self.percentile(100) * 1000))
+
+
+class _Client(object):
+    """A replayed session, reads the replies while its bytes are sent.
+
+    The command lines sent are followed, and the message of the ``DATA``
+    command skipped, to know the replies expected and when every one was
+    requested.
+    """
+
+    def __init__(self, stream, io_loop, result):
+        self.stream = stream
+        self.io_loop = io_loop
+        self.result = result
+        self.closed = False
+        self._greeted = False
+        self._line = b''
+        self._data = False
+        self._requests = collections.deque()
+        self._answered = None
+
+    @gen.coroutine
+    def send(self, data):
+        yield self.stream.write(data)
+        now = self.io_loop.time()
+        self.result.bytes_sent += len(data)
+        lines = (self._line + data).split(b'\r\n')
+        self._line = lines.pop()
+        for line in lines:
+            if self._data:
+                if line == b'.':
+                    self._data = False
+                    self._requests.append(now)
+            else:
+                self._data = line.upper() == b'DATA'
+                self._requests.append(now)
+
+    @gen.coroutine
+    def read(self):
+        try:
+            while True:
+                line = yield self.stream.read_until(b'\r\n')
+                # Multiline replies have a hyphen after the status code
+                if line[3:4] == b'-':
+                    continue
+                self.result.replies += 1
+                if not self._greeted:
+                    self._greeted = True
+                elif self._requests:
+                    sent = self._requests.popleft()
+                    self.result.latencies.append(self.io_loop.time() - sent)
+                    if not self._requests:
+                        self._set_answered()
+        except StreamClosedError:
+            pass
+        finally:
+            self.closed = True
+            self._set_answered()
+
+    def _set_answered(self):
+        if self._answered is not None:
+            future, self._answered = self._answered, None
+            future.set_result(None)
+
+    def answered(self):
+        """Returns a :class:`~tornado.concurrent.Future` resolved when every
+        command sent is answered, or the stream is closed.
+        """
+        future = Future()
+        if not self._requests or self.closed:
+            future.set_result(None)
+        else:
+            self._answered = future
+        return future
+
+
+class Replayer(object):
+    """Replays captured sessions on the streams returned by ``connect``.
+
+    :arg connect: Callable returning a stream connected to the server, or a
+        :class:`~tornado.concurrent.Future` resolved with it.
+    :arg float speed: Factor applied to the captured timing, ``0`` sends
+        everything as fast as possible.
+    :arg int concurrency: Maximum number of sessions open at a time.
+    :arg float linger: Seconds to wait for the replies to the last bytes of
+        a session.
+    """
+
+    def __init__(self, connect, speed=1.0, concurrency=100, linger=5,
+                 io_loop=None):
+        self.connect = connect
+        self.speed = speed
+        self.concurrency = concurrency
+        self.linger = linger
+        self.io_loop = io_loop or IOLoop.current()
+
+    @gen.coroutine
+    def _wait_until(self, start, offset):
+        if self.speed:
+            delay = start + offset / self.speed - self.io_loop.time()
+            if delay > 0:
+                yield _sleep(self.io_loop, delay)
+
+    @gen.coroutine
+    def run(self, sessions):
+        """Replays ``sessions``, a list of
+        :class:`~bonzo.capture.CapturedSession`, and returns a
+        :class:`~tornado.concurrent.Future` resolved with a
+        :class:`ReplayResult`.
+        """
+        result = ReplayResult()
+        result.start = self.io_loop.time()
+        pending = iter(sessions)
+        workers = min(self.concurrency, len(sessions))
+        yield [self._work(pending, result) for _ in range(workers)]
+        result.end = self.io_loop.time()
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _work(self, pending, result):
+        for session in pending:
+            yield self._wait_until(result.start, session.start)
+            yield self._replay(session, result)
+
+    @gen.coroutine
+    def _replay(self, session, result):
+        stream = None
+        try:
+            stream = yield gen.maybe_future(self.connect())
+            client = _Client(stream, self.io_loop, result)
+            reader = client.read()
+            start = self.io_loop.time()
+            for offset, data in session.events:
+                yield self._wait_until(start, offset)
+                yield client.send(data)
+            try:
+                yield gen.with_timeout(
+                    datetime.timedelta(seconds=self.linger),
+                    client.answered(), io_loop=self.io_loop)
+            except gen.TimeoutError:
+                result.errors += 1
+            stream.close()
+            yield reader
+            result.sessions += 1
+        except (IOError, StreamClosedError):
+            result.errors += 1
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+def replay(path, host='127.0.0.1', port=25, speed=1.0, concurrency=100,
+           linger=5):
+    """Replays the capture file in ``path`` against the server listening on
+    ``host`` and ``port``, and returns a :class:`ReplayResult`.
+    """
+    from tornado.tcpclient import TCPClient
+    client = TCPClient()
+    replayer = Replayer(lambda: client.connect(host, port), speed=speed,
+                        concurrency=concurrency, linger=linger)
+    sessions = read_sessions(path)
+    return IOLoop.current().run_sync(lambda: replayer.run(sessions))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] capture')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('-p', '--port', type='int', default=25)
+    parser.add_option('-s', '--speed', type='float', default=1.0,
+                      help='factor applied to the captured timing, 0 for as '
+                           'fast as possible')
+    parser.add_option('-c', '--concurrency', type='int', default=100,
+                      help='maximum number of concurrent sessions')
+    parser.add_option('--linger', type='float', default=5,
+                      help='seconds to wait for the last replies of a '
+                           'session')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('a capture file is required')
+    result = replay(args[0], options.host, options.port, options.speed,
+                    options.concurrency, options.linger)
+    sys.stdout.write(result.summary())
+
+
+if __name__ == '__main__':
+    main()
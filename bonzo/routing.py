@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Routing of recipient addresses to their targets."""
+import re
+
+
+class Router(object):
+    """Resolves recipient addresses to targets, usually
+    :class:`~bonzo.smtp.RequestHandler` subclasses.
+
+    Patterns can be:
+
+    - An address, e.g. ``'postmaster@example.com'``, matching only that
+      address.
+    - A domain, e.g. ``'example.com'``, matching the addresses of the domain.
+    - A wildcard domain, e.g. ``'*.example.com'``, matching the addresses of
+      any subdomain of the domain.
+    - A compiled regular expression, matched against the whole address when
+      no other pattern matches.
+
+    Addresses and domains are compared case-insensitively. The most specific
+    pattern wins: addresses first, then domains, then the deepest wildcard,
+    then the regular expressions in the order they were added. Domains are
+    kept in a trie indexed by their labels in reverse order, so resolving an
+    address takes a dictionary lookup per label.
+
+    :arg routes: An optional list of ``(pattern, target)`` tuples.
+    """
+
+    def __init__(self, routes=None):
+        self.addresses = {}
+        self.domains = {}
+        self.regexes = []
+        for pattern, target in routes or ():
+            self.add(pattern, target)
+
+    def add(self, pattern, target):
+        """Adds a route from ``pattern`` to ``target``."""
+        if hasattr(pattern, 'match'):
+            # Anchored at the end, so it has to match the whole address
+            pattern = re.compile(r'(?:%s)\Z' % pattern.pattern, pattern.flags)
+            self.regexes.append((pattern, target))
+        elif '@' in pattern:
+            self.addresses[pattern.lower()] = target
+        elif pattern.startswith('*.'):
+            self._node(pattern[2:])[1] = target
+        else:
+            self._node(pattern)[0] = target
+
+    def _node(self, domain):
+        # Every node is a list of [exact target, wildcard target, children].
+        node = [None, None, self.domains]
+        for label in reversed(domain.lower().split('.')):
+            children = node[2]
+            if label not in children:
+                children[label] = [None, None, {}]
+            node = children[label]
+        return node
+
+    def targets(self):
+        """Returns the list of the targets of every pattern."""
+        targets = list(self.addresses.values())
+        nodes = list(self.domains.values())
+        while nodes:
+            node = nodes.pop()
+            targets.extend(target for target in node[:2] if target is not None)
+            nodes.extend(node[2].values())
+        targets.extend(target for _, target in self.regexes)
+        return targets
+
+    def resolve(self, address, default=None):
+        """Returns the target of ``address``, or ``default`` when no pattern
+        matches it.
+        """
+        lowered = address.lower()
+        target = self.addresses.get(lowered)
+        if target is not None:
+            return target
+        domain = lowered.rpartition('@')[2]
+        labels = domain.split('.')
+        children = self.domains
+        node = None
+        wildcard = None
+        for i in range(len(labels) - 1, -1, -1):
+            node = children.get(labels[i])
+            if node is None:
+                break
+            if i and node[1] is not None:
+                wildcard = node[1]
+            children = node[2]
+        else:
+            if node is not None and node[0] is not None:
+                return node[0]
+        if wildcard is not None:
+            return wildcard
+        for regex, target in self.regexes:
+            if regex.match(address):
+                return target
+        return default
@@ -1,18 +1,36 @@
 # -*- coding: utf-8 -*-
 """A non-blocking, single-threaded SMTP server."""
-import email
 import functools
 import socket
+import struct
 import sys
 
+from tornado.concurrent import Future
 from tornado.escape import to_unicode, utf8
+from tornado.ioloop import IOLoop
 from tornado.log import app_log, gen_log
 from tornado.tcpserver import TCPServer
 from tornado import stack_context
 
+# The email package, and the modules only needed by optional features, are
+# imported on first use to keep the startup of the server fast.
 from bonzo import errors, version
+from bonzo.budget import MemoryBudget, RequestBudget
+from bonzo.stats import Histogram, TopCounter
 
 CRLF = '\r\n'
+_CRLF = b'\r\n'
+_END_OF_DATA = b'\r\n.\r\n'
+
+# Replies with a fixed text, encoded once
+_REPLY_WELCOME = utf8('220 Bonzo SMTP Server %s\r\n' % version)
+_REPLY_LMTP_WELCOME = utf8('220 Bonzo LMTP Server %s\r\n' % version)
+_REPLY_OK = b'250 Ok\r\n'
+_REPLY_BYE = b'221 Bye\r\n'
+_REPLY_DATA = b'354 End data with <CR><LF>.<CR><LF>\r\n'
+
+# The ucred structure of SO_PEERCRED
+_PEER_CREDENTIALS = struct.Struct('3i')
 
 
 class SMTPServer(TCPServer):
@@ -35,16 +53,278 @@ class SMTPServer(TCPServer):
         smtp_server = SMTPServer(handle_request)
         smtp_server.listen()
         IOLoop.current().start()
+
+    ``recipient_filter`` is an optional container, usually a
+    :class:`~bonzo.bloom.RecipientFilter`, used to screen the ``RCPT``
+    addresses: addresses not in it are rejected without calling the
+    ``validate_recipient`` method of the request callback.
+
+    ``greylist`` is an optional :class:`~bonzo.greylist.Greylist` checked for
+    every valid ``RCPT`` address.
+
+    ``filters`` is an optional :class:`~bonzo.filters.FilterChain` run on every
+    phase of the SMTP transactions, it defaults to the ``filters`` attribute
+    of the request callback when it exists.
+
+    ``memory_budget`` is an optional number of bytes shared by the messages
+    being received and the messages waiting for the request callback to finish
+    them. When it is exhausted the ``DATA`` command returns a ``452`` error
+    and the transfers in progress stop reading until memory is released. See
+    :class:`~bonzo.budget.MemoryBudget`.
+
+    ``max_pending_requests`` is an optional number of requests passed to the
+    request callback and not answered yet. When it's reached the connections
+    stop reading from their sockets, and hold their received messages, until
+    a request is answered, so slow handlers increase the latency instead of
+    the memory used. Every connection waits for the answer of its request
+    before reading the next command, so it has at most one pending request.
+    See :class:`~bonzo.budget.RequestBudget`.
+
+    ``max_line_length`` is the maximum length of a command line, including the
+    ``<CR><LF>``, longer lines are discarded with a ``500`` error.
+    ``max_recipients`` is the maximum number of recipients of a message,
+    additional ``RCPT`` commands return a ``452`` error.
+
+    When ``parse_mime`` is true, the MIME parts of the messages are found while
+    they are received, see :meth:`SMTPRequest.iter_parts`.
+
+    ``recorder`` is an optional :class:`~bonzo.capture.SessionRecorder`
+    writing the bytes received from the clients, to replay them with
+    :mod:`bonzo.replay`.
+
+    ``trusted_uids`` is an optional container of the user ids trusted to
+    submit mail through the Unix sockets of :meth:`listen_unix`. Their
+    connections skip the recipient filter, the greylist and the filters, see
+    :attr:`SMTPConnection.trusted`.
+
+    When ``lmtp`` is true the server speaks LMTP (:rfc:`2033`) instead of
+    SMTP: clients greet with ``LHLO``, and a message is answered with a reply
+    per recipient, see :meth:`SMTPRequest.finish_recipient`.
+
+    When ``proxy_protocol`` is true every connection must start with a PROXY
+    protocol header, sent by a load balancer like HAProxy, and the address of
+    the client in it is used instead of the address of the balancer. See
+    :mod:`bonzo.proxy`.
+
+    ``watchdog`` is an optional :class:`~bonzo.watchdog.LoopWatchdog` whose
+    measures are included in :meth:`get_stats`.
+
+    ``top_talkers`` is the number of client addresses whose connections and
+    messages are counted, see :class:`~bonzo.stats.TopCounter`.
+
+    For stopping the server without aborting transactions use :meth:`drain`,
+    and for restarting it without refusing connections use :meth:`reexec`.
     """
 
-    def __init__(self, request_callback, io_loop=None, **kwargs):
+    def __init__(self, request_callback, io_loop=None, recipient_filter=None,
+                 greylist=None, filters=None, memory_budget=None,
+                 max_pending_requests=None, max_line_length=512,
+                 max_recipients=100, parse_mime=False, recorder=None,
+                 trusted_uids=None, lmtp=False, proxy_protocol=False,
+                 watchdog=None, top_talkers=100, **kwargs):
         self.request_callback = request_callback
+        self.proxy_protocol = proxy_protocol
+        self.watchdog = watchdog
+        self.phases = {'connect': 0, 'command': 0, 'data': 0, 'handler': 0}
+        self.handler_latency = Histogram()
+        self.talkers = {
+            'connections': TopCounter(top_talkers),
+            'messages': TopCounter(top_talkers),
+        }
+        self.lmtp = lmtp
+        self.trusted_uids = trusted_uids
+        self.parse_mime = parse_mime
+        self.recorder = recorder
+        self.max_line_length = max_line_length
+        self.max_recipients = max_recipients
+        self.budget = None
+        if memory_budget is not None:
+            self.budget = MemoryBudget(memory_budget)
+        self.request_budget = None
+        if max_pending_requests is not None:
+            self.request_budget = RequestBudget(max_pending_requests)
+        self.recipient_filter = recipient_filter
+        self.greylist = greylist
+        if filters is None:
+            filters = getattr(request_callback, 'filters', None)
+        self.filters = filters
+        self._connections = set()
+        self._drain_future = None
+        self._drain_timeout = None
         TCPServer.__init__(self, io_loop=io_loop, **kwargs)
 
+    def listen(self, port, address=''):
+        """Starts accepting connections on the given port, like
+        :meth:`TCPServer.listen <tornado.tcpserver.TCPServer.listen>`. The
+        sockets listening on ``port`` passed to this process by
+        :meth:`reexec` are used when there are any.
+        """
+        from bonzo import handoff
+        sockets = handoff.inherited_sockets(port)
+        if sockets:
+            self.add_sockets(sockets)
+        else:
+            TCPServer.listen(self, port, address)
+
+    def listen_unix(self, path, mode=0o666, backlog=128):
+        """Starts accepting connections on a Unix socket bound to ``path``,
+        for the local clients. The socket passed to this process by
+        :meth:`reexec` for ``path`` is used when there is one.
+
+        The user of the clients is known by the credentials of the socket,
+        see :attr:`SMTPConnection.peer_credentials`, on systems supporting
+        them, like Linux.
+        """
+        from bonzo import handoff
+        sockets = handoff.inherited_sockets(path)
+        if not sockets:
+            from tornado.netutil import bind_unix_socket
+            sockets = [bind_unix_socket(path, mode, backlog)]
+        self.add_sockets(sockets)
+
     def handle_stream(self, stream, address):
         """Handles the stream by executing the request callback.
         """
-        SMTPConnection(stream, address, self.request_callback)
+        if self.proxy_protocol:
+            self._read_proxy_header(stream, address, b'')
+        else:
+            self._start_connection(stream, address, b'')
+
+    def _read_proxy_header(self, stream, address, data):
+        """Reads the PROXY protocol header, usually received at once, with
+        reads bounded by the maximum size of a header.
+        """
+        from bonzo import proxy
+        try:
+            result = proxy.parse(data)
+        except proxy.ProxyProtocolError as e:
+            gen_log.warning('Invalid PROXY protocol header from %s: %s',
+                            address[0] if address else address, e)
+            stream.close()
+            return
+        if result is not None:
+            client_address, size = result
+            if client_address is not None:
+                address = client_address
+            self._start_connection(stream, address, data[size:])
+        elif not stream.closed():
+            stream.read_bytes(proxy.MAX_SIZE - len(data),
+                              functools.partial(self._on_proxy_header, stream,
+                                                address, data),
+                              partial=True)
+
+    def _on_proxy_header(self, stream, address, data, chunk):
+        self._read_proxy_header(stream, address, data + chunk)
+
+    def _start_connection(self, stream, address, buffered):
+        connection = SMTPConnection(stream, address, self.request_callback,
+                                    recipient_filter=self.recipient_filter,
+                                    greylist=self.greylist,
+                                    filters=self.filters, budget=self.budget,
+                                    request_budget=self.request_budget,
+                                    max_line_length=self.max_line_length,
+                                    max_recipients=self.max_recipients,
+                                    parse_mime=self.parse_mime,
+                                    recorder=self.recorder,
+                                    trusted_uids=self.trusted_uids,
+                                    lmtp=self.lmtp, server=self,
+                                    buffered=buffered)
+        self.talkers['connections'].add(connection.remote_ip)
+        if not stream.closed():
+            self._connections.add(connection)
+            if self._drain_future is not None:
+                connection.drain()
+
+    def on_close(self, connection):
+        """Called by ``connection`` when it's closed."""
+        self._connections.discard(connection)
+        self._check_drained()
+
+    def drain(self, timeout=30):
+        """Stops accepting connections and closes the open ones once their
+        transactions are finished. Idle connections, and connections sending a
+        new command, are answered with a
+        :class:`~bonzo.errors.ServiceUnavailable` error. The connections still
+        open after ``timeout`` seconds are closed.
+
+        Returns a :class:`~tornado.concurrent.Future` resolved when every
+        connection is closed, when the process can exit.
+        """
+        if self._drain_future is None:
+            self._drain_future = Future()
+            self.stop()
+            io_loop = IOLoop.current()
+            self._drain_timeout = io_loop.add_timeout(io_loop.time() + timeout,
+                                                      self._on_drain_timeout)
+            for connection in list(self._connections):
+                connection.drain()
+            self._check_drained()
+        return self._drain_future
+
+    def _on_drain_timeout(self):
+        self._drain_timeout = None
+        for connection in list(self._connections):
+            connection.close()
+
+    def _check_drained(self):
+        future = self._drain_future
+        if future is None or self._connections or future.done():
+            return
+        if self._drain_timeout is not None:
+            IOLoop.current().remove_timeout(self._drain_timeout)
+            self._drain_timeout = None
+        future.set_result(None)
+
+    def reexec(self, argv=None, timeout=30):
+        """Starts a new process running ``argv``, the command line of this
+        process by default, passing it the listening sockets of the server,
+        and drains this server. The new process takes the sockets on
+        :meth:`listen`. Returns the :class:`~tornado.concurrent.Future` of
+        :meth:`drain`.
+        """
+        from bonzo import handoff
+        handoff.spawn(self._sockets.values(), argv)
+        return self.drain(timeout)
+
+    def get_stats(self):
+        """Returns a dictionary with the current statistics of the server.
+
+        Every value is kept up to date by the connections as they run, so
+        it's cheap enough to be called often, e.g. by :mod:`bonzo.admin`.
+        """
+        stats = {
+            'connections': dict(self.phases,
+                                total=sum(self.phases.values())),
+            'handlers': self.handler_latency.to_dict(),
+            'talkers': dict((name, counter.top())
+                            for name, counter in self.talkers.items()),
+        }
+        if self.filters is not None:
+            stats['filters'] = dict(
+                ('%s:%s' % key, histogram.to_dict())
+                for key, histogram in self.filters.latencies.items())
+        if self.budget is not None:
+            stats['memory'] = self.budget.to_dict()
+        if self.request_budget is not None:
+            stats['requests'] = self.request_budget.to_dict()
+        if self.watchdog is not None:
+            stats['loop'] = self.watchdog.to_dict()
+        return stats
+
+
+def _peer_credentials(sock):
+    """Returns the ``(pid, uid, gid)`` of the process connected to the Unix
+    socket ``sock``, or ``None`` when the system doesn't tell it.
+    """
+    option = getattr(socket, 'SO_PEERCRED', None)
+    if option is None or not hasattr(sock, 'getsockopt'):
+        return None
+    try:
+        value = sock.getsockopt(socket.SOL_SOCKET, option,
+                                _PEER_CREDENTIALS.size)
+    except socket.error:
+        return None
+    return _PEER_CREDENTIALS.unpack(value)
 
 
 class SMTPConnection(object):
@@ -52,6 +332,18 @@ class SMTPConnection(object):
 
     This class uses its :attr:`COMMAND` and :attr:`DATA` attributes as a
     simple "enum" to manage the connection state.
+
+    .. attribute:: peer_credentials
+
+       The ``(pid, uid, gid)`` of the client connected to a Unix socket, when
+       the system tells it, otherwise ``None``. The :attr:`remote_ip` of
+       these clients is then ``'unix:uid=<uid>'``, so the greylist and the
+       statistics tell the users apart, and ``'0.0.0.0'`` otherwise.
+
+    .. attribute:: trusted
+
+       Whether the client is trusted, because its user is one of the
+       ``trusted_uids`` of the server, or :meth:`trust` was called.
     """
 
     COMMAND = 0
@@ -59,26 +351,163 @@ class SMTPConnection(object):
     DATA = 1
     """Used to set the state to receive data."""
 
-    def __init__(self, stream, address, request_callback):
+    def __init__(self, stream, address, request_callback,
+                 recipient_filter=None, greylist=None, filters=None,
+                 budget=None, max_line_length=512, max_recipients=100,
+                 parse_mime=False, recorder=None, trusted_uids=None,
+                 lmtp=False, server=None, request_budget=None,
+                 buffered=b''):
         self.stream = stream
         self.address = address
         self.request_callback = request_callback
+        self.recipient_filter = recipient_filter
+        self.greylist = greylist
+        self.filters = filters
+        self.budget = budget
+        self.request_budget = request_budget
+        self._request_pending = False
+        self._handling = False
+        self.max_line_length = max_line_length
+        self.max_recipients = max_recipients
+        self.parse_mime = parse_mime
+        self.recorder = recorder
+        self.lmtp = lmtp
+        self.server = server
+        self.draining = False
+        self._phase = None
+        self._dispatched = None
         self.__hostname = None
+        self._greeted = False
+        self._buffer = b''
+        self._discarding = False
+        self._write_buffer = []
+        self._reading_commands = False
+        self._next_command = False
+        self._data_chunks = []
+        self._data_size = 0
+        self._data_pending = b''
+        self._data_line_start = True
+        self._mime_parser = None
+        self._mime_parts = []
+        self._session = None
+        if recorder is not None:
+            self._session = recorder.open()
+        if buffered:
+            # Bytes read from the stream before, like the commands received
+            # with the PROXY protocol header
+            self._record(buffered)
+            self._buffer = buffered
         self.reset_arguments()
+        self.peer_credentials = None
+        self.trusted = False
         if self.stream.socket.family in (socket.AF_INET, socket.AF_INET6):
             self.remote_ip = self.address[0]
         else:
-            # Unix (or other) socket; fake the remote address
-            self.remote_ip = '0.0.0.0'  # pragma: no cover
+            self.peer_credentials = _peer_credentials(self.stream.socket)
+            if self.peer_credentials is not None:
+                # Unix socket; the user of the client stands for its address
+                self.remote_ip = 'unix:uid=%d' % self.peer_credentials[1]
+            else:
+                # Unix (or other) socket; fake the remote address
+                self.remote_ip = '0.0.0.0'
+            if (trusted_uids is not None and
+                    self.peer_credentials is not None and
+                    self.peer_credentials[1] in trusted_uids):
+                self.trust()
         self._clear_request_state()
+        self._set_phase('connect')
         self._command_callback = stack_context.wrap(self._on_commands)
         self.stream.set_close_callback(self._on_connection_close)
-        self.write('220 Bonzo SMTP Server %s' % version)
+        self._run_filters('connect', (self,), self._greet)
+
+    def trust(self):
+        """Marks the client as trusted, its transactions skip the recipient
+        filter, the greylist and the filters of the server.
+        """
+        self.trusted = True
+        self.recipient_filter = None
+        self.greylist = None
+        self.filters = None
+
+    @property
+    def hostname(self):
+        """The hostname received by the ``HELO``, or ``LHLO``, command."""
+        return self.__hostname
+
+    @property
+    def mail(self):
+        """The address received by the ``MAIL`` command."""
+        return self.__mail
+
+    @property
+    def rcpt(self):
+        """The list of addresses accepted by the ``RCPT`` command."""
+        return self.__rcpt
+
+    def _greet(self):
+        self._greeted = True
+        self._set_phase('command')
+        self.write(_REPLY_LMTP_WELCOME if self.lmtp else _REPLY_WELCOME)
 
     def reset_arguments(self):
         self.__state = self.COMMAND
         self.__mail = None
         self.__rcpt = []
+        self.__rcpt_set = set()
+        self._request = None
+        self._handling = False
+        self._release_request()
+        self._reset_data()
+        if self._greeted:
+            self._set_phase('command')
+
+    def _set_phase(self, phase):
+        """Moves the connection to ``phase`` in the counters of the server,
+        closed connections aren't counted."""
+        if self.stream.closed():
+            phase = None
+        if phase != self._phase and self.server is not None:
+            phases = self.server.phases
+            if self._phase is not None:
+                phases[self._phase] -= 1
+            if phase is not None:
+                phases[phase] += 1
+        self._phase = phase
+
+    def _release_request(self):
+        """Accounts the request of the connection as answered in the request
+        budget and the handler latency of the server."""
+        if self._dispatched is not None:
+            if not self.stream.closed():
+                self.server.handler_latency.add(
+                    self.stream.io_loop.time() - self._dispatched)
+            self._dispatched = None
+        if self._request_pending:
+            self._request_pending = False
+            self.request_budget.release()
+
+    def _paused(self, callback):
+        """Returns whether reading from the socket must wait for the request
+        budget, in which case ``callback`` runs when a request is answered.
+        """
+        if self.request_budget is not None and self.request_budget.exhausted:
+            self.request_budget.wait(callback)
+            return True
+        return False
+
+    def _reset_data(self):
+        """Releases the bytes of the message accounted in the memory
+        budget."""
+        if self.budget is not None:
+            self.budget.end_read(self)
+            if self._data_size:
+                self.budget.release(self._data_size)
+        self._data_chunks = []
+        self._data_size = 0
+        self._data_pending = b''
+        self._data_line_start = True
+        self._mime_parser = None
+        self._mime_parts = []
 
     def _clear_request_state(self):
         """Clears the per-request state.
@@ -87,8 +516,15 @@ class SMTPConnection(object):
         to be garbage collected (and prevent spurious close callbacks),
         and when the connection is closed (to break up cycles and
         facilitate garbage collection in cpython).
+
+        A request passed to the handler keeps its slot in the request budget
+        and its bytes in the memory budget until it's answered, even when the
+        connection is closed before.
         """
-        self.reset_arguments()
+        if self._handling:
+            self._request = None
+        else:
+            self.reset_arguments()
         self._request_finished = False
         self._write_callback = None
         self._close_callback = None
@@ -105,6 +541,12 @@ class SMTPConnection(object):
             callback()
         # Delete any unfinished callbacks to break up reference cycles.
         self._clear_request_state()
+        self._set_phase(None)
+        if self._session is not None:
+            self.recorder.close_session(self._session)
+            self._session = None
+        if self.server is not None:
+            self.server.on_close(self)
 
     def close(self):
         """Close the stream.
@@ -115,21 +557,56 @@ class SMTPConnection(object):
         self._clear_request_state()
 
     def write(self, chunk, callback=None, read_until_delimiter=CRLF):
-        """Writes a chunk of output to the stream."""
+        """Writes a reply to the stream, ``chunk`` is a string without the
+        ``<CR><LF>``, or the bytes of the reply including it.
+
+        Pipelined commands already received are answered at once, in the
+        same IOLoop iteration, and their replies are sent with a single write.
+        """
+        if self.stream.closed():
+            return
+        if not isinstance(chunk, bytes):
+            chunk = utf8(chunk + CRLF)
+        self._write_buffer.append(chunk)
+        if callback is None and read_until_delimiter == CRLF:
+            if self._reading_commands and _CRLF in self._buffer:
+                self._next_command = True
+                return
+            callback = self._read_command
+        elif callback is None:
+            callback = functools.partial(self.stream.read_until,
+                                         utf8(read_until_delimiter),
+                                         self._on_delimited_read)
+        self._write_callback = stack_context.wrap(callback)
+        if not self._reading_commands:
+            self._flush()
+
+    def _write_partial(self, chunk):
+        """Writes the bytes of one of several replies to a command, the
+        connection keeps waiting for the last one.
+        """
         if not self.stream.closed():
-            if callback is None:
-                callback = functools.partial(self.stream.read_until,
-                                             utf8(read_until_delimiter),
-                                             self._on_commands)
-            self._write_callback = stack_context.wrap(callback)
-            self.stream.write(utf8(chunk + CRLF), self._on_write_complete)
+            self._write_buffer.append(chunk)
+            if not self._reading_commands:
+                self._flush()
+
+    def _flush(self):
+        """Writes the buffered replies to the stream."""
+        if not self._write_buffer or self.stream.closed():
+            return
+        if len(self._write_buffer) == 1:
+            data = self._write_buffer[0]
+        else:
+            data = b''.join(self._write_buffer)
+        self._write_buffer = []
+        self.stream.write(data, self._on_write_complete)
 
     def write_ok(self, message='Ok', callback=None, read_until_delimiter=CRLF):
         """Writes a successfully message to the output by sending a ``250``
         status code.
         """
-        self.write('%s %s' % (250, message), callback=callback,
-                   read_until_delimiter=read_until_delimiter)
+        self.write(_REPLY_OK if message == 'Ok' else '250 %s' % message,
+                   callback=callback, read_until_delimiter=read_until_delimiter)
 
     def finish(self):
         """Finishes the request."""
@@ -154,6 +631,147 @@ class SMTPConnection(object):
     def _finish_request(self):
         self.close()
 
+    def drain(self):
+        """Closes the connection with a
+        :class:`~bonzo.errors.ServiceUnavailable` error, right away when it's
+        waiting for a command, otherwise once the current command or message
+        is answered.
+        """
+        self.draining = True
+        if self.__state == self.COMMAND and self.stream.reading():
+            self._close_draining()
+
+    def _close_draining(self):
+        self.write(errors.wire(errors.ServiceUnavailable), self.finish)
+
+    def _read_command(self):
+        """Reads the next command line.
+
+        Lines longer than :attr:`max_line_length` are discarded as they are
+        received and answered with a :class:`~bonzo.errors.LineTooLong`
+        error, so the buffered bytes are bounded by the line length and the
+        read chunk size.
+        """
+        if self._reading_commands:
+            # Answering a pipelined command, it's run by the loop below
+            self._next_command = True
+            return
+        self._reading_commands = True
+        try:
+            self._next_command = True
+            while self._next_command:
+                self._next_command = False
+                self._read_next_command()
+        finally:
+            self._reading_commands = False
+            self._flush()
+
+    def _read_next_command(self):
+        if self.draining:
+            self._close_draining()
+            return
+        buffer = self._buffer
+        i = buffer.find(_CRLF)
+        if i >= 0:
+            self._buffer = buffer[i + 2:]
+            if self._discarding or i + 2 > self.max_line_length:
+                self._discarding = False
+                self.write(errors.wire(errors.LineTooLong))
+            else:
+                self._on_commands(buffer[:i + 2])
+            return
+        if len(buffer) > self.max_line_length:
+            # Keep the last byte, it may be the '\r' of the delimiter
+            self._buffer = buffer[-1:]
+            self._discarding = True
+        if not self.stream.closed() and not self._paused(self._read_command):
+            self.stream.read_bytes(self.stream.read_chunk_size,
+                                   self._on_command_chunk, partial=True)
+
+    def _record(self, chunk):
+        if self._session is not None:
+            self.recorder.record(self._session, chunk)
+
+    def _on_command_chunk(self, chunk):
+        self._record(chunk)
+        self._buffer += chunk
+        self._read_command()
+
+    def _on_delimited_read(self, line):
+        self._record(line)
+        self._on_commands(line)
+
+    def _read_data(self):
+        """Reads the next chunk of the message, unless the memory budget or
+        the request budget is exhausted, in which case reading is resumed when
+        memory is released or a request is answered.
+        """
+        if self.stream.closed() or self.__state != self.DATA:
+            return
+        if self.budget is not None and not self.budget.may_read(self):
+            self.budget.wait(self._read_data)
+        elif self._buffer:
+            chunk, self._buffer = self._buffer, b''
+            self._on_data_chunk(chunk)
+        elif not self._paused(self._read_data):
+            self.stream.read_bytes(self.stream.read_chunk_size,
+                                   self._on_data_read, partial=True)
+
+    def _on_data_read(self, chunk):
+        self._record(chunk)
+        self._on_data_chunk(chunk)
+
+    def _on_data_chunk(self, chunk):
+        self._data_size += len(chunk)
+        if self.budget is not None:
+            self.budget.acquire(len(chunk))
+        window = self._data_pending + chunk
+        if not self._data_chunks and window.startswith(b'.\r\n'):
+            # The message is empty
+            end, after = 0, 3
+        else:
+            end = window.find(_END_OF_DATA)
+            after = end + len(_END_OF_DATA)
+        if end < 0:
+            # Keep the bytes that may start the end of data sequence, and
+            # don't split a <CR><LF> that may be followed by a stuffed dot
+            end = max(len(window) - 4, 0)
+            if window[end - 1:end] == b'\r':
+                end -= 1
+            self._data_pending = window[end:]
+            self._add_data(window[:end])
+            self._read_data()
+            return
+        self._buffer = window[after:]
+        self._data_pending = b''
+        self._add_data(window[:end])
+        if self.budget is not None:
+            self.budget.end_read(self)
+        raw = b''.join(self._data_chunks)
+        self._data_chunks = []
+        try:
+            parts = None
+            if self._mime_parser is not None:
+                parts = self._mime_parts + self._mime_parser.close()
+                for part in parts:
+                    part.source = raw
+            self._on_data(raw, parts)
+        except Exception as e:
+            self._handle_request_exception(e)
+
+    def _add_data(self, segment):
+        """Adds a segment of the message, removing the dot stuffing."""
+        if not segment:
+            return
+        line_start = segment.endswith(_CRLF)
+        if self._data_line_start and segment[:1] == b'.':
+            segment = segment[1:]
+        segment = segment.replace(b'\r\n.', _CRLF)
+        self._data_line_start = line_start
+        self._data_chunks.append(segment)
+        if self._mime_parser is not None:
+            self._mime_parts.extend(self._mime_parser.feed(segment))
+
     def _on_commands(self, line):
         try:
             if self.__state == self.COMMAND:
@@ -171,20 +789,45 @@ class SMTPConnection(object):
                 if not method:
                     raise errors.NotImplementedCommand(command)
                 method(arg)
-            elif self.__state == self.DATA:
-                line = to_unicode(line)[:-5]  # Remove delimiter '\r\n.\r\n'
-                data = []
-                for text in line.split(CRLF):
-                    if text and text[0] == '.':
-                        data.append(text[1:])
-                    else:
-                        data.append(text)
-                self._on_data('\n'.join(data))
             else:
                 raise errors.InternalConfusion()
         except Exception as e:
             self._handle_request_exception(e)
 
+    def _wait_for(self, result, callback):
+        """Runs ``callback`` with ``result``, or with its value once resolved
+        when it is a :class:`~tornado.concurrent.Future`. Exceptions raised
+        while resolving it are handled as request errors.
+
+        Futures already resolved, like the cached recipient validations of
+        :class:`~bonzo.smtp.Application`, run ``callback`` right away, so
+        the reply is coalesced with the replies to the pipelined commands.
+        """
+        if isinstance(result, Future):
+            if result.done():
+                self._on_future_result(callback, result)
+                return
+            self.stream.io_loop.add_future(
+                result, functools.partial(self._on_future_result, callback))
+        else:
+            callback(result)
+
+    def _on_future_result(self, callback, future):
+        try:
+            callback(future.result())
+        except Exception as e:
+            self._handle_request_exception(e)
+
+    def _run_filters(self, phase, args, callback):
+        """Runs ``callback`` once the filters of ``phase`` accepted the
+        transaction.
+        """
+        if self.filters is None or not self.filters.has(phase):
+            callback()
+        else:
+            self._wait_for(self.filters.run(phase, *args),
+                           lambda result: callback())
+
     def _request_summary(self):
         return ''
 
@@ -201,9 +844,31 @@ class SMTPConnection(object):
 
     def _handle_request_exception(self, e):
         self.log_exception(*sys.exc_info())
+        if self.__state == self.DATA:
+            if self.lmtp:
+                # Every recipient not answered yet is answered with the error
+                request = self._request
+                if request is None:
+                    request = SMTPRequest(self, self.remote_ip, 'DATA',
+                                          rcpt=self.__rcpt)
+                request.fail(e)
+                return
+            # The transaction is aborted, wait for a new one
+            self.reset_arguments()
+        self.write_error(e)
+
+    def write_error(self, e):
+        """Writes the status code and message of ``e``, an instance of
+        :class:`~bonzo.errors.SMTPError`, to the output. Other exceptions are
+        written as a :class:`~bonzo.errors.InternalConfusion` error.
+        """
         if not isinstance(e, errors.SMTPError):
             e = errors.InternalConfusion()
-        self.write('%d %s' % (e.status_code, e.message))
+        if not self._greeted:
+            # Rejected before the welcome message, close the connection
+            self.write(e.wire, self.finish)
+        else:
+            self.write(e.wire)
 
     def __getaddr(self, keyword, arg):
         address = None
@@ -226,11 +891,37 @@ class SMTPConnection(object):
         - Raises a :class:`~bonzo.errors.BadSequence` when a ``HELO`` command
           already was received.
         """
+        if self.lmtp:
+            raise errors.NotImplementedCommand('HELO')
         if not arg:
             raise errors.BadArguments('HELO hostname')
         if self.__hostname:
             raise errors.BadSequence('Duplicate HELO/EHLO')
-        self.__hostname = arg
+        self._run_filters('helo', (self, arg),
+                          functools.partial(self._on_helo, arg))
+
+    def command_lhlo(self, arg):
+        """Handles the ``LHLO`` LMTP command, the ``HELO`` command of LMTP
+        servers.
+
+        - Raises a :class:`~bonzo.errors.NotImplementedCommand` when the
+          server doesn't speak LMTP.
+        - Raises a :class:`~bonzo.errors.BadArguments` error code when the
+          network name of the connecting machine is not received.
+        - Raises a :class:`~bonzo.errors.BadSequence` when a ``LHLO`` command
+          already was received.
+        """
+        if not self.lmtp:
+            raise errors.NotImplementedCommand('LHLO')
+        if not arg:
+            raise errors.BadArguments('LHLO hostname')
+        if self.__hostname:
+            raise errors.BadSequence('Duplicate LHLO')
+        self._run_filters('helo', (self, arg),
+                          functools.partial(self._on_helo, arg))
+
+    def _on_helo(self, hostname):
+        self.__hostname = hostname
         self.write('250 Hello %s' % self.remote_ip)
 
     def command_noop(self, arg):
@@ -246,7 +937,7 @@ class SMTPConnection(object):
     def command_quit(self, arg):
         """Handles the ``QUIT`` SMTP command.
         """
-        self.write('221 Bye', self.finish)
+        self.write(_REPLY_BYE, self.finish)
 
     def command_mail(self, arg):
         """Handles the ``MAIL`` SMTP command.
@@ -259,12 +950,17 @@ class SMTPConnection(object):
           already was received.
         """
         if not self.__hostname:
-            raise errors.BadSequence('Error: need HELO command')
+            raise errors.BadSequence('Error: need %s command' %
+                                     ('LHLO' if self.lmtp else 'HELO'))
         address = self.__getaddr('FROM:', arg) if arg else None
         if not address:
             raise errors.BadArguments('MAIL FROM:<address>')
         if self.__mail:
             raise errors.BadSequence('Error: nested MAIL command')
+        self._run_filters('mail', (self, address),
+                          functools.partial(self._on_mail, address))
+
+    def _on_mail(self, address):
         self.__mail = address
         self.write_ok()
 
@@ -275,13 +971,56 @@ class SMTPConnection(object):
           was not previously received.
         - Raises a :class:`~bonzo.errors.BadArguments` when the ``to`` address
           is not received.
+        - Raises a :class:`~bonzo.errors.MailboxUnavailable` when the address
+          is not in the recipient filter, or when the request callback has a
+          ``validate_recipient`` method and it rejects the address. The method
+          may return a :class:`~tornado.concurrent.Future`, in which case the
+          reply is delayed until it is resolved.
+        - Raises a :class:`~bonzo.errors.Greylisted` error when the triplet of
+          client, sender and recipient is rejected by the greylist.
+        - Raises a :class:`~bonzo.errors.TooManyRecipients` error when
+          :attr:`max_recipients` addresses were already received.
+
+        Duplicated addresses are accepted but only added once. On LMTP servers
+        they are rejected with a :class:`~bonzo.errors.BadSequence` error
+        instead, as every accepted recipient is answered after the message.
         """
         if not self.__mail:
             raise errors.BadSequence('Error: need MAIL command')
         address = self.__getaddr('TO:', arg) if arg else None
         if not address:
             raise errors.BadArguments('RCPT TO:<address>')
-        self.__rcpt.append(address)
+        if address in self.__rcpt_set:
+            if self.lmtp:
+                raise errors.BadSequence('Duplicate recipient')
+            self.write_ok()
+            return
+        if len(self.__rcpt) >= self.max_recipients:
+            raise errors.TooManyRecipients()
+        if (self.recipient_filter is not None and
+                address not in self.recipient_filter):
+            raise errors.MailboxUnavailable()
+        self._run_filters('rcpt', (self, address),
+                          functools.partial(self._validate_recipient, address))
+
+    def _validate_recipient(self, address):
+        validate = getattr(self.request_callback, 'validate_recipient', None)
+        if validate is None:
+            self._on_recipient_validated(address, True)
+        else:
+            self._wait_for(validate(address),
+                           functools.partial(self._on_recipient_validated,
+                                             address))
+
+    def _on_recipient_validated(self, address, valid):
+        if not valid:
+            raise errors.MailboxUnavailable()
+        if (self.greylist is not None and
+                not self.greylist.check(self.remote_ip, self.__mail, address)):
+            raise errors.Greylisted()
+        if address not in self.__rcpt_set:
+            self.__rcpt.append(address)
+            self.__rcpt_set.add(address)
         self.write_ok()
 
     def command_rset(self, arg):
@@ -302,36 +1041,118 @@ class SMTPConnection(object):
           was not previously received.
         - Raises a :class:`~bonzo.errors.BadArguments` when an argument is not
           received.
+        - Raises a :class:`~bonzo.errors.InsufficientStorage` when the memory
+          budget of the server is exhausted.
         """
         if not self.__rcpt:
             raise errors.BadSequence('Error: need RCPT command')
         if arg:
             raise errors.BadArguments('DATA')
+        if self.budget is not None and self.budget.exhausted:
+            raise errors.InsufficientStorage()
         self.__state = self.DATA
-        self.write('354 End data with <CR><LF>.<CR><LF>',
-                   read_until_delimiter='{0}.{0}'.format(CRLF))
+        self._set_phase('data')
+        if self.parse_mime:
+            from bonzo import mime
+            self._mime_parser = mime.MIMEParser()
+        self.write(_REPLY_DATA, self._read_data)
 
-    def _on_data(self, data):
-        self.__data = data
+    def _on_data(self, raw, parts=None):
         request = SMTPRequest(self, self.remote_ip, 'DATA',
                               hostname=self.__hostname, mail=self.__mail,
-                              rcpt=self.__rcpt, data=self.__data)
+                              rcpt=self.__rcpt, raw=raw, parts=parts)
+        self._request = request
+        if self.filters is not None and self.filters.has('headers'):
+            import email.parser
+            # Only the header block is decoded, not the whole message
+            end = raw.find(b'\r\n\r\n')
+            head = raw if end < 0 else raw[:end + 2]
+            headers = email.parser.HeaderParser().parsestr(
+                to_unicode(head).replace(CRLF, '\n'), headersonly=True)
+            self._run_filters('headers', (self, headers),
+                              functools.partial(self._on_headers, request))
+        else:
+            self._on_headers(request)
+
+    def _on_headers(self, request):
+        self._run_filters('body', (self, request.data),
+                          functools.partial(self._on_body, request))
+
+    def _on_body(self, request):
+        if self.request_budget is not None:
+            if self.stream.closed():
+                return
+            if self._paused(functools.partial(self._on_body, request)):
+                return
+            self._request_pending = True
+            self.request_budget.acquire()
+        if self.server is not None:
+            self._set_phase('handler')
+            self._dispatched = self.stream.io_loop.time()
+            self.server.talkers['messages'].add(self.remote_ip)
+        self._handling = True
         self.request_callback(request)
 
 
 class SMTPRequest(object):
     """A single SMTP request.
+
+    On LMTP servers every recipient is answered on its own, with
+    :meth:`finish_recipient` or :meth:`fail_recipient`, and :meth:`finish`
+    and :meth:`fail` answer the recipients not answered yet. The replies are
+    written in the order of :attr:`rcpt`.
     """
 
     def __init__(self, connection, remote_ip, command, hostname=None, mail=None,
-                 rcpt=None, data=None):
+                 rcpt=None, data=None, raw=None, parts=None):
         self.connection = connection
         self.remote_ip = remote_ip
         self.command = command
         self.hostname = hostname
         self.mail = mail
         self.rcpt = rcpt or []
-        self.data = data
+        self.raw = raw
+        self._data = data
+        self._parts = parts
+        self.parent = None
+        self._pending_parts = 0
+        self._replies = {}
+        self._next_reply = 0
+
+    @property
+    def data(self):
+        """The received message as a string with ``\\n`` line endings,
+        decoded on first access from :attr:`raw`, the received bytes with
+        ``<CR><LF>`` line endings.
+        """
+        if self._data is None and self.raw is not None:
+            self._data = to_unicode(self.raw).replace(CRLF, '\n')
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def size(self):
+        """The size in bytes of the received message."""
+        if self.raw is not None:
+            return len(self.raw)
+        return len(self._data or '')
+
+    def iter_parts(self, chunk_size=65536):
+        """Returns an iterator of the leaf parts of the message, as
+        :class:`~bonzo.mime.MIMEPart` instances, without building the tree of
+        the message. When the server was created with ``parse_mime`` the parts
+        were already found while the message was received.
+        """
+        if self._parts is not None:
+            return iter(self._parts)
+        raw = self.raw
+        if raw is None:
+            raw = utf8((self.data or '').replace('\n', CRLF))
+        from bonzo import mime
+        return mime.iter_parts(raw, chunk_size)
 
     @property
     def message(self):
@@ -339,15 +1160,123 @@ class SMTPRequest(object):
         :class:`email.mime.base.MIMEBase` class. It's actually parsed from the
         data received using the :meth:`~email.message_from_string` method.
         """
+        if self.parent is not None:
+            return self.parent.message
         if not hasattr(self, '_message'):
+            import email
             self._message = email.message_from_string(self.data)
         return self._message
 
+    def split(self, rcpt_groups):
+        """Returns a request for every list of recipients in ``rcpt_groups``,
+        sharing the data of this request. The connection is answered once
+        every returned request is finished.
+        """
+        self._pending_parts = len(rcpt_groups)
+        parts = []
+        for rcpt in rcpt_groups:
+            part = self.__class__(self.connection, self.remote_ip,
+                                  self.command, hostname=self.hostname,
+                                  mail=self.mail, rcpt=rcpt, data=self._data,
+                                  raw=self.raw, parts=self._parts)
+            part.parent = self
+            parts.append(part)
+        return parts
+
+    def abort_parts(self):
+        """Stops waiting for the requests returned by :meth:`split`, their
+        :meth:`finish` method no longer writes to the connection. Used when
+        the connection was already answered with an error.
+        """
+        self._pending_parts = -1
+
+    @property
+    def lmtp(self):
+        """Whether the request was received by an LMTP server."""
+        return getattr(self.connection, 'lmtp', False)
+
+    def finish_recipient(self, address):
+        """Answers ``address``, one of the recipients of a request received
+        by an LMTP server, with a successfully message.
+        """
+        self._answer(address, None)
+
+    def fail_recipient(self, address, error):
+        """Answers ``address``, one of the recipients of a request received
+        by an LMTP server, with the reply of ``error``, see
+        :meth:`SMTPConnection.write_error`.
+        """
+        self._answer(address, error)
+
+    def _answer(self, address, error):
+        if not self.lmtp:
+            raise RuntimeError('Recipients are answered on their own only '
+                               'by LMTP servers')
+        if address not in self.rcpt:
+            raise ValueError('Unknown recipient: %s' % address)
+        root = self.parent if self.parent is not None else self
+        if address in root._replies:
+            raise RuntimeError('Recipient already answered: %s' % address)
+        if error is None:
+            reply = _REPLY_OK
+        elif isinstance(error, errors.SMTPError):
+            reply = error.wire
+        else:
+            reply = errors.wire(errors.InternalConfusion)
+        root._replies[address] = reply
+        root._write_replies()
+
+    def _write_replies(self):
+        connection = self.connection
+        while (self._next_reply < len(self.rcpt) and
+               self.rcpt[self._next_reply] in self._replies):
+            reply = self._replies[self.rcpt[self._next_reply]]
+            self._next_reply += 1
+            if self._next_reply < len(self.rcpt):
+                connection._write_partial(reply)
+            else:
+                connection.reset_arguments()
+                connection.write(reply)
+
+    def _pending_rcpt(self):
+        root = self.parent if self.parent is not None else self
+        return [address for address in self.rcpt
+                if address not in root._replies]
+
     def finish(self):
         """Writes to the connection a successfully message."""
+        if self.lmtp:
+            for address in self._pending_rcpt():
+                self.finish_recipient(address)
+            return
+        if self.parent is not None:
+            self.parent._finish_part()
+            return
         self.connection.reset_arguments()
         self.connection.write_ok()
 
+    def fail(self, error):
+        """Writes to the connection the error reply of ``error``, see
+        :meth:`SMTPConnection.write_error`.
+        """
+        if self.lmtp:
+            for address in self._pending_rcpt():
+                self.fail_recipient(address, error)
+            return
+        if self.parent is not None:
+            if self.parent._pending_parts > 0:
+                self.parent.abort_parts()
+                self.parent.fail(error)
+            return
+        self.connection.reset_arguments()
+        self.connection.write_error(error)
+
+    def _finish_part(self):
+        if self._pending_parts > 0:
+            self._pending_parts -= 1
+            if not self._pending_parts:
+                self.finish()
+
     def __repr__(self):
         attrs = ('remote_ip', 'hostname', 'mail', 'rcpt')
         args = ', '.join(["%s='%s'" % (n, getattr(self, n)) for n in attrs])
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 """Tools for handling requests with asynchronous features."""
 import functools
+import sys
 
 from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from bonzo.cache import LookupCache
+from bonzo.filters import FilterChain
+from bonzo.routing import Router
 
 
 class RequestHandler(object):
@@ -22,6 +28,19 @@ class RequestHandler(object):
         <Application.settings>`."""
         return self.application.settings
 
+    @classmethod
+    def validate_recipient(cls, application, address):
+        """Called when a ``RCPT`` command is received, before any handler is
+        instanced.
+
+        Override this method to reject unknown recipients with a ``550``
+        status code before the message is transferred. It should return a
+        true value for valid addresses, or a
+        :class:`~tornado.concurrent.Future` resolving to it. Results are cached
+        by the :class:`Application`, see :meth:`Application.validate_recipient`.
+        """
+        return True
+
     def data(self):
         pass
 
@@ -65,7 +84,6 @@ class RequestHandler(object):
                     raise ValueError('Expected None, got %r' % result.result())
                 callback()
             else:
-                from tornado.ioloop import IOLoop
                 IOLoop.current().add_future(
                     result, functools.partial(self._when_complete,
                                               callback=callback))
@@ -85,6 +103,40 @@ class RequestHandler(object):
         if self._auto_finish and not self._finished:
             self.finish()
 
+    def finish_recipient(self, address):
+        """Answers ``address`` with a successfully message, before the rest of
+        the recipients. Only for requests received by an LMTP server, where
+        every recipient succeeds or fails on its own, e.g. while delivering
+        the message to their mailboxes in parallel:
+
+        .. code-block:: python
+
+           class Handler(smtp.RequestHandler):
+
+               @gen.coroutine
+               def data(self):
+                   yield [self.deliver(rcpt) for rcpt in self.request.rcpt]
+
+               @gen.coroutine
+               def deliver(self, address):
+                   try:
+                       yield store_in_mailbox(address, self.request.raw)
+                   except MailboxFull:
+                       self.fail_recipient(address,
+                                           errors.InsufficientStorage())
+                   else:
+                       self.finish_recipient(address)
+
+        The recipients not answered yet are answered by :meth:`finish`.
+        """
+        self.request.finish_recipient(address)
+
+    def fail_recipient(self, address, error):
+        """Answers ``address`` with ``error``, an instance of
+        :class:`~bonzo.errors.SMTPError`, see :meth:`finish_recipient`.
+        """
+        self.request.fail_recipient(address, error)
+
     def finish(self):
         """Finishes this response, ending the SMTP request."""
         if self._finished:
@@ -97,6 +149,151 @@ class RequestHandler(object):
         self.on_finish()
 
 
+class BatchRequestHandler(object):
+    """Subclass this class and define :meth:`data_batch()` to make a handler
+    receiving the requests in batches.
+
+    The :class:`Application` collects the requests of every connection for
+    this handler and calls :meth:`data_batch` once with all of them. A batch
+    is delivered when it reaches the ``batch_max_count`` requests or the
+    ``batch_max_bytes`` bytes of data, or ``batch_max_wait`` seconds after
+    its first request was received, whichever happens first. Clients are
+    answered when their batch is completed: with a ``250`` status code,
+    or with the error raised by :meth:`data_batch`, or with the error given to
+    :meth:`reject` for their request.
+    """
+
+    def __init__(self, application, requests):
+        self.application = application
+        self.requests = requests
+        self._errors = {}
+
+    @property
+    def settings(self):
+        """An alias for :attr:`self.application.settings
+        <Application.settings>`."""
+        return self.application.settings
+
+    @classmethod
+    def validate_recipient(cls, application, address):
+        """See :meth:`RequestHandler.validate_recipient`."""
+        return True
+
+    def data_batch(self, requests):
+        """Called with the list of :class:`~bonzo.server.SMTPRequest` of the
+        batch. May return a :class:`~tornado.concurrent.Future`.
+        """
+        pass
+
+    def reject(self, request, error):
+        """Answers ``request`` with ``error``, an instance of
+        :class:`~bonzo.errors.SMTPError`, when the batch is completed.
+        """
+        self._errors[id(request)] = error
+
+    def on_finish(self):
+        """Called after the requests of the batch were answered."""
+        pass
+
+    def _execute(self):
+        try:
+            result = self.data_batch(self.requests)
+            if result is not None and not isinstance(result, Future):
+                raise ValueError("Expected Future or None, got %r" % result)
+        except Exception as e:
+            self._log_exception()
+            self._finish(e)
+            return
+        if result is None:
+            self._finish()
+        else:
+            IOLoop.current().add_future(result, self._on_result)
+
+    def _on_result(self, future):
+        try:
+            future.result()
+        except Exception as e:
+            self._log_exception()
+            self._finish(e)
+        else:
+            self._finish()
+
+    def _log_exception(self):
+        self.requests[0].connection.log_exception(*sys.exc_info())
+
+    def _finish(self, error=None):
+        for request in self.requests:
+            request_error = error or self._errors.get(id(request))
+            if request_error is None:
+                request.finish()
+            else:
+                request.fail(request_error)
+        self.on_finish()
+
+
+class WorkerRequestHandler(object):
+    """Subclass this class and define :meth:`process()` to make a handler
+    running on worker processes.
+
+    The :class:`Application` passes the requests for this handler to its
+    :attr:`~Application.worker_pool`, a :class:`~bonzo.workers.WorkerPool`
+    created with the ``worker_processes``, ``worker_spool_path`` and
+    ``worker_shared_memory`` settings. The class must be defined at the top
+    level of a module, so the workers can import it.
+    """
+
+    @classmethod
+    def validate_recipient(cls, application, address):
+        """See :meth:`RequestHandler.validate_recipient`, it runs on the
+        IOLoop process."""
+        return True
+
+    @classmethod
+    def process(cls, message):
+        """Called on a worker process with a
+        :class:`~bonzo.workers.WorkerMessage`. The request is answered with
+        a successfully message when it returns, or with the
+        :class:`~bonzo.errors.SMTPError` it raises.
+        """
+        pass
+
+
+class _RequestBatcher(object):
+    """Collects the requests for a :class:`BatchRequestHandler`."""
+
+    def __init__(self, application, handler_class):
+        self.application = application
+        self.handler_class = handler_class
+        settings = application.settings
+        self.max_count = settings.get('batch_max_count', 100)
+        self.max_bytes = settings.get('batch_max_bytes', 16 * 1024 * 1024)
+        self.max_wait = settings.get('batch_max_wait', 0.1)
+        self._requests = []
+        self._bytes = 0
+        self._timeout = None
+
+    def add(self, request):
+        self._requests.append(request)
+        self._bytes += request.size
+        if (len(self._requests) >= self.max_count or
+                self._bytes >= self.max_bytes):
+            self.flush()
+        elif self._timeout is None:
+            self._timeout = IOLoop.current().add_timeout(
+                IOLoop.current().time() + self.max_wait, self.flush)
+
+    def flush(self):
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if not self._requests:
+            return
+        requests = self._requests
+        self._requests = []
+        self._bytes = 0
+        self.handler_class(self.application, requests)._execute()
+
+
 class Application(object):
     """Instances of this class are callable and can be passed directly to
     SMTPServer to handle messages:
@@ -118,10 +315,39 @@ class Application(object):
          :class:`RequestHandler`). Some applications also like to use the
          ``settings`` dictionary as a way to make application-specific settings
          available to handlers without using global variables.
+
+    Recipients can be dispatched to different handlers by passing a list of
+    ``(pattern, handler_class)`` tuples as ``routes``, see
+    :class:`~bonzo.routing.Router` for the supported patterns. Recipients not
+    matching any route are handled by ``handler_class``, or rejected when it is
+    ``None``. Messages for recipients of several handlers are split into a
+    request per handler, each one with its own recipients:
+
+    .. code-block:: python
+
+       application = smtp.Application(DefaultHandler, routes=[
+           ('example.com', ExampleHandler),
+           ('*.example.org', TenantHandler)])
+
+    The ``filters`` setting is an optional list of
+    :class:`~bonzo.filters.Filter` instances run in order on every phase of
+    the SMTP transactions, see :mod:`bonzo.filters`.
+
+    Requests for subclasses of :class:`BatchRequestHandler` are batched using
+    the ``batch_max_count``, ``batch_max_bytes`` and ``batch_max_wait``
+    settings.
+
+    Requests for subclasses of :class:`WorkerRequestHandler` are processed
+    by worker processes, see :attr:`worker_pool`.
+
+    The results of :meth:`RequestHandler.validate_recipient` are cached using
+    the ``recipient_cache_size``, ``recipient_cache_ttl`` and
+    ``recipient_negative_cache_ttl`` settings.
     """
 
-    def __init__(self, handler_class, **settings):
+    def __init__(self, handler_class=None, routes=None, **settings):
         self.handler_class = handler_class
+        self.router = Router(routes)
         self.settings = settings
         if self.settings.get('debug'):
             self.settings.setdefault('autoreload', True)
@@ -131,12 +357,131 @@ class Application(object):
             from tornado import autoreload
             autoreload.start()
 
+        self._batchers = {}
+        self._worker_pool = None
+
+        filters = self.settings.get('filters')
+        self.filters = FilterChain(filters) if filters else None
+
+        self.recipient_cache = LookupCache(
+            self._validate_recipient,
+            maxsize=self.settings.get('recipient_cache_size', 1024),
+            ttl=self.settings.get('recipient_cache_ttl', 300),
+            negative_ttl=self.settings.get('recipient_negative_cache_ttl'))
+
     def __call__(self, request):
         """Called by :class:`~bonzo.server.SMTPServer` to execute the
         request.
         """
-        handler = self.handler_class(self, request)
-        handler._execute()
+        groups = []
+        handler_classes = {}
+        for address in request.rcpt:
+            handler_class = self.find_handler(address)
+            if handler_class not in handler_classes:
+                handler_classes[handler_class] = len(groups)
+                groups.append((handler_class, []))
+            groups[handler_classes[handler_class]][1].append(address)
+        if len(groups) == 1:
+            self._execute(groups[0][0], request)
+            return
+        parts = request.split([rcpt for _, rcpt in groups])
+        try:
+            for (handler_class, _), part in zip(groups, parts):
+                self._execute(handler_class, part)
+        except Exception:
+            request.abort_parts()
+            raise
+
+    def _execute(self, handler_class, request):
+        if issubclass(handler_class, BatchRequestHandler):
+            batcher = self._batchers.get(handler_class)
+            if batcher is None:
+                batcher = self._batchers[handler_class] = _RequestBatcher(
+                    self, handler_class)
+            batcher.add(request)
+        elif issubclass(handler_class, WorkerRequestHandler):
+            future = self.worker_pool.submit(handler_class.process, request)
+            IOLoop.current().add_future(
+                future, functools.partial(self._on_worker_result, request))
+        else:
+            handler_class(self, request)._execute()
+
+    def _on_worker_result(self, request, future):
+        error = future.result()
+        if error is None:
+            request.finish()
+        else:
+            request.fail(error)
+
+    @property
+    def worker_pool(self):
+        """The :class:`~bonzo.workers.WorkerPool` of the subclasses of
+        :class:`WorkerRequestHandler`, with ``worker_processes`` processes,
+        the number of CPUs by default.
+
+        It's created by :meth:`listen` when a handler is one of them, or on
+        first use. The processes are forked when it's created, which blocks
+        the IOLoop and is unsafe once other threads run, so applications
+        not started by :meth:`listen` should create it before starting the
+        IOLoop.
+        """
+        if self._worker_pool is None:
+            from bonzo.workers import WorkerPool
+            self._worker_pool = WorkerPool(
+                self.settings.get('worker_processes'),
+                spool_path=self.settings.get('worker_spool_path'),
+                use_shared_memory=self.settings.get('worker_shared_memory',
+                                                    True))
+        return self._worker_pool
+
+    def get_stats(self):
+        """Returns a dictionary with the requests waiting in the batches of
+        every :class:`BatchRequestHandler` and on the :attr:`worker_pool`.
+        """
+        stats = {
+            'batches': dict((handler_class.__name__, len(batcher._requests))
+                            for handler_class, batcher in
+                            self._batchers.items()),
+        }
+        if self._worker_pool is not None:
+            stats['workers'] = {'pending': self._worker_pool.pending}
+        return stats
+
+    def close(self):
+        """Stops the worker processes of :attr:`worker_pool`, waiting for
+        the pending requests."""
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+            self._worker_pool = None
+
+    def _start_workers(self):
+        # The worker processes are forked before the IOLoop and the helper
+        # threads start, see worker_pool
+        targets = [self.handler_class] + self.router.targets()
+        if any(isinstance(target, type) and
+               issubclass(target, WorkerRequestHandler)
+               for target in targets):
+            return self.worker_pool
+
+    def find_handler(self, address):
+        """Returns the handler class for the recipient ``address``."""
+        return self.router.resolve(address, self.handler_class)
+
+    def _validate_recipient(self, address):
+        handler_class = self.find_handler(address)
+        if handler_class is None:
+            return False
+        return handler_class.validate_recipient(self, address)
+
+    def validate_recipient(self, address):
+        """Called by :class:`~bonzo.server.SMTPServer` when a ``RCPT`` command
+        is received. Returns a :class:`~tornado.concurrent.Future` resolving to
+        the cached result of :meth:`RequestHandler.validate_recipient` of the
+        handler routed for ``address``, or to ``False`` when there is no
+        handler for it; concurrent validations of the same address share a
+        single call.
+        """
+        return self.recipient_cache(address)
 
     def listen(self, port, address='', **kwargs):
         """Starts an SMTP server for this handler on the given port.
@@ -151,9 +496,44 @@ class Application(object):
         :meth:`~tornado.tcpserver.TCPServer.bind`/
         :meth:`~tornado.tcpserver.TCPServer.start` methods directly.
 
+        When the ``admin_port`` setting is given, an
+        :class:`~bonzo.admin.AdminApplication` for the server listens on it,
+        on the ``admin_address`` setting or ``127.0.0.1``, with the
+        ``profiler`` and ``admin_token`` settings.
+
+        The :attr:`worker_pool` is created first when a handler is a
+        :class:`WorkerRequestHandler`. Returns the
+        :class:`~.server.SMTPServer`.
+
         Note that after calling this method you still need to call
         ``IOLoop.current().start()`` to start the server.
         """
         from bonzo.server import SMTPServer
+        self._start_workers()
         server = SMTPServer(self, **kwargs)
         server.listen(port, address)
+        self._start_admin(server)
+        return server
+
+    def listen_unix(self, path, mode=0o666, backlog=128, **kwargs):
+        """Starts an SMTP server for this handler on a Unix socket bound to
+        ``path``, like :meth:`listen` does on a port. See
+        :meth:`SMTPServer.listen_unix <.server.SMTPServer.listen_unix>`.
+        Returns the :class:`~.server.SMTPServer`.
+        """
+        from bonzo.server import SMTPServer
+        self._start_workers()
+        server = SMTPServer(self, **kwargs)
+        server.listen_unix(path, mode, backlog)
+        self._start_admin(server)
+        return server
+
+    def _start_admin(self, server):
+        admin_port = self.settings.get('admin_port')
+        if admin_port is not None:
+            from bonzo.admin import AdminApplication
+            admin = AdminApplication(server, self,
+                                     profiler=self.settings.get('profiler'),
+                                     token=self.settings.get('admin_token'))
+            admin.listen(admin_port,
+                         self.settings.get('admin_address', '127.0.0.1'))
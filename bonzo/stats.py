@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Preaggregated counters and histograms for monitoring the server."""
+import bisect
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds, in seconds, of the default latency histogram buckets."""
+
+
+class Histogram(object):
+    """A histogram of values counted in fixed buckets.
+
+    :arg buckets: Sorted upper bounds of the buckets, values greater than the
+        last bound are counted in an extra bucket.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """Counts ``value`` in its bucket."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        """Returns a dictionary with the current values of the histogram."""
+        return {
+            'buckets': list(self.buckets) + ['+Inf'],
+            'counts': list(self.counts),
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+
+class TopCounter(object):
+    """Approximate counts of the most frequent keys, in bounded memory.
+
+    At most ``capacity`` keys are counted. Adding a new key when they are
+    all taken decrements every count instead, dropping the keys reaching
+    zero, so the keys counted more than ``1 / (capacity + 1)`` of the times
+    are always kept (the Misra-Gries algorithm). Counts are lower bounds of
+    the real ones.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key):
+        """Counts ``key`` once."""
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+        else:
+            for other in list(counts):
+                if counts[other] == 1:
+                    del counts[other]
+                else:
+                    counts[other] -= 1
+
+    def top(self, count=10):
+        """Returns the ``count`` most frequent keys with their counts, as a
+        list of ``(key, count)`` tuples."""
+        items = sorted(self.counts.items(), key=lambda item: -item[1])
+        return items[:count]
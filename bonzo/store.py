@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed storage of messages.
+
+A :class:`MessageStore` keeps the large parts of the messages, usually
+attachments, in a :class:`BlobStore` addressed by the SHA-256 digest of their
+content, so a part received many times is written once. The stored message
+refers to its parts by digest and is streamed back byte for byte:
+
+.. code-block:: python
+
+   store = AsyncMessageStore(MessageStore('/var/spool/bonzo'))
+
+   class Handler(smtp.RequestHandler):
+
+       @gen.coroutine
+       def data(self):
+           yield store.store(self.request.raw, self.request.iter_parts())
+
+Blobs and messages are compressed as chosen by a
+:class:`~bonzo.compression.CompressionPolicy`. The methods of the stores do
+blocking disk I/O and compression, :class:`AsyncMessageStore` runs them on a
+worker thread so the IOLoop is not blocked.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from bonzo import mime
+from bonzo.compression import CompressionPolicy, get_codec
+
+_BLOB_SEGMENT = b'B'
+_RAW_SEGMENT = b'R'
+
+
+def _iter_file(f, chunk_size):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class _Reader(object):
+    """Reads lines and blocks from an iterable of chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def _fill(self):
+        for chunk in self._chunks:
+            self._buffer += chunk
+            return True
+        return False
+
+    def readline(self):
+        while True:
+            i = self._buffer.find(b'\n')
+            if i >= 0:
+                line, self._buffer = self._buffer[:i + 1], self._buffer[i + 1:]
+                return line
+            if not self._fill():
+                line, self._buffer = self._buffer, b''
+                return line
+
+    def read(self, size):
+        if not self._buffer:
+            self._fill()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class BlobStore(object):
+    """A directory of blobs named by the SHA-256 digest of their content.
+
+    Every blob has a reference count, kept in memory and appended to a
+    journal file in the directory, and it's deleted when its count drops to
+    zero. The journal is replayed when the store is created, and rewritten by
+    :meth:`compact`. A blob file starts with a line with the name of its
+    codec, followed by the compressed content.
+
+    :arg str path: Directory of the store, created when it doesn't exist.
+    :arg policy: The :class:`~bonzo.compression.CompressionPolicy` of the
+        blobs, a default policy is used when it's not given.
+    """
+
+    JOURNAL = 'refs.log'
+
+    def __init__(self, path, policy=None):
+        self.path = path
+        self.policy = policy or CompressionPolicy()
+        self.refs = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._journal_path = os.path.join(path, self.JOURNAL)
+        self._load()
+        self._journal = open(self._journal_path, 'ab')
+
+    def _load(self):
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    digest, delta = line.split()
+                    delta = int(delta)
+                except ValueError:
+                    # A truncated last line
+                    continue
+                digest = digest.decode('ascii')
+                count = self.refs.get(digest, 0) + delta
+                if count > 0:
+                    self.refs[digest] = count
+                else:
+                    self.refs.pop(digest, None)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def _add_ref(self, digest, delta):
+        count = self.refs.get(digest, 0) + delta
+        if count > 0:
+            self.refs[digest] = count
+        else:
+            self.refs.pop(digest, None)
+        self._journal.write(('%s %d\n' % (digest, delta)).encode('ascii'))
+        self._journal.flush()
+        return count
+
+    def put(self, data, content_type=None):
+        """Adds a reference to the blob with the content of ``data``, a
+        bytes-like object, writing it when it's not stored yet. Returns the
+        digest of the blob. ``content_type`` is used for choosing the codec.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.refs:
+            path = self._blob_path(digest)
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            codec = self.policy.choose(len(data), content_type)
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(codec.name.encode('ascii') + b'\n')
+                for chunk in codec.iter_compress([data]):
+                    f.write(chunk)
+            os.rename(tmp_path, path)
+        self._add_ref(digest, 1)
+        return digest
+
+    def release(self, digest):
+        """Removes a reference to the blob of ``digest``, deleting it when
+        it's no longer referenced.
+        """
+        if digest not in self.refs:
+            raise KeyError(digest)
+        if not self._add_ref(digest, -1):
+            os.remove(self._blob_path(digest))
+
+    def iter_blob(self, digest, chunk_size=65536):
+        """Yields the content of the blob of ``digest`` in chunks."""
+        with open(self._blob_path(digest), 'rb') as f:
+            codec = get_codec(f.readline().strip().decode('ascii'))
+            for chunk in codec.iter_decompress(_iter_file(f, chunk_size)):
+                yield chunk
+
+    def get(self, digest):
+        """Returns the content of the blob of ``digest``."""
+        return b''.join(self.iter_blob(digest))
+
+    def compact(self):
+        """Rewrites the journal with a line per referenced blob."""
+        tmp_path = self._journal_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for digest, count in self.refs.items():
+                f.write(('%s %d\n' % (digest, count)).encode('ascii'))
+        self._journal.close()
+        os.rename(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, 'ab')
+
+    def close(self):
+        """Closes the journal."""
+        self._journal.close()
+
+    def __contains__(self, digest):
+        return digest in self.refs
+
+    def __len__(self):
+        return len(self.refs)
+
+
+class MessageStore(object):
+    """Stores messages keeping their large MIME parts in a :class:`BlobStore`.
+
+    A stored message is a file of segments: the bytes between the large parts
+    are written inline, and every large part is replaced by the digest of its
+    blob. The parts are stored encoded, as received, so the message is
+    rebuilt exactly. Like blobs, the file starts with a line with the name of
+    its codec, chosen by the size of the inline bytes, and the segments are
+    compressed.
+
+    :arg str path: Directory of the store, created when it doesn't exist.
+    :arg int min_size: Minimum size of the encoded payload of the parts
+        stored as blobs, smaller parts are written inline.
+    :arg policy: The :class:`~bonzo.compression.CompressionPolicy` of the
+        messages and their blobs.
+    """
+
+    def __init__(self, path, min_size=1024, policy=None):
+        self.path = path
+        self.min_size = min_size
+        self.policy = policy or CompressionPolicy()
+        self.messages_path = os.path.join(path, 'messages')
+        if not os.path.isdir(self.messages_path):
+            os.makedirs(self.messages_path)
+        self.blobs = BlobStore(os.path.join(path, 'blobs'), self.policy)
+
+    def _message_path(self, message_id):
+        return os.path.join(self.messages_path, message_id)
+
+    def store(self, raw, parts=None):
+        """Stores the message in ``raw``, a bytes-like object, returning its
+        identifier.
+
+        :arg parts: Optional iterable of the :class:`~bonzo.mime.MIMEPart`
+            instances of ``raw``, e.g. from
+            :meth:`~bonzo.server.SMTPRequest.iter_parts`. The message is
+            parsed when they are not given.
+        """
+        if parts is None:
+            parts = mime.iter_parts(raw)
+        parts = [part for part in parts if part.size >= self.min_size]
+        view = memoryview(raw)
+        inline_size = len(view) - sum(part.size for part in parts)
+        codec = self.policy.choose(inline_size)
+        message_id = uuid.uuid4().hex
+        path = self._message_path(message_id)
+        tmp_path = path + '.tmp'
+        position = 0
+        digests = []
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(codec.name.encode('ascii') + b'\n')
+                compressor = codec.compressor()
+
+                def write(data):
+                    f.write(compressor.compress(data))
+
+                for part in parts:
+                    self._write_raw(write, view[position:part.start])
+                    digest = self.blobs.put(view[part.start:part.end],
+                                            part.content_type)
+                    digests.append(digest)
+                    write(_BLOB_SEGMENT + (' %s %d\n' % (
+                        digest, part.size)).encode('ascii'))
+                    position = part.end
+                self._write_raw(write, view[position:])
+                f.write(compressor.flush())
+            os.rename(tmp_path, path)
+        except Exception:
+            for digest in digests:
+                self.blobs.release(digest)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return message_id
+
+    def _write_raw(self, write, data):
+        if len(data):
+            write(_RAW_SEGMENT + (' %d\n' % len(data)).encode('ascii'))
+            write(data)
+
+    def _iter_segments(self, message_id, chunk_size):
+        """Yields ``(digest, None)`` for the blob segments of the message and
+        ``(None, chunk)`` for the chunks of its inline segments.
+        """
+        with open(self._message_path(message_id), 'rb') as f:
+            codec = get_codec(f.readline().strip().decode('ascii'))
+            reader = _Reader(codec.iter_decompress(_iter_file(f, chunk_size)))
+            while True:
+                line = reader.readline()
+                if not line:
+                    break
+                fields = line.split()
+                if fields[0] == _BLOB_SEGMENT:
+                    yield fields[1].decode('ascii'), None
+                    continue
+                remaining = int(fields[1])
+                while remaining:
+                    chunk = reader.read(min(remaining, chunk_size))
+                    if not chunk:
+                        raise IOError('Truncated message: %s' % message_id)
+                    remaining -= len(chunk)
+                    yield None, chunk
+
+    def iter_message(self, message_id, chunk_size=65536):
+        """Yields the bytes of the message of ``message_id`` in chunks."""
+        for digest, chunk in self._iter_segments(message_id, chunk_size):
+            if digest is None:
+                yield chunk
+                continue
+            for chunk in self.blobs.iter_blob(digest, chunk_size):
+                yield chunk
+
+    def read(self, message_id):
+        """Returns the bytes of the message of ``message_id``."""
+        return b''.join(self.iter_message(message_id))
+
+    def digests(self, message_id):
+        """Returns the list of blob digests the message of ``message_id``
+        refers to.
+        """
+        return [digest for digest, _ in self._iter_segments(message_id, 65536)
+                if digest is not None]
+
+    def delete(self, message_id):
+        """Deletes the message of ``message_id``, releasing its blobs."""
+        digests = self.digests(message_id)
+        os.remove(self._message_path(message_id))
+        for digest in digests:
+            self.blobs.release(digest)
+
+    def __contains__(self, message_id):
+        return os.path.exists(self._message_path(message_id))
+
+    def close(self):
+        """Closes the blob store."""
+        self.blobs.close()
+
+
+class AsyncMessageStore(object):
+    """Runs the methods of a :class:`MessageStore` on a worker thread, so the
+    compression and the disk I/O don't block the IOLoop. The methods return a
+    :class:`~tornado.concurrent.Future` resolved on the IOLoop.
+    """
+
+    def __init__(self, message_store, io_loop=None):
+        self.message_store = message_store
+        self.io_loop = io_loop or IOLoop.current()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            future, method, args = task
+            try:
+                result = method(*args)
+            except Exception:
+                self.io_loop.add_callback(future.set_exc_info, sys.exc_info())
+            else:
+                self.io_loop.add_callback(future.set_result, result)
+
+    def _submit(self, method, *args):
+        future = Future()
+        self._queue.put((future, method, args))
+        return future
+
+    def store(self, raw, parts=None):
+        """Runs :meth:`MessageStore.store`."""
+        return self._submit(self.message_store.store, raw, parts)
+
+    def read(self, message_id):
+        """Runs :meth:`MessageStore.read`."""
+        return self._submit(self.message_store.read, message_id)
+
+    def delete(self, message_id):
+        """Runs :meth:`MessageStore.delete`."""
+        return self._submit(self.message_store.delete, message_id)
+
+    def close(self):
+        """Waits for the pending tasks and closes the store."""
+        self._queue.put(None)
+        self._thread.join()
+        self.message_store.close()
@@ -2,12 +2,100 @@
 """Unit testing support for asynchronous code."""
 import socket
 
+from tornado import gen
 from tornado.escape import utf8
-from tornado.iostream import IOStream
+from tornado.iostream import IOStream, StreamClosedError
 from tornado.testing import AsyncTestCase, bind_unused_port
+from bonzo.loopback import stream_pair
 from bonzo.server import SMTPServer
 
 
+def connect_loopback(server, address=('127.0.0.1', 0), io_loop=None):
+    """Connects a client to ``server``, an instance of
+    :class:`~.server.SMTPServer`, through in-memory streams instead of a
+    socket. Returns the :class:`~.loopback.LoopbackStream` of the client.
+
+    :arg tuple address: Address of the client seen by the server.
+    """
+    client, server_stream = stream_pair(io_loop)
+    server.handle_stream(server_stream, address)
+    return client
+
+
+def mail_script(hostname, mail, rcpt, data):
+    """Returns the commands of a session sending a message, for
+    :meth:`AsyncSMTPTestCase.run_sessions`.
+    """
+    script = ['HELO %s' % hostname, 'MAIL FROM:%s' % mail]
+    script.extend('RCPT TO:%s' % address for address in rcpt)
+    script.extend(['DATA', '%s\r\n.' % data, 'QUIT'])
+    return script
+
+
+class SessionResult(object):
+    """The outcome of a client session run by
+    :meth:`AsyncSMTPTestCase.run_sessions`.
+
+    .. attribute:: transcript
+
+       List of ``(command, reply)`` tuples, the first one has a ``None``
+       command and the welcome message.
+
+    .. attribute:: latencies
+
+       Seconds from sending every command until its reply was received.
+
+    .. attribute:: error
+
+       The exception that ended the session early, or ``None``.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.transcript = []
+        self.latencies = []
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def replies(self):
+        """The list of replies received."""
+        return [reply for _, reply in self.transcript]
+
+    @property
+    def duration(self):
+        """Seconds the session lasted."""
+        return self.end - self.start
+
+    def __repr__(self):
+        return '%s (index=%d, commands=%d, error=%r)' % (
+            self.__class__.__name__, self.index, len(self.latencies),
+            self.error)
+
+
+def throughput(results):
+    """Returns the sessions completed per second by ``results``, a list of
+    :class:`SessionResult`, from the start of the first one to the end of the
+    last one.
+    """
+    start = min(result.start for result in results)
+    end = max(result.end for result in results)
+    return len(results) / max(end - start, 1e-9)
+
+
+def latency_percentile(results, percentile):
+    """Returns the ``percentile`` of the command latencies of ``results``, a
+    list of :class:`SessionResult`.
+    """
+    latencies = sorted(latency for result in results
+                       for latency in result.latencies)
+    if not latencies:
+        return 0.0
+    index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+    return latencies[index]
+
+
 class AsyncSMTPTestCase(AsyncTestCase):
     """A test case that starts up an SMTP server.
 
@@ -15,14 +103,21 @@ class AsyncSMTPTestCase(AsyncTestCase):
     :class:`~.server.SMTPServer` callback to be tested.
     """
 
+    loopback = False
+    """When true the server doesn't listen on a port and :meth:`connect`
+    uses :func:`connect_loopback`, so the tests don't use sockets."""
+
     def setUp(self):
         super(AsyncSMTPTestCase, self).setUp()
-        sock, port = bind_unused_port()
-        self.__port = port
+        sock = None
+        self.__port = None
+        if not self.loopback:
+            sock, self.__port = bind_unused_port()
 
         self._request_callback = self.get_request_callback()
         self.smtp_server = self.get_smtp_server()
-        self.smtp_server.add_sockets([sock])
+        if sock is not None:
+            self.smtp_server.add_sockets([sock])
 
     def get_smtp_server(self):
         """Returns an instance of :class:`~.server.SMTPServer` that will be
@@ -47,22 +142,29 @@ class AsyncSMTPTestCase(AsyncTestCase):
     def get_smtp_port(self):
         """Returns the port used by the server.
 
-        A new port is chosen for each test.
+        A new port is chosen for each test, it's ``None`` when
+        :attr:`loopback` is true.
         """
         return self.__port
 
     def connect(self, read_response=True):
         """Creates a instance of :class:`~tornado.iostream.IOStream` for
         reading and writing bytes to the opened socket on the SMTP server
-        address.
+        address, or a :class:`~.loopback.LoopbackStream` when
+        :attr:`loopback` is true.
 
         :arg bool read_response: Reads the response of the server immediately
              after to establish connection. Useful to read the response and
              discard the welcome message.
         """
-        self.stream = IOStream(socket.socket(), io_loop=self.io_loop)
-        self.stream.connect(('localhost', self.get_smtp_port()), self.stop)
-        self.wait()
+        if self.loopback:
+            self.stream = connect_loopback(self.smtp_server,
+                                           io_loop=self.io_loop)
+        else:
+            self.stream = IOStream(socket.socket(), io_loop=self.io_loop)
+            self.stream.connect(('localhost', self.get_smtp_port()),
+                                self.stop)
+            self.wait()
         if read_response:
             self.read_response()
 
@@ -94,6 +196,91 @@ class AsyncSMTPTestCase(AsyncTestCase):
         self.stream.close()
         del self.stream
 
+    @gen.coroutine
+    def open_stream(self):
+        """Returns a :class:`~tornado.concurrent.Future` resolved with a new
+        stream connected to the server, without reading the welcome message.
+        """
+        if self.loopback:
+            raise gen.Return(connect_loopback(self.smtp_server,
+                                              io_loop=self.io_loop))
+        stream = IOStream(socket.socket(), io_loop=self.io_loop)
+        yield stream.connect(('localhost', self.get_smtp_port()))
+        raise gen.Return(stream)
+
+    @gen.coroutine
+    def _read_reply(self, stream):
+        lines = []
+        while True:
+            line = yield stream.read_until(b'\r\n')
+            lines.append(line)
+            # Multiline replies have a hyphen after the status code
+            if line[3:4] != b'-':
+                raise gen.Return(b''.join(lines))
+
+    @gen.coroutine
+    def _run_session(self, index, script, pipelined):
+        result = SessionResult(index)
+        now = self.io_loop.time
+        result.start = now()
+        commands = [utf8(command) for command in script]
+        stream = None
+        try:
+            stream = yield self.open_stream()
+            reply = yield self._read_reply(stream)
+            result.transcript.append((None, reply))
+            if pipelined:
+                sent = now()
+                stream.write(b''.join(c + b'\r\n' for c in commands))
+            for command in commands:
+                if not pipelined:
+                    sent = now()
+                    stream.write(command + b'\r\n')
+                reply = yield self._read_reply(stream)
+                result.latencies.append(now() - sent)
+                result.transcript.append((command, reply))
+        except StreamClosedError as e:
+            result.error = e
+        finally:
+            result.end = now()
+            if stream is not None:
+                stream.close()
+        raise gen.Return(result)
+
+    def run_sessions(self, scripts, pipelined=False, timeout=30):
+        """Runs a client session for every script of ``scripts``
+        concurrently, and returns the list of their :class:`SessionResult`.
+
+        A script is a list of commands, every one is sent followed by a
+        ``<CR><LF>`` and answered by a reply, e.g. the result of
+        :func:`mail_script`. When ``pipelined`` is true every session sends
+        all of its commands at once before reading the replies.
+        """
+        @gen.coroutine
+        def run():
+            results = yield [self._run_session(i, script, pipelined)
+                             for i, script in enumerate(scripts)]
+            raise gen.Return(results)
+        return self.io_loop.run_sync(run, timeout=timeout)
+
+    def assertThroughput(self, results, minimum):
+        """Fails unless the sessions of ``results`` were completed at a rate
+        of at least ``minimum`` sessions per second.
+        """
+        value = throughput(results)
+        if value < minimum:
+            self.fail('Throughput of %.1f sessions per second is lower than '
+                      '%.1f' % (value, minimum))
+
+    def assertLatency(self, results, maximum, percentile=99):
+        """Fails unless the ``percentile`` of the command latencies of
+        ``results`` is at most ``maximum`` seconds.
+        """
+        value = latency_percentile(results, percentile)
+        if value > maximum:
+            self.fail('Latency p%s of %.4f seconds is higher than %.4f' % (
+                percentile, value, maximum))
+
     def tearDown(self):
         self.smtp_server.stop()
         super(AsyncSMTPTestCase, self).tearDown()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Detection of the IOLoop being blocked, usually by a handler doing
+blocking I/O.
+
+A :class:`LoopWatchdog` measures how late a periodic timer of the IOLoop
+runs. A watcher thread checks the timer, and when the IOLoop is blocked
+for longer than ``threshold`` seconds it captures the stack of the IOLoop
+thread, finds the handler and the SMTP phase running, and logs them:
+
+.. code:: python
+
+    watchdog = LoopWatchdog(threshold=0.5)
+    watchdog.start()
+    smtp_server = SMTPServer(application, watchdog=watchdog)
+
+The lag of every tick of the timer is counted in :attr:`LoopWatchdog.lag`,
+and :meth:`~bonzo.server.SMTPServer.get_stats` includes the watchdog.
+"""
+import collections
+import sys
+import threading
+import traceback
+
+from tornado.ioloop import IOLoop
+from tornado.log import gen_log
+
+from bonzo.stats import Histogram
+
+_PHASES = {
+    '_on_body': 'DATA',
+    '_on_data_chunk': 'DATA',
+}
+
+
+def describe(frame):
+    """Returns the names of the handler and the SMTP phase running in the
+    stack of ``frame``, or ``None`` when they aren't found. Used on the
+    stacks of the IOLoop thread captured by other threads.
+    """
+    from bonzo.server import SMTPConnection
+    from bonzo.smtp import (BatchRequestHandler, RequestHandler,
+                            WorkerRequestHandler)
+    handler_classes = (RequestHandler, BatchRequestHandler,
+                       WorkerRequestHandler)
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    handler = phase = None
+    callback = False
+    # From the outermost frame, the innermost phase and handler are kept
+    for frame in reversed(frames):
+        name = frame.f_code.co_name
+        instance = frame.f_locals.get('self')
+        if callback:
+            # The request callback, unless a handler class is found later
+            callback = False
+            if handler is None:
+                handler = (name if instance is None else
+                           instance.__class__.__name__)
+        if isinstance(instance, SMTPConnection):
+            if name.startswith('command_'):
+                phase = name[8:].upper()
+            elif name == '_run_filters':
+                phase = frame.f_locals.get('phase', phase)
+            elif name in _PHASES:
+                phase = _PHASES[name]
+            callback = name == '_on_body'
+        elif isinstance(instance, handler_classes):
+            handler = instance.__class__.__name__
+        elif (isinstance(instance, type) and
+              issubclass(instance, handler_classes)):
+            # Class methods, e.g. validate_recipient
+            handler = instance.__name__
+    return handler, phase
+
+
+class Stall(object):
+    """A time the IOLoop was blocked.
+
+    .. attribute:: duration
+
+       Seconds the IOLoop was blocked, updated when it runs again.
+
+    .. attribute:: stack
+
+       The formatted stack of the IOLoop thread, as a list of strings.
+    """
+
+    def __init__(self, start, duration, handler, phase, stack):
+        self.start = start
+        self.duration = duration
+        self.handler = handler
+        self.phase = phase
+        self.stack = stack
+
+    def to_dict(self):
+        """Returns a dictionary with the attributes of the stall."""
+        return {
+            'start': self.start,
+            'duration': self.duration,
+            'handler': self.handler,
+            'phase': self.phase,
+            'stack': ''.join(self.stack),
+        }
+
+
+class LoopWatchdog(object):
+    """Measures the scheduling lag of the IOLoop with a timer running every
+    ``interval`` seconds, and records a :class:`Stall` when it's blocked for
+    longer than ``threshold`` seconds.
+
+    :arg int max_stalls: Number of the last stalls kept in :attr:`stalls`.
+    """
+
+    def __init__(self, threshold=0.5, interval=0.1, max_stalls=20,
+                 io_loop=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.io_loop = io_loop or IOLoop.current()
+        self.lag = Histogram()
+        self.stalls = collections.deque(maxlen=max_stalls)
+        self._expected = None
+        self._stall = None
+        self._timeout = None
+        self._thread = None
+        self._thread_id = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts the timer and the watcher thread, it's called on the
+        thread running the IOLoop."""
+        self._thread_id = threading.current_thread().ident
+        self._stopped.clear()
+        self._schedule()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the timer and the watcher thread."""
+        self._stopped.set()
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _schedule(self):
+        self._expected = self.io_loop.time() + self.interval
+        self._timeout = self.io_loop.add_timeout(self._expected, self._tick)
+
+    def _tick(self):
+        lag = max(self.io_loop.time() - self._expected, 0)
+        self.lag.add(lag)
+        stall, self._stall = self._stall, None
+        if stall is not None:
+            stall.duration = lag
+            gen_log.info('IOLoop was blocked for %.3f seconds in %s (%s)',
+                         lag, stall.handler, stall.phase)
+        self._schedule()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            expected = self._expected
+            blocked = self.io_loop.time() - expected
+            if blocked < self.threshold or self._stall is not None:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None or expected != self._expected:
+                # The IOLoop thread is gone, or ran meanwhile
+                continue
+            handler, phase = describe(frame)
+            stack = traceback.format_stack(frame)
+            del frame
+            self._stall = Stall(expected, blocked, handler, phase, stack)
+            self.stalls.append(self._stall)
+            gen_log.warning('IOLoop blocked for more than %.3f seconds in '
+                            '%s (%s)\n%s', blocked, handler, phase,
+                            ''.join(stack))
+
+    def to_dict(self):
+        """Returns a dictionary with the lag histogram and the last stalls."""
+        return {
+            'threshold': self.threshold,
+            'lag': self.lag.to_dict(),
+            'stalls': [stall.to_dict() for stall in list(self.stalls)],
+        }
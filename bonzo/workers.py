@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Offload of the requests to worker processes.
+
+A :class:`WorkerPool` runs a function on a pool of processes for every
+:class:`~bonzo.server.SMTPRequest`, so CPU-heavy handlers use every core and
+don't block the IOLoop. The bytes of the message are not pickled: they are
+copied once to a shared memory segment, or to a spool file when
+:mod:`multiprocessing.shared_memory` is not available, and only a small
+record with the envelope and the name of the segment goes over the queue of
+the pool. The function receives a :class:`WorkerMessage` reading the bytes
+from the segment.
+
+Usually the pool is used by :class:`~bonzo.smtp.Application` for the
+subclasses of :class:`~bonzo.smtp.WorkerRequestHandler`.
+"""
+import multiprocessing
+import os
+import pickle
+import tempfile
+import traceback
+
+from tornado.concurrent import Future
+from tornado.escape import to_unicode
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+from bonzo import errors
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
+SHARED_MEMORY = 'shm'
+SPOOL_FILE = 'file'
+
+
+def _attach(name):
+    """Attaches to the shared memory segment ``name`` created by another
+    process, without tracking it as a segment of this process.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every attached segment is tracked, by the
+        # resource tracker shared with the parent process, which unlinks it
+        return shared_memory.SharedMemory(name=name)
+
+
+class WorkerMessage(object):
+    """The request received by the function of a :class:`WorkerPool`, on the
+    worker process.
+
+    .. attribute:: buffer
+
+       A :class:`memoryview` of the bytes of the message, with ``<CR><LF>``
+       line endings, on the shared memory segment. It's only valid while the
+       function runs.
+    """
+
+    def __init__(self, remote_ip, hostname, mail, rcpt, buffer):
+        self.remote_ip = remote_ip
+        self.hostname = hostname
+        self.mail = mail
+        self.rcpt = rcpt
+        self.buffer = buffer
+        self._raw = None
+
+    @property
+    def size(self):
+        """The size in bytes of the message."""
+        return len(self.buffer)
+
+    @property
+    def raw(self):
+        """The bytes of the message, copied from :attr:`buffer` on first
+        access.
+        """
+        if self._raw is None:
+            self._raw = bytes(self.buffer)
+        return self._raw
+
+    @property
+    def data(self):
+        """The message as a string with ``\\n`` line endings."""
+        return to_unicode(self.raw).replace('\r\n', '\n')
+
+    @property
+    def message(self):
+        """The message parsed as an :class:`email.message.Message`."""
+        import email
+        return email.message_from_string(self.data)
+
+    def __repr__(self):
+        attrs = ('remote_ip', 'hostname', 'mail', 'rcpt')
+        args = ', '.join(["%s='%s'" % (n, getattr(self, n)) for n in attrs])
+        return '%s (%s)' % (self.__class__.__name__, args)
+
+
+def _run(function, record):
+    """Runs ``function``, pickled, on a worker process. Returns ``None``, the
+    status code and message of an :class:`~bonzo.errors.SMTPError`, or the
+    traceback of another exception.
+    """
+    kind, name, size, remote_ip, hostname, mail, rcpt = record
+    segment = buffer = None
+    try:
+        function = pickle.loads(function)
+        if kind == SHARED_MEMORY:
+            segment = _attach(name)
+            buffer = segment.buf[:size]
+        else:
+            with open(name, 'rb') as f:
+                buffer = memoryview(f.read())
+        function(WorkerMessage(remote_ip, hostname, mail, rcpt, buffer))
+    except errors.SMTPError as e:
+        return 'error', e.status_code, e.message
+    except Exception:
+        return 'exception', traceback.format_exc()
+    finally:
+        if segment is not None:
+            if buffer is not None:
+                buffer.release()
+            try:
+                segment.close()
+            except BufferError:
+                # A view kept by the function, closed once it's collected
+                pass
+    return None
+
+
+class WorkerPool(object):
+    """Runs functions for the requests on a pool of ``processes`` worker
+    processes, the number of CPUs by default.
+
+    :arg str spool_path: Directory of the spool files used when shared
+        memory is not available, or when ``use_shared_memory`` is false.
+
+    .. attribute:: pending
+
+       Number of requests submitted and not done yet.
+    """
+
+    def __init__(self, processes=None, spool_path=None, use_shared_memory=True,
+                 io_loop=None):
+        self.io_loop = io_loop or IOLoop.current()
+        self.spool_path = spool_path
+        self.pending = 0
+        self.use_shared_memory = use_shared_memory and shared_memory is not None
+        if self.use_shared_memory:
+            # Started before the workers, so they share it, see _attach()
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(processes)
+
+    def _write_body(self, raw):
+        if self.use_shared_memory:
+            segment = shared_memory.SharedMemory(create=True,
+                                                 size=max(len(raw), 1))
+            segment.buf[:len(raw)] = raw
+            return SHARED_MEMORY, segment.name, segment
+        fd, path = tempfile.mkstemp(prefix='bonzo-', dir=self.spool_path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+        return SPOOL_FILE, path, None
+
+    def _release_body(self, kind, name, segment):
+        if kind == SHARED_MEMORY:
+            segment.close()
+            segment.unlink()
+        else:
+            os.remove(name)
+
+    def submit(self, function, request):
+        """Runs ``function``, a module level function or a class method, with
+        a :class:`WorkerMessage` for ``request``. Returns a
+        :class:`~tornado.concurrent.Future` resolved with ``None`` when it
+        returns, or with the :class:`~bonzo.errors.SMTPError` it raises.
+        Other exceptions, and failures to run the function on a worker, are
+        logged and resolve it with an :class:`~bonzo.errors.InternalConfusion`
+        error.
+        """
+        future = Future()
+        try:
+            # Pickled here, so the failures are not lost on the threads of
+            # the pool
+            function = pickle.dumps(function, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            app_log.error('Cannot send the function to the workers %r',
+                          request, exc_info=True)
+            future.set_result(errors.InternalConfusion())
+            return future
+        raw = request.raw
+        if raw is None:
+            raw = (request.data or '').replace('\n', '\r\n').encode('utf-8')
+        kind, name, segment = self._write_body(raw)
+        record = (kind, name, len(raw), request.remote_ip, request.hostname,
+                  request.mail, list(request.rcpt))
+
+        def done(result):
+            self.pending -= 1
+            self._release_body(kind, name, segment)
+            if result is None:
+                future.set_result(None)
+            elif result[0] == 'error':
+                future.set_result(errors.SMTPError(result[1], result[2]))
+            else:
+                app_log.error('Uncaught exception in worker %r\n%s', request,
+                              result[1])
+                future.set_result(errors.InternalConfusion())
+
+        def callback(result):
+            # Called on a thread of the pool
+            self.io_loop.add_callback(done, result)
+
+        try:
+            self.pool.apply_async(_run, (function, record), callback=callback)
+        except Exception:
+            self._release_body(kind, name, segment)
+            raise
+        self.pending += 1
+        return future
+
+    def close(self):
+        """Waits for the pending requests and stops the worker processes."""
+        self.pool.close()
+        self.pool.join()
@@ -59,7 +59,7 @@ setup(
     author_email='puentesarrin@gmail.com',
     packages=['bonzo'],
     keywords=['bonzo', 'tornado', 'smtp', 'server', 'proxy'],
-    install_requires=['tornado >= 3.0'],
+    install_requires=['tornado >= 4.0'],
     license='Apache License, Version 2.0',
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import ExpectLog, bind_unused_port
+from bonzo.admin import AdminApplication
+from bonzo.profiler import SamplingProfiler
+from bonzo.smtp import Application, RequestHandler
+from bonzo.testing import AsyncSMTPTestCase
+
+
+class Handler(RequestHandler):
+
+    def data(self):
+        pass
+
+
+class AdminApplicationTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def setUp(self):
+        super(AdminApplicationTest, self).setUp()
+        sock, self.admin_port = bind_unused_port()
+        self.http_server = HTTPServer(
+            AdminApplication(self.smtp_server,
+                             self.smtp_server.request_callback,
+                             token='secret'),
+            io_loop=self.io_loop)
+        self.http_server.add_sockets([sock])
+        self.http_client = AsyncHTTPClient(io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.http_server.stop()
+        self.http_client.close()
+        super(AdminApplicationTest, self).tearDown()
+
+    def get_request_callback(self):
+        return Application(Handler)
+
+    def fetch(self, path, **kwargs):
+        self.http_client.fetch('http://127.0.0.1:%d%s' % (self.admin_port,
+                                                          path),
+                               self.stop, raise_error=False, **kwargs)
+        return self.wait()
+
+    def post(self, path, body, token='secret'):
+        headers = {'X-Admin-Token': token} if token is not None else {}
+        return self.fetch(path, method='POST', body=body, headers=headers)
+
+    def test_stats(self):
+        self.connect()
+        self.send_mail('client', 'mail@example.com', ['rcpt@example.com'],
+                       'This is a message')
+        response = self.fetch('/stats')
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(stats['connections']['command'], 1)
+        self.assertEqual(stats['connections']['total'], 1)
+        self.assertEqual(stats['handlers']['count'], 1)
+        self.assertEqual(stats['talkers']['messages'], [['127.0.0.1', 1]])
+        self.assertEqual(stats['application'], {'batches': {}})
+        self.close()
+
+    def test_token(self):
+        for token in (None, 'wrong'):
+            with ExpectLog('tornado.access', '403 POST'):
+                with ExpectLog('tornado.general',
+                               '.*Invalid X-Admin-Token header'):
+                    response = self.post('/drain', '', token=token)
+            self.assertEqual(response.code, 403)
+        self.assertIsNone(self.smtp_server._drain_future)
+
+    def test_drain(self):
+        self.connect()
+        response = self.post('/drain', 'timeout=5')
+        self.assertEqual(response.code, 202)
+        self.assertEqual(self.read_response(),
+                         b'421 Service not available, closing transmission '
+                         b'channel\r\n')
+
+    def test_log_level(self):
+        logger = logging.getLogger('bonzo.admin.test')
+        response = self.post('/log-level', 'logger=bonzo.admin.test&'
+                                           'level=debug')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(logger.level, logging.DEBUG)
+        logger.setLevel(logging.NOTSET)
+        with ExpectLog('tornado.access', '400 POST'):
+            with ExpectLog('tornado.general', '.*Invalid level: VERBOSE'):
+                response = self.post('/log-level', 'level=verbose')
+        self.assertEqual(response.code, 400)
+
+    def test_profile(self):
+        with ExpectLog('tornado.access', '404 POST'):
+            with ExpectLog('tornado.general', '.*No profiler'):
+                self.assertEqual(self.post('/profile', '').code, 404)
+        directory = tempfile.mkdtemp()
+        try:
+            profiler = SamplingProfiler(os.path.join(directory, 'profile'),
+                                        io_loop=self.io_loop)
+            self.http_server.request_callback = AdminApplication(
+                self.smtp_server, profiler=profiler)
+            response = self.post('/profile', 'duration=0.05')
+            self.assertEqual(response.code, 202)
+            self.io_loop.add_future(profiler.start(), self.stop)
+            self.assertTrue(os.path.exists(self.wait().result()))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+from tornado.testing import AsyncTestCase
+from bonzo.bloom import BloomFilter, RecipientFilter
+
+
+class BloomFilterTest(AsyncTestCase):
+
+    def test_no_false_negatives(self):
+        keys = ['user%d@example.com' % i for i in range(1000)]
+        bloom = BloomFilter.from_iterable(keys, error_rate=0.01)
+        self.assertEqual(len(bloom), 1000)
+        for key in keys:
+            self.assertTrue(key in bloom)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.from_iterable(
+            ('user%d@example.com' % i for i in range(1000)), error_rate=0.01)
+        positives = sum(1 for i in range(10000)
+                        if ('other%d@example.com' % i) in bloom)
+        self.assertTrue(positives < 300)
+
+
+class RecipientFilterTest(AsyncTestCase):
+
+    def setUp(self):
+        super(RecipientFilterTest, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('# Valid addresses\n\nNew@Example.com\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+        super(RecipientFilterTest, self).tearDown()
+
+    def test_empty_filter(self):
+        self.assertTrue('mail@example.com' in RecipientFilter())
+
+    def test_case_insensitive(self):
+        recipients = RecipientFilter(['Mail@Example.com'])
+        self.assertTrue('mail@example.COM' in recipients)
+        self.assertFalse('other@example.com' in recipients)
+
+    def test_reload(self):
+        recipients = RecipientFilter(['mail@example.com'], path=self.path)
+        recipients.reload(io_loop=self.io_loop).add_done_callback(self.stop)
+        self.wait()
+        self.assertTrue('new@example.com' in recipients)
+        self.assertFalse('mail@example.com' in recipients)
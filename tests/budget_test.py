@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from tornado.testing import AsyncTestCase
+from bonzo.budget import MemoryBudget, RequestBudget
+
+
+class MemoryBudgetTest(AsyncTestCase):
+
+    def test_acquire_and_release(self):
+        budget = MemoryBudget(10)
+        budget.acquire(10)
+        self.assertTrue(budget.exhausted)
+        budget.release(5)
+        self.assertFalse(budget.exhausted)
+        self.assertEqual(budget.to_dict(),
+                         {'limit': 10, 'used': 5, 'waiting': 0})
+
+    def test_single_reader_while_exhausted(self):
+        budget = MemoryBudget(10)
+        self.assertTrue(budget.may_read('a'))
+        budget.acquire(20)
+        self.assertTrue(budget.may_read('a'))
+        self.assertFalse(budget.may_read('b'))
+        budget.end_read('a')
+        self.assertTrue(budget.may_read('b'))
+
+    def test_wait(self):
+        budget = MemoryBudget(10)
+        budget.acquire(10)
+        budget.wait(self.stop)
+        self.assertEqual(budget.to_dict()['waiting'], 1)
+        budget.release(10)
+        self.wait()
+        self.assertEqual(budget.to_dict()['waiting'], 0)
+
+
+class RequestBudgetTest(AsyncTestCase):
+
+    def test_wait(self):
+        budget = RequestBudget(2)
+        budget.acquire()
+        budget.acquire()
+        self.assertTrue(budget.exhausted)
+        budget.wait(self.stop)
+        self.assertEqual(budget.to_dict(),
+                         {'limit': 2, 'pending': 2, 'waiting': 1})
+        budget.release()
+        self.wait()
+        self.assertFalse(budget.exhausted)
+        self.assertEqual(budget.to_dict()['waiting'], 0)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tornado.concurrent import Future
+from bonzo.cache import LookupCache, TTLCache
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = Timer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertTrue('a' in self.cache)
+
+    def test_expiration(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=20)
+        self.timer.now = 10
+        self.assertFalse('a' in self.cache)
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertFalse('b' in self.cache)
+        self.assertTrue('a' in self.cache)
+
+
+class LookupCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = Timer()
+        self.calls = []
+        self.futures = {}
+
+    def lookup(self, key):
+        self.calls.append(key)
+        future = self.futures[key] = Future()
+        return future
+
+    def test_coalescing(self):
+        cache = LookupCache(self.lookup, timer=self.timer)
+        first = cache('a')
+        second = cache('a')
+        self.assertTrue(first is second)
+        self.futures['a'].set_result(True)
+        self.assertTrue(first.result())
+        self.assertTrue(cache('a').result())
+        self.assertEqual(self.calls, ['a'])
+
+    def test_negative_ttl(self):
+        cache = LookupCache(lambda key: key == 'a', ttl=100, negative_ttl=5,
+                            timer=self.timer)
+        self.assertTrue(cache('a').result())
+        self.assertFalse(cache('b').result())
+        self.timer.now = 5
+        self.assertTrue('a' in cache.cache)
+        self.assertFalse('b' in cache.cache)
+
+    def test_exceptions_not_cached(self):
+        cache = LookupCache(self.lookup, timer=self.timer)
+        future = cache('a')
+        self.futures['a'].set_exception(ValueError())
+        self.assertRaises(ValueError, future.result)
+        cache('a')
+        self.assertEqual(self.calls, ['a', 'a'])
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo.capture import SessionRecorder, read_sessions
+from bonzo.replay import Replayer
+from bonzo.testing import AsyncSMTPTestCase, connect_loopback, mail_script
+
+
+class SessionRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.bin')
+        self.now = 100.0
+        self.recorder = SessionRecorder(self.path, timer=lambda: self.now)
+
+    def tearDown(self):
+        self.recorder.close()
+        shutil.rmtree(self.directory)
+
+    def test_read_sessions(self):
+        first = self.recorder.open()
+        self.now += 0.5
+        second = self.recorder.open()
+        self.recorder.record(first, b'HELO first\r\n')
+        self.now += 0.25
+        self.recorder.record(second, b'HELO second\r\n')
+        self.recorder.record(first, b'QUIT\r\n')
+        self.recorder.close_session(first)
+        self.recorder.close()
+        sessions = read_sessions(self.path)
+        self.assertEqual([s.number for s in sessions], [first, second])
+        self.assertEqual(sessions[0].start, 0)
+        self.assertEqual(sessions[0].events, [(0.5, b'HELO first\r\n'),
+                                              (0.75, b'QUIT\r\n')])
+        self.assertTrue(sessions[0].closed)
+        self.assertEqual(sessions[1].start, 0.5)
+        self.assertEqual(sessions[1].events, [(0.25, b'HELO second\r\n')])
+        self.assertFalse(sessions[1].closed)
+        self.assertEqual(sessions[1].size, 13)
+
+    def test_truncated_file(self):
+        session = self.recorder.open()
+        self.recorder.record(session, b'HELO client\r\n')
+        self.recorder.close()
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        sessions = read_sessions(self.path)
+        self.assertEqual(sessions[0].events, [])
+
+    def test_invalid_file(self):
+        self.recorder.close()
+        with open(self.path, 'wb') as f:
+            f.write(b'HELO client\r\n')
+        self.assertRaises(ValueError, read_sessions, self.path)
+
+
+class CaptureReplayTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.bin')
+        self.recorder = SessionRecorder(self.path)
+        self.messages = []
+        super(CaptureReplayTest, self).setUp()
+
+    def tearDown(self):
+        self.recorder.close()
+        shutil.rmtree(self.directory)
+        super(CaptureReplayTest, self).tearDown()
+
+    def get_request_callback(self):
+        def request_callback(request):
+            self.messages.append(request.data)
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'recorder': self.recorder}
+
+    def capture(self, count=3, pipelined=False):
+        scripts = [mail_script('client%d' % i, 'mail@example.com',
+                               ['rcpt@example.com'], 'Message %d' % i)
+                   for i in range(count)]
+        self.run_sessions(scripts, pipelined=pipelined)
+        self.recorder.close()
+        del self.messages[:]
+        return read_sessions(self.path)
+
+    def replay(self, sessions, **kwargs):
+        replayer = Replayer(lambda: connect_loopback(self.smtp_server,
+                                                     io_loop=self.io_loop),
+                            io_loop=self.io_loop, **kwargs)
+        return self.io_loop.run_sync(lambda: replayer.run(sessions))
+
+    def test_capture(self):
+        sessions = self.capture()
+        self.assertEqual(len(sessions), 3)
+        for session in sessions:
+            data = b''.join(chunk for _, chunk in session.events)
+            self.assertTrue(data.startswith(b'HELO client'))
+            self.assertTrue(data.endswith(b'QUIT\r\n'))
+            self.assertTrue(session.closed)
+
+    def test_replay(self):
+        sessions = self.capture(pipelined=True)
+        result = self.replay(sessions, speed=0, concurrency=2)
+        self.assertEqual(result.sessions, 3)
+        self.assertEqual(result.errors, 0)
+        self.assertEqual(result.bytes_sent, sum(s.size for s in sessions))
+        # The welcome message, and 6 replies to the pipelined commands
+        self.assertEqual(result.replies, 21)
+        self.assertEqual(len(result.latencies), 18)
+        self.assertEqual(sorted(self.messages),
+                         ['Message 0', 'Message 1', 'Message 2'])
+        self.assertIn('3 sessions (0 errors)', result.summary())
+
+    def test_replay_timing(self):
+        sessions = self.capture(count=1)
+        session = sessions[0]
+        session.events = [(i * 0.02, data)
+                          for i, (_, data) in enumerate(session.events)]
+        result = self.replay(sessions, speed=2)
+        self.assertEqual(result.sessions, 1)
+        self.assertEqual(len(result.latencies), len(session.events))
+        expected = (len(session.events) - 1) * 0.01
+        self.assertTrue(result.duration >= expected)
+        self.assertEqual(self.messages, ['Message 0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo import compression
+from bonzo.compression import (Codec, CompressionPolicy, LZMACodec,
+                               ZlibCodec, get_codec)
+
+
+class CodecTest(unittest.TestCase):
+
+    data = b'Hello world\r\n' * 1000
+
+    def check_codec(self, codec):
+        chunks = [self.data[i:i + 100] for i in range(0, len(self.data), 100)]
+        compressed = b''.join(codec.iter_compress(chunks))
+        decoder = get_codec(codec.name)
+        decompressed = decoder.iter_decompress(
+            compressed[i:i + 7] for i in range(0, len(compressed), 7))
+        self.assertEqual(b''.join(decompressed), self.data)
+        return compressed
+
+    def test_identity(self):
+        self.assertEqual(self.check_codec(Codec()), self.data)
+
+    def test_zlib(self):
+        self.assertTrue(len(self.check_codec(ZlibCodec())) < len(self.data))
+
+    @unittest.skipIf(compression.lzma is None, 'lzma is not available')
+    def test_lzma(self):
+        self.assertTrue(len(self.check_codec(LZMACodec())) < len(self.data))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, 'unknown')
+
+
+class CompressionPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.large_codec = ZlibCodec(level=9)
+        self.policy = CompressionPolicy(min_size=100,
+                                        large_codec=self.large_codec,
+                                        large_size=1000)
+
+    def test_small(self):
+        self.assertEqual(self.policy.choose(99, 'text/plain').name,
+                         'identity')
+
+    def test_compressed_types(self):
+        for content_type in ('image/png', 'application/zip', 'Video/MP4'):
+            self.assertEqual(self.policy.choose(500, content_type).name,
+                             'identity')
+
+    def test_codecs(self):
+        self.assertTrue(self.policy.choose(500, 'text/plain') is
+                        self.policy.codec)
+        self.assertTrue(self.policy.choose(500) is self.policy.codec)
+        self.assertTrue(self.policy.choose(1000, 'application/pdf') is
+                        self.large_codec)
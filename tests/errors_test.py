@@ -34,3 +34,13 @@ class SMTPErrorTest(unittest.TestCase):
     def test_unrecognised_command_error(self):
         e = errors.UnrecognisedCommand()
         self.assertEqual(str(e), 'SMTP %d: %s' % (500, 'Error: bad syntax'))
+
+    def test_wire(self):
+        e = errors.SMTPError(self.status_code, self.message)
+        self.assertEqual(e.wire, b'501 This is a message exception.\r\n')
+        self.assertIs(e.wire, e.wire)
+
+    def test_cached_wire(self):
+        wire = errors.wire(errors.LineTooLong)
+        self.assertEqual(wire, b'500 Line too long\r\n')
+        self.assertIs(errors.wire(errors.LineTooLong), wire)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from tornado import gen
+from tornado.escape import utf8
+from tornado.testing import AsyncTestCase
+from bonzo import errors
+from bonzo.filters import Filter, FilterChain
+from bonzo.smtp import Application, RequestHandler
+from bonzo.testing import AsyncSMTPTestCase
+
+
+class Recorder(Filter):
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def helo(self, connection, hostname):
+        self.calls.append(('helo', hostname))
+
+    @gen.coroutine
+    def mail(self, connection, address):
+        self.calls.append(('mail', address))
+        if address == 'spammer@example.com':
+            self.reject('Sender rejected')
+
+    def rcpt(self, connection, address):
+        self.calls.append(('rcpt', address))
+        if address == 'busy@example.com':
+            self.tempfail()
+
+    def headers(self, connection, headers):
+        self.calls.append(('headers', headers['Subject']))
+        if headers['Subject'] == 'Spam':
+            self.reject('Message rejected')
+
+    def body(self, connection, data):
+        self.calls.append(('body', data))
+
+
+class FilterChainTest(AsyncTestCase):
+
+    def test_stages(self):
+        chain = FilterChain([Recorder([]), Filter()])
+        self.assertTrue(chain.has('helo'))
+        self.assertFalse(chain.has('connect'))
+        self.assertEqual(sorted(chain.latencies),
+                         [('Recorder', phase) for phase in
+                          sorted(['helo', 'mail', 'rcpt', 'headers', 'body'])])
+
+    def test_run(self):
+        calls = []
+        chain = FilterChain([Recorder(calls), Recorder(calls)])
+        chain.run('helo', None, 'client').add_done_callback(self.stop)
+        self.assertEqual(self.wait().result(), None)
+        self.assertEqual(calls, [('helo', 'client'), ('helo', 'client')])
+        self.assertEqual(chain.latencies[('Recorder', 'helo')].count, 2)
+
+    def test_reject(self):
+        calls = []
+        chain = FilterChain([Recorder(calls), Recorder(calls)])
+        future = chain.run('mail', None, 'spammer@example.com')
+        self.assertRaises(errors.SMTPError, future.result)
+        self.assertEqual(len(calls), 1)
+
+
+class FilterSMTPTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.calls = []
+        super(FilterSMTPTest, self).setUp()
+
+    def get_request_callback(self):
+        class Handler(RequestHandler):
+            pass
+
+        return Application(Handler, filters=[Recorder(self.calls)])
+
+    def test_phases(self):
+        self.connect()
+        data = self.send_mail('client', 'mail@example.com',
+                              ['rcpt@example.com'],
+                              'Subject: Hello\r\n\r\nThis is a message')
+        self.assertEqual(data, b'250 Ok\r\n')
+        self.assertEqual([call[0] for call in self.calls],
+                         ['helo', 'mail', 'rcpt', 'headers', 'body'])
+        self.assertEqual(self.calls[3], ('headers', 'Hello'))
+        self.close()
+
+    def test_reject_mail(self):
+        self.connect()
+        self.stream.write(b'HELO client\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:spammer@example.com\r\n')
+        self.assertEqual(self.read_response(), b'550 Sender rejected\r\n')
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.stream.write(b'RCPT TO:busy@example.com\r\n')
+        self.assertEqual(self.read_response(), utf8(
+            '451 Requested action aborted: try again later\r\n'))
+        self.close()
+
+    def test_reject_headers(self):
+        self.connect()
+        data = self.send_mail('client', 'mail@example.com',
+                              ['rcpt@example.com'],
+                              'Subject: Spam\r\n\r\nThis is a message')
+        self.assertEqual(data, b'550 Message rejected\r\n')
+        self.assertEqual(self.calls[-1], ('headers', 'Spam'))
+        self.close()
+
+    def test_headers_without_body(self):
+        self.connect()
+        data = self.send_mail('client', 'mail@example.com',
+                              ['rcpt@example.com'], 'Subject: Spam')
+        self.assertEqual(data, b'550 Message rejected\r\n')
+        self.assertEqual(self.calls[-1], ('headers', 'Spam'))
+        self.close()
+
+
+class RejectConnection(Filter):
+
+    def connect(self, connection):
+        raise errors.SMTPError(554, 'No service')
+
+
+class FilterConnectTest(AsyncSMTPTestCase):
+
+    def get_request_callback(self):
+        class Handler(RequestHandler):
+            pass
+
+        return Application(Handler, filters=[RejectConnection()])
+
+    def test_reject_connection(self):
+        self.connect(read_response=False)
+        self.assertEqual(self.read_response(), b'554 No service\r\n')
+        self.stream.read_until_close(self.stop)
+        self.wait()
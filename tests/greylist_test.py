@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo.greylist import Greylist, TripletTable
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TripletTableTest(unittest.TestCase):
+
+    def test_set_get_and_resize(self):
+        table = TripletTable(capacity=4)
+        for key in range(1, 101):
+            table.set(key, key, 0)
+        self.assertEqual(len(table), 100)
+        self.assertTrue(table.size >= 100 / table.MAX_LOAD)
+        for key in range(1, 101):
+            self.assertEqual(table.get(key), (key, 0))
+        self.assertEqual(table.get(101), None)
+
+    def test_incremental_resize(self):
+        table = TripletTable(capacity=4)
+        table.MIGRATE_BATCH = 1
+        size = table.size
+        keys = range(1, int(size * table.MAX_LOAD) + 1)
+        for key in keys:
+            table.set(key, key, 0)
+        table.set(100, 100, 0)
+        self.assertEqual(table.size, 2 * size)
+        self.assertTrue(table.migrating)
+        # Keys set or removed before being moved keep their new state
+        table.set(keys[-1], 1, 2)
+        table.remove_slot(table._slot(keys[-1]))
+        table.set(keys[-2], 3, 4)
+        self.assertEqual(table.get(keys[-1]), None)
+        self.assertEqual(table.get(keys[-2]), (3, 4))
+        self.assertEqual(table.get(keys[0]), (keys[0], 0))
+        table.migrate()
+        self.assertFalse(table.migrating)
+        self.assertEqual(len(table), len(keys))
+        self.assertEqual(table.get(keys[-1]), None)
+        self.assertEqual(table.get(keys[-2]), (3, 4))
+        for key in list(keys[:-2]) + [100]:
+            self.assertEqual(table.get(key), (key, 0))
+
+    def test_remove_slot_keeps_probe_sequences(self):
+        table = TripletTable(capacity=4)
+        keys = [1, 1 + table.size, 1 + 2 * table.size, 2]
+        for key in keys:
+            table.set(key, key, key)
+        table.remove_slot(table._slot(keys[0]))
+        self.assertEqual(table.get(keys[0]), None)
+        for key in keys[1:]:
+            self.assertEqual(table.get(key), (key, key))
+        self.assertEqual(len(table), 3)
+
+
+class GreylistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = Timer()
+        self.greylist = Greylist(delay=60, retry_window=600, expire=3600,
+                                 timer=self.timer)
+
+    def test_check(self):
+        args = ('192.168.0.1', 'mail@example.com', 'rcpt@example.com')
+        self.assertFalse(self.greylist.check(*args))
+        self.timer.now += 30
+        self.assertFalse(self.greylist.check(*args))
+        self.timer.now += 30
+        self.assertTrue(self.greylist.check('192.168.0.2', *args[1:]))
+        self.assertFalse(self.greylist.check('192.168.1.1', *args[1:]))
+        self.timer.now += 3000
+        self.assertTrue(self.greylist.check(*args))
+
+    def test_unix_clients(self):
+        self.assertNotEqual(self.greylist.network('unix:uid=1000'),
+                            self.greylist.network('unix:uid=1001'))
+
+    def test_retry_window(self):
+        args = ('192.168.0.1', 'mail@example.com', 'rcpt@example.com')
+        self.greylist.check(*args)
+        self.timer.now += 601
+        self.assertFalse(self.greylist.check(*args))
+
+    def test_sweep(self):
+        for i in range(50):
+            self.greylist.check('10.0.%d.1' % i, 'mail@example.com',
+                                'rcpt@example.com')
+        self.timer.now += 601
+        self.greylist.check('10.1.0.1', 'mail@example.com', 'rcpt@example.com')
+        removed = 0
+        for _ in range(2 * self.greylist.table.size):
+            removed += self.greylist.sweep(1)
+        self.assertEqual(removed, 50)
+        self.assertEqual(len(self.greylist), 1)
+
+    def test_snapshot(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            args = ('::1', 'mail@example.com', 'rcpt@example.com')
+            self.greylist.check(*args)
+            self.greylist.save(path)
+            greylist = Greylist(delay=60, snapshot_path=path, timer=self.timer)
+            self.assertEqual(len(greylist), 1)
+            self.timer.now += 60
+            self.assertTrue(greylist.check(*args))
+        finally:
+            os.remove(path)
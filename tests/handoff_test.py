@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tornado.testing import bind_unused_port
+
+from bonzo import handoff
+
+
+class HandoffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sock, self.port = bind_unused_port()
+        handoff._inherited = None
+
+    def tearDown(self):
+        self.sock.close()
+        handoff._inherited = None
+
+    def test_inherited_sockets(self):
+        fd = os.dup(self.sock.fileno())
+        os.environ[handoff.LISTEN_FDS] = '%d:%d' % (fd, self.sock.family)
+        self.assertEqual(handoff.inherited_sockets(self.port + 1), [])
+        sockets = handoff.inherited_sockets(self.port)
+        self.assertEqual(len(sockets), 1)
+        self.assertEqual(sockets[0].getsockname(), self.sock.getsockname())
+        self.assertEqual(handoff.inherited_sockets(self.port), [])
+        self.assertFalse(handoff.LISTEN_FDS in os.environ)
+        sockets[0].close()
+
+    def test_spawn(self):
+        code = ('import sys; sys.path.insert(0, %r); '
+                'from bonzo import handoff; '
+                'sock, = handoff.inherited_sockets(%d)' %
+                (os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 self.port))
+        process = handoff.spawn([self.sock], [sys.executable, '-c', code])
+        process.wait()
+        self.assertEqual(process.returncode, 0)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from tornado.iostream import StreamClosedError
+from tornado.testing import AsyncTestCase
+
+from bonzo.loopback import stream_pair
+
+
+class LoopbackStreamTest(AsyncTestCase):
+
+    def setUp(self):
+        super(LoopbackStreamTest, self).setUp()
+        self.client, self.server = stream_pair(self.io_loop)
+
+    def test_read_until(self):
+        self.client.write(b'HELO ')
+        self.server.read_until(b'\r\n', self.stop)
+        self.assertTrue(self.server.reading())
+        self.client.write(b'client\r\nNOOP\r\n')
+        self.assertEqual(self.wait(), b'HELO client\r\n')
+        self.assertFalse(self.server.reading())
+        self.server.read_until(b'\r\n', self.stop)
+        self.assertEqual(self.wait(), b'NOOP\r\n')
+
+    def test_read_bytes(self):
+        self.client.write(b'abcdef')
+        self.server.read_bytes(4, self.stop)
+        self.assertEqual(self.wait(), b'abcd')
+        self.server.read_bytes(4, self.stop, partial=True)
+        self.assertEqual(self.wait(), b'ef')
+
+    def test_futures(self):
+        future = self.server.read_bytes(3)
+        self.client.write(b'abc').add_done_callback(self.stop)
+        self.wait()
+        self.assertEqual(future.result(), b'abc')
+
+    def test_write_callback(self):
+        self.client.write(b'abc', self.stop)
+        self.wait()
+        self.assertFalse(self.client.writing())
+
+    def test_close(self):
+        closed = []
+        self.server.set_close_callback(lambda: closed.append(True))
+        self.client.write(b'QUIT\r\n')
+        self.client.close()
+        self.server.read_until_close(self.stop)
+        self.assertEqual(self.wait(), b'QUIT\r\n')
+        self.assertTrue(self.server.closed())
+        self.assertEqual(closed, [True])
+        self.assertRaises(StreamClosedError, self.server.write, b'221 Bye')
+
+    def test_unsatisfiable_read(self):
+        future = self.server.read_until(b'\r\n')
+        self.client.write(b'QUIT')
+        self.client.close()
+        self.assertTrue(self.server.closed())
+        self.assertRaises(StreamClosedError, future.result)
+
+    def test_read_closed(self):
+        self.server.close()
+        self.assertRaises(StreamClosedError, self.server.read_until, b'\r\n')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import email
+import os
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from bonzo import mime
+
+
+def make_message():
+    message = MIMEMultipart()
+    message['Subject'] = 'Test'
+    alternative = MIMEMultipart('alternative')
+    alternative.attach(MIMEText('Hello'))
+    alternative.attach(MIMEText(u'<b>H\xe9llo</b>' * 100, 'html', 'utf-8'))
+    message.attach(alternative)
+    attachment = MIMEApplication(os.urandom(20000))
+    attachment.add_header('Content-Disposition', 'attachment',
+                          filename='data.bin')
+    message.attach(attachment)
+    message.attach(MIMEText(u'caf\xe9 ' * 50, 'plain', 'latin-1'))
+    return message.as_string().replace('\n', '\r\n').encode('utf-8')
+
+
+class MIMEParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = make_message()
+        parse = getattr(email, 'message_from_bytes', email.message_from_string)
+        message = parse(self.raw)
+        self.leaves = [m for m in message.walk() if not m.is_multipart()]
+
+    def parse(self, chunk_size):
+        parser = mime.MIMEParser()
+        parts = []
+        for i in range(0, len(self.raw), chunk_size):
+            parts.extend(parser.feed(self.raw[i:i + chunk_size]))
+        parts.extend(parser.close())
+        for part in parts:
+            part.source = self.raw
+        return parts
+
+    def test_parts(self):
+        for chunk_size in (7, 100, 65536):
+            parts = self.parse(chunk_size)
+            self.assertEqual([p.path for p in parts],
+                             [(0, 0), (0, 1), (1,), (2,)])
+            self.assertEqual([p.content_type for p in parts],
+                             ['text/plain', 'text/html',
+                              'application/octet-stream', 'text/plain'])
+            self.assertEqual(parts[2].filename, 'data.bin')
+            for part, leaf in zip(parts, self.leaves):
+                self.assertEqual(part.read(), leaf.get_payload(decode=True))
+
+    def test_chunked_payload(self):
+        for part in self.parse(65536):
+            self.assertEqual(b''.join(part.iter_payload(chunk_size=13)),
+                             part.read())
+
+    def test_undecoded_payload(self):
+        part = self.parse(65536)[2]
+        self.assertEqual(part.encoding, 'base64')
+        self.assertEqual(part.read(decode=False),
+                         self.raw[part.start:part.end])
+
+    def test_single_part(self):
+        parts = list(mime.iter_parts(b'Subject: Test\r\n\r\nHello\r\nWorld'))
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0].path, ())
+        self.assertEqual(parts[0].headers['Subject'], 'Test')
+        self.assertEqual(parts[0].read(), b'Hello\r\nWorld')
+
+    def test_headers_only(self):
+        parts = list(mime.iter_parts(b'Subject: Test'))
+        self.assertEqual(parts[0].headers['Subject'], 'Test')
+        self.assertEqual(parts[0].read(), b'')
+
+    def test_max_header_size(self):
+        parser = mime.MIMEParser(max_header_size=16)
+        parts = parser.feed(b'Subject: Test\r\nX-Long: ' + b'a' * 100)
+        parts.extend(parser.close())
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0].raw_headers, b'Subject: Test')
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from bonzo.profiler import SamplingProfiler
+from bonzo.smtp import Application, RequestHandler
+from bonzo.testing import AsyncSMTPTestCase
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def read_stacks(path):
+    with open(path) as f:
+        return dict(line.rsplit(' ', 1) for line in f.read().splitlines())
+
+
+class SamplingProfilerTest(AsyncTestCase):
+
+    def setUp(self):
+        super(SamplingProfilerTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.profiler = SamplingProfiler(
+            os.path.join(self.directory, 'profile-%(pid)d.txt'),
+            duration=0.2, interval=0.005, io_loop=self.io_loop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(SamplingProfilerTest, self).tearDown()
+
+    @gen_test
+    def test_profile(self):
+        future = self.profiler.start()
+        self.assertTrue(self.profiler.running)
+        self.assertIs(self.profiler.start(), future)
+        self.io_loop.add_callback(busy, 0.1)
+        path = yield future
+        self.assertFalse(self.profiler.running)
+        self.assertEqual(path, os.path.join(self.directory,
+                                            'profile-%d.txt' % os.getpid()))
+        stacks = read_stacks(path)
+        busy_stacks = [stack for stack in stacks if 'busy (' in stack]
+        self.assertTrue(busy_stacks)
+        self.assertTrue(busy_stacks[0].startswith('phase:-;handler:-;'))
+        self.assertTrue(all(int(count) > 0 for count in stacks.values()))
+
+    @gen_test
+    def test_signal(self):
+        previous = signal.getsignal(signal.SIGUSR2)
+        try:
+            self.profiler.install(signal.SIGUSR2)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            while not self.profiler.running:
+                yield gen.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
+        self.profiler.stop()
+        path = yield self.profiler.start()
+        self.assertTrue(os.path.exists(path))
+
+
+class Handler(RequestHandler):
+
+    def data(self):
+        busy(0.1)
+
+
+class ProfilerHandlerTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super(ProfilerHandlerTest, self).setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(ProfilerHandlerTest, self).tearDown()
+
+    def get_request_callback(self):
+        return Application(Handler)
+
+    def test_labels(self):
+        profiler = SamplingProfiler(os.path.join(self.directory, 'profile'),
+                                    duration=10, interval=0.005,
+                                    io_loop=self.io_loop)
+        future = profiler.start()
+        self.connect()
+        self.send_mail('client', 'mail@example.com', ['rcpt@example.com'],
+                       'This is a message')
+        self.close()
+        profiler.stop()
+        self.io_loop.add_future(future, self.stop)
+        stacks = read_stacks(self.wait().result())
+        self.assertTrue([stack for stack in stacks if
+                         stack.startswith('phase:DATA;handler:Handler;') and
+                         'busy (' in stack])
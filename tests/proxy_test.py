@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import socket
+import struct
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo import proxy
+
+
+def v2_header(command=1, family=0x11, addresses=None):
+    if addresses is None:
+        addresses = (socket.inet_pton(socket.AF_INET, '192.0.2.1') +
+                     socket.inet_pton(socket.AF_INET, '192.0.2.2') +
+                     struct.pack('!HH', 4321, 25))
+    return (proxy.V2_SIGNATURE + struct.pack('!BBH', 0x20 | command, family,
+                                             len(addresses)) + addresses)
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_v1(self):
+        data = b'PROXY TCP4 192.0.2.1 192.0.2.2 4321 25\r\nHELO'
+        self.assertEqual(proxy.parse(data), (('192.0.2.1', 4321), 40))
+        data = b'PROXY TCP6 2001:db8::1 2001:db8::2 4321 25\r\n'
+        self.assertEqual(proxy.parse(data), (('2001:db8::1', 4321), 44))
+        self.assertEqual(proxy.parse(b'PROXY UNKNOWN\r\n'), (None, 15))
+
+    def test_v1_incomplete(self):
+        data = b'PROXY TCP4 192.0.2.1 192.0.2.2 4321 25\r\n'
+        for i in range(len(data) - 1):
+            self.assertIsNone(proxy.parse(data[:i]))
+
+    def test_v1_invalid(self):
+        for data in (b'PROXY TCP4 192.0.2.1\r\n',
+                     b'PROXY TCP4 example.com 192.0.2.2 4321 25\r\n',
+                     b'PROXY TCP4 192.0.2.1 192.0.2.2 99999 25\r\n',
+                     b'PROXY TCP4 192.0.2.1 ' + b'1' * 100,
+                     b'HELO client\r\n'):
+            self.assertRaises(proxy.ProxyProtocolError, proxy.parse, data)
+
+    def test_v2(self):
+        header = v2_header()
+        self.assertEqual(proxy.parse(header + b'HELO'),
+                         (('192.0.2.1', 4321), len(header)))
+        addresses = (socket.inet_pton(socket.AF_INET6, '2001:db8::1') +
+                     socket.inet_pton(socket.AF_INET6, '2001:db8::2') +
+                     struct.pack('!HH', 4321, 25) + b'\x04\x00\x01x')
+        header = v2_header(family=0x21, addresses=addresses)
+        self.assertEqual(proxy.parse(header),
+                         (('2001:db8::1', 4321), len(header)))
+
+    def test_v2_local(self):
+        header = v2_header(command=0, family=0, addresses=b'')
+        self.assertEqual(proxy.parse(header), (None, 16))
+
+    def test_v2_incomplete(self):
+        header = v2_header()
+        for i in range(len(header)):
+            self.assertIsNone(proxy.parse(header[:i]))
+
+    def test_v2_invalid(self):
+        header = v2_header(command=2)
+        self.assertRaises(proxy.ProxyProtocolError, proxy.parse, header)
+        header = v2_header(addresses=b'x' * proxy.MAX_SIZE)
+        self.assertRaises(proxy.ProxyProtocolError, proxy.parse, header[:16])
+
+
+if __name__ == '__main__':
+    unittest.main()
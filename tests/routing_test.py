@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import re
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo.routing import Router
+
+
+class RouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router([
+            ('postmaster@example.com', 'postmaster'),
+            ('example.com', 'domain'),
+            ('*.example.com', 'subdomains'),
+            ('*.eu.example.com', 'eu'),
+            (re.compile(r'bounces\+.*@.*'), 'bounces'),
+            (re.compile(r'.*@tenant\.com'), 'tenant')])
+
+    def test_address(self):
+        self.assertEqual(self.router.resolve('PostMaster@Example.com'),
+                         'postmaster')
+
+    def test_domain(self):
+        self.assertEqual(self.router.resolve('mail@example.com'), 'domain')
+        self.assertEqual(self.router.resolve('mail@EXAMPLE.COM'), 'domain')
+
+    def test_wildcard(self):
+        self.assertEqual(self.router.resolve('mail@a.example.com'),
+                         'subdomains')
+        self.assertEqual(self.router.resolve('mail@b.a.example.com'),
+                         'subdomains')
+        self.assertEqual(self.router.resolve('mail@eu.example.com'),
+                         'subdomains')
+        self.assertEqual(self.router.resolve('mail@fr.eu.example.com'), 'eu')
+
+    def test_regex(self):
+        self.assertEqual(self.router.resolve('bounces+1@example.org'),
+                         'bounces')
+        self.assertEqual(self.router.resolve('bounces+1@example.com'),
+                         'domain')
+
+    def test_regex_matches_whole_address(self):
+        self.assertEqual(self.router.resolve('x@tenant.com'), 'tenant')
+        self.assertEqual(self.router.resolve('x@tenant.com.evil.org'), None)
+        router = Router([(re.compile(r'.*@(tenant\.com|tenant\.com\.au)'),
+                          't')])
+        self.assertEqual(router.resolve('x@tenant.com.au'), 't')
+
+    def test_targets(self):
+        self.assertEqual(sorted(self.router.targets()),
+                         ['bounces', 'domain', 'eu', 'postmaster',
+                          'subdomains', 'tenant'])
+
+    def test_default(self):
+        self.assertEqual(self.router.resolve('mail@example.org'), None)
+        self.assertEqual(self.router.resolve('mail@com', 'default'),
+                         'default')
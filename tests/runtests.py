@@ -4,7 +4,13 @@ import sys
 from unittest import defaultTestLoader, TextTestRunner, TestSuite
 
 TESTS = ('init_test', 'server_test', 'smtp_test', 'testing_test',
-         'errors_test', )
+         'errors_test', 'cache_test', 'bloom_test',
+         'greylist_test', 'routing_test',
+         'filters_test', 'budget_test', 'mime_test',
+         'store_test', 'compression_test', 'handoff_test',
+         'startup_test', 'loopback_test', 'capture_test', 'proxy_test',
+         'workers_test', 'watchdog_test',
+         'profiler_test', 'stats_test', 'admin_test', )
 
 
 def make_suite(prefix='', extra=(), force_all=False):
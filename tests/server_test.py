@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 import email
+import os
+import shutil
+import socket
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
 
 from tornado.escape import to_unicode, utf8
+from tornado.iostream import IOStream
 from tornado.testing import ExpectLog
 from bonzo import errors, version
+from bonzo.bloom import RecipientFilter
+from bonzo.capture import SessionRecorder, read_sessions
+from bonzo.greylist import Greylist
 from bonzo.testing import AsyncSMTPTestCase
 
 
@@ -265,6 +277,16 @@ class SMTPRequestTest(AsyncSMTPTestCase):
         self.close()
 
 
+class LoopbackSMTPConnectionTest(SMTPConnectionTest):
+
+    loopback = True
+
+
+class LoopbackSMTPRequestTest(SMTPRequestTest):
+
+    loopback = True
+
+
 class SMTPServerTest(AsyncSMTPTestCase):
 
     def get_request_callback(self):
@@ -329,3 +351,617 @@ class SMTPServerErrorLogMessageTest(AsyncSMTPTestCase):
             self.assertEqual(data, utf8('%d %s\r\n' % (self.status_code,
                                                        self.message)))
         self.close()
+
+
+class SMTPServerRecipientFilterTest(AsyncSMTPTestCase):
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'recipient_filter': RecipientFilter(['mail@example.com'])}
+
+    def test_rcpt(self):
+        self.connect()
+        self.stream.write(b'HELO NameClient\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        self.stream.write(b'RCPT TO:<unknown@example.com>\r\n')
+        data = self.read_response()
+        self.assertEqual(data, b'550 Requested action not taken: mailbox '
+                               b'unavailable\r\n')
+        self.stream.write(b'RCPT TO:<Mail@example.com>\r\n')
+        data = self.read_response()
+        self.assertEqual(data, b'250 Ok\r\n')
+        self.close()
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets required')
+class SMTPServerUnixSocketTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        super(SMTPServerUnixSocketTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'smtp.sock')
+        self.smtp_server.listen_unix(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(SMTPServerUnixSocketTest, self).tearDown()
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'recipient_filter': RecipientFilter(['mail@example.com']),
+                'trusted_uids': [os.getuid()]}
+
+    def connect(self, read_response=True):
+        self.stream = IOStream(socket.socket(socket.AF_UNIX),
+                               io_loop=self.io_loop)
+        self.stream.connect(self.path, self.stop)
+        self.wait()
+        if read_response:
+            self.read_response()
+
+    def test_local_submission(self):
+        self.connect()
+        self.stream.write(b'HELO localhost\r\n')
+        reply = self.read_response()
+        connection, = self.smtp_server._connections
+        if not hasattr(socket, 'SO_PEERCRED'):
+            self.assertEqual(reply, b'250 Hello 0.0.0.0\r\n')
+            self.assertIsNone(connection.peer_credentials)
+            self.assertFalse(connection.trusted)
+            return
+        self.assertEqual(reply, utf8('250 Hello unix:uid=%d\r\n' %
+                                     os.getuid()))
+        self.assertEqual(connection.peer_credentials,
+                         (os.getpid(), os.getuid(), os.getgid()))
+        self.assertEqual(connection.remote_ip, 'unix:uid=%d' % os.getuid())
+        self.assertTrue(connection.trusted)
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        # Trusted clients skip the recipient filter
+        self.stream.write(b'RCPT TO:<unknown@example.com>\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.close()
+
+    def test_untrusted_tcp_client(self):
+        AsyncSMTPTestCase.connect(self)
+        self.stream.write(b'HELO client\r\n')
+        self.read_response()
+        connection, = self.smtp_server._connections
+        self.assertIsNone(connection.peer_credentials)
+        self.assertFalse(connection.trusted)
+        self.close()
+
+
+class SMTPServerGreylistTest(AsyncSMTPTestCase):
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'greylist': Greylist(delay=0)}
+
+    def test_rcpt(self):
+        self.connect()
+        self.stream.write(b'HELO NameClient\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        self.stream.write(b'RCPT TO:<rcpt@example.com>\r\n')
+        data = self.read_response()
+        self.assertEqual(data, b'451 Greylisted, please try again later\r\n')
+        self.stream.write(b'RCPT TO:<rcpt@example.com>\r\n')
+        data = self.read_response()
+        self.assertEqual(data, b'250 Ok\r\n')
+        self.close()
+
+
+class SMTPServerMemoryBudgetTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.requests = []
+        super(SMTPServerMemoryBudgetTest, self).setUp()
+
+    def get_request_callback(self):
+        return self.requests.append
+
+    def get_smtpserver_options(self):
+        return {'memory_budget': 64}
+
+    def wait_for_request(self, count=1):
+        while len(self.requests) < count:
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, self.stop)
+            self.wait()
+
+    def wait_for_close(self, request):
+        while not request.connection.stream.closed():
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, self.stop)
+            self.wait()
+
+    def start_data(self, stream):
+        for line in (b'HELO client', b'MAIL FROM:mail@example.com',
+                     b'RCPT TO:rcpt@example.com', b'DATA'):
+            stream.write(line + b'\r\n')
+            stream.read_until(b'\r\n', self.stop)
+            data = self.wait()
+        return data
+
+    def test_budget_exhausted(self):
+        self.connect()
+        first = self.stream
+        self.start_data(first)
+        first.write(b'x' * 100 + b'\r\n.\r\n')
+        self.wait_for_request()
+        self.assertEqual(len(self.requests[0].data), 100)
+        self.assertEqual(self.smtp_server.get_stats()['memory']['used'], 105)
+        self.connect()
+        data = self.start_data(self.stream)
+        self.assertEqual(data, b'452 Insufficient system storage\r\n')
+        self.requests[0].finish()
+        first.read_until(b'\r\n', self.stop)
+        self.assertEqual(self.wait(), b'250 Ok\r\n')
+        self.assertEqual(self.smtp_server.get_stats()['memory']['used'], 0)
+        self.stream.write(b'DATA\r\n')
+        self.assertEqual(self.read_response(),
+                         b'354 End data with <CR><LF>.<CR><LF>\r\n')
+        first.close()
+        self.close()
+
+    def test_disconnect(self):
+        self.connect()
+        self.start_data(self.stream)
+        self.stream.write(b'x' * 100 + b'\r\n.\r\n')
+        self.wait_for_request()
+        self.close()
+        self.wait_for_close(self.requests[0])
+        # The handler still holds the message
+        self.assertEqual(self.smtp_server.get_stats()['memory']['used'], 105)
+        self.requests[0].finish()
+        self.assertEqual(self.smtp_server.get_stats()['memory']['used'], 0)
+
+    def test_empty_message(self):
+        self.connect()
+        self.start_data(self.stream)
+        self.stream.write(b'.\r\nQUIT\r\n')
+        self.wait_for_request()
+        self.assertEqual(self.requests[0].data, '')
+        self.requests[0].finish()
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(), b'221 Bye\r\n')
+        self.close()
+
+
+class SMTPServerRequestBudgetTest(SMTPServerMemoryBudgetTest):
+
+    def get_smtpserver_options(self):
+        return {'max_pending_requests': 1}
+
+    def test_budget_exhausted(self):
+        self.connect()
+        first = self.stream
+        self.start_data(first)
+        self.connect()
+        second = self.stream
+        self.start_data(second)
+        first.write(b'First message\r\n.\r\n')
+        self.wait_for_request()
+        second.write(b'Second message\r\n.\r\n')
+        self.connect()
+        self.stream.write(b'HELO client\r\n')
+        while self.smtp_server.request_budget.to_dict()['waiting'] < 2:
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, self.stop)
+            self.wait()
+        stats = self.smtp_server.get_stats()['requests']
+        # The second message is held, and the third client isn't read
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(stats['pending'], 1)
+        self.requests[0].finish()
+        first.read_until(b'\r\n', self.stop)
+        self.assertEqual(self.wait(), b'250 Ok\r\n')
+        self.wait_for_request(2)
+        self.assertEqual(self.requests[1].data, 'Second message')
+        self.requests[1].finish()
+        self.assertEqual(self.read_response(), b'250 Hello 127.0.0.1\r\n')
+        second.read_until(b'\r\n', self.stop)
+        self.assertEqual(self.wait(), b'250 Ok\r\n')
+        self.assertEqual(self.smtp_server.get_stats()['requests']['pending'],
+                         0)
+        first.close()
+        second.close()
+        self.close()
+
+    def test_disconnect(self):
+        budget = self.smtp_server.request_budget
+        self.connect()
+        self.start_data(self.stream)
+        self.stream.write(b'First message\r\n.\r\n')
+        self.wait_for_request()
+        self.close()
+        self.wait_for_close(self.requests[0])
+        self.assertEqual(budget.pending, 1)
+        # The handler of the closed connection still holds the budget, so
+        # the next client isn't read
+        self.connect()
+        self.stream.write(b'HELO client\r\n')
+        while not budget.to_dict()['waiting']:
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, self.stop)
+            self.wait()
+        self.requests[0].finish()
+        self.assertEqual(budget.pending, 0)
+        self.assertEqual(self.read_response(), b'250 Hello 127.0.0.1\r\n')
+        self.close()
+
+
+class SMTPServerLimitsTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.requests = []
+        super(SMTPServerLimitsTest, self).setUp()
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            self.requests.append(request)
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'max_line_length': 64, 'max_recipients': 2}
+
+    def test_line_too_long(self):
+        self.connect()
+        for length in (62, 63, 1000, 100000):
+            self.stream.write(b'NOOP' + b' ' * (length - 4) + b'\r\n')
+        self.stream.write(b'NOOP\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        for _ in range(3):
+            self.assertEqual(self.read_response(), b'500 Line too long\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.close()
+
+    def test_max_recipients(self):
+        self.connect()
+        self.stream.write(b'HELO client\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        for rcpt in (b'a@example.com', b'<a@example.com>', b'b@example.com',
+                     b'c@example.com'):
+            self.stream.write(b'RCPT TO:' + rcpt + b'\r\n')
+            data = self.read_response()
+        self.assertEqual(data, b'452 Too many recipients\r\n')
+        self.stream.write(b'DATA\r\n')
+        self.read_response()
+        self.stream.write(b'This is a message\r\n.\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.requests[0].rcpt,
+                         ['a@example.com', 'b@example.com'])
+        self.close()
+
+
+class SMTPServerMIMETest(AsyncSMTPTestCase):
+
+    message = (b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+               b'--b\r\nContent-Type: text/plain\r\n\r\n'
+               b'..dot\r\n..\r\n--b\r\n'
+               b'Content-Type: application/octet-stream\r\n'
+               b'Content-Transfer-Encoding: base64\r\n\r\n'
+               b'SGVsbG8=\r\n--b--')
+
+    def setUp(self):
+        self.requests = []
+        super(SMTPServerMIMETest, self).setUp()
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            self.requests.append(request)
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'parse_mime': True}
+
+    def test_parts(self):
+        self.connect()
+        for line in (b'HELO client', b'MAIL FROM:mail@example.com',
+                     b'RCPT TO:rcpt@example.com', b'DATA'):
+            self.stream.write(line + b'\r\n')
+            self.read_response()
+        # Written in small chunks splitting the dot stuffing
+        data = self.message + b'\r\n.\r\n'
+        for i in range(0, len(data), 3):
+            self.stream.write(data[i:i + 3])
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        request = self.requests[0]
+        self.assertEqual(request.raw, self.message.replace(b'\r\n..',
+                                                           b'\r\n.'))
+        self.assertEqual(request.size, len(request.raw))
+        parts = list(request.iter_parts())
+        self.assertEqual([p.path for p in parts], [(0,), (1,)])
+        self.assertEqual(parts[0].read(), b'.dot\r\n.')
+        self.assertEqual(parts[1].read(), b'Hello')
+        self.close()
+
+
+class SMTPServerCoalescingTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            request.finish()
+        return request_callback
+
+    def test_pipelined_replies(self):
+        self.connect()
+        stream = self.stream
+        writes = []
+        server_stream = stream.peer
+        write = server_stream.write
+
+        def counting_write(data, callback=None):
+            writes.append(data)
+            return write(data, callback)
+        server_stream.write = counting_write
+        stream.write(b'HELO client\r\nMAIL FROM:mail@example.com\r\n'
+                     b'RCPT TO:rcpt@example.com\r\nNOOP\r\nBAD\r\n'
+                     b'DATA\r\n')
+        for _ in range(6):
+            self.read_response()
+        self.assertEqual(writes, [
+            b'250 Hello 127.0.0.1\r\n250 Ok\r\n250 Ok\r\n250 Ok\r\n'
+            b'502 Error: command "BAD" not implemented\r\n'
+            b'354 End data with <CR><LF>.<CR><LF>\r\n'])
+        stream.write(b'Message\r\n.\r\nQUIT\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(), b'221 Bye\r\n')
+        self.close()
+
+
+class SMTPServerLMTPTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def setUp(self):
+        self.requests = []
+        super(SMTPServerLMTPTest, self).setUp()
+
+    def get_request_callback(self):
+        return self.requests.append
+
+    def get_smtpserver_options(self):
+        return {'lmtp': True}
+
+    def send_transaction(self, rcpt):
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        for address in rcpt:
+            self.stream.write(utf8('RCPT TO:%s\r\n' % address))
+            self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.stream.write(b'DATA\r\n')
+        self.read_response()
+        self.stream.write(b'This is a message\r\n.\r\n')
+        while len(self.requests) < 1:
+            self.io_loop.add_callback(self.stop)
+            self.wait()
+        return self.requests.pop()
+
+    def test_greeting(self):
+        self.connect(read_response=False)
+        self.assertEqual(self.read_response(),
+                         utf8('220 Bonzo LMTP Server %s\r\n' % version))
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.assertEqual(self.read_response(),
+                         b'503 Error: need LHLO command\r\n')
+        self.stream.write(b'HELO client\r\n')
+        self.assertEqual(self.read_response(),
+                         b'502 Error: command "HELO" not implemented\r\n')
+        self.stream.write(b'LHLO client\r\n')
+        self.assertEqual(self.read_response(), b'250 Hello 127.0.0.1\r\n')
+        self.stream.write(b'LHLO client\r\n')
+        self.assertEqual(self.read_response(), b'503 Duplicate LHLO\r\n')
+        self.close()
+
+    def test_reply_per_recipient(self):
+        self.connect()
+        self.stream.write(b'LHLO client\r\n')
+        self.read_response()
+        request = self.send_transaction(['a@example.com', 'b@example.com',
+                                         'c@example.com'])
+        self.assertTrue(request.lmtp)
+        request.finish_recipient('c@example.com')
+        self.assertRaises(RuntimeError, request.finish_recipient,
+                          'c@example.com')
+        self.assertRaises(ValueError, request.finish_recipient,
+                          'd@example.com')
+        request.fail_recipient('a@example.com', errors.MailboxUnavailable())
+        self.assertEqual(self.read_response(),
+                         b'550 Requested action not taken: mailbox '
+                         b'unavailable\r\n')
+        request.finish()
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        # The next transaction starts from scratch
+        request = self.send_transaction(['d@example.com'])
+        self.assertEqual(request.rcpt, ['d@example.com'])
+        request.fail(errors.InsufficientStorage())
+        self.assertEqual(self.read_response(),
+                         b'452 Insufficient system storage\r\n')
+        self.close()
+
+    def test_duplicate_recipient(self):
+        self.connect()
+        self.stream.write(b'LHLO client\r\nMAIL FROM:mail@example.com\r\n'
+                          b'RCPT TO:c@example.com\r\n'
+                          b'RCPT TO:c@example.com\r\n')
+        self.read_response()
+        self.read_response()
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(),
+                         b'503 Duplicate recipient\r\n')
+        self.stream.write(b'DATA\r\n')
+        self.read_response()
+        self.stream.write(b'This is a message\r\n.\r\n')
+        while not self.requests:
+            self.io_loop.add_callback(self.stop)
+            self.wait()
+        request = self.requests.pop()
+        self.assertEqual(request.rcpt, ['c@example.com'])
+        request.finish()
+        # A single reply for the single accepted RCPT command
+        self.stream.write(b'HELO client\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(),
+                         b'502 Error: command "HELO" not implemented\r\n')
+        self.close()
+
+    def test_request_exception(self):
+        def request_callback(request):
+            raise Exception('Delivery failed')
+        self.smtp_server.request_callback = request_callback
+        self.connect()
+        self.stream.write(b'LHLO client\r\nMAIL FROM:mail@example.com\r\n'
+                          b'RCPT TO:a@example.com\r\n'
+                          b'RCPT TO:b@example.com\r\nDATA\r\n')
+        for _ in range(5):
+            self.read_response()
+        with ExpectLog('tornado.application', 'Uncaught exception'):
+            self.stream.write(b'This is a message\r\n.\r\n')
+            self.assertEqual(self.read_response(),
+                             b'451 Internal confusion\r\n')
+            self.assertEqual(self.read_response(),
+                             b'451 Internal confusion\r\n')
+        self.stream.write(b'NOOP\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.close()
+
+    def test_smtp_request(self):
+        self.smtp_server.lmtp = False
+        self.connect()
+        self.stream.write(b'LHLO client\r\n')
+        self.assertEqual(self.read_response(),
+                         b'502 Error: command "LHLO" not implemented\r\n')
+        self.close()
+
+
+class SMTPServerProxyProtocolTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            request.finish()
+        return request_callback
+
+    def get_smtpserver_options(self):
+        return {'proxy_protocol': True}
+
+    def test_v1(self):
+        self.connect(read_response=False)
+        self.stream.write(b'PROXY TCP4 192.0.2.1 ')
+        self.stream.write(b'192.0.2.2 4321 25\r\nHELO client\r\n')
+        self.assertTrue(self.read_response().startswith(b'220 '))
+        self.assertEqual(self.read_response(), b'250 Hello 192.0.2.1\r\n')
+        connection, = self.smtp_server._connections
+        self.assertEqual(connection.address, ('192.0.2.1', 4321))
+        self.close()
+
+    def test_capture(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'sessions.bin')
+            recorder = self.smtp_server.recorder = SessionRecorder(path)
+            self.connect(read_response=False)
+            self.stream.write(b'PROXY TCP4 192.0.2.1 192.0.2.2 4321 25\r\n'
+                              b'HELO client\r\nNOOP\r\n')
+            for _ in range(3):
+                self.read_response()
+            self.close()
+            while self.smtp_server._connections:
+                self.io_loop.add_timeout(self.io_loop.time() + 0.01,
+                                         self.stop)
+                self.wait()
+            recorder.close()
+            # The commands received with the header are captured too
+            session, = read_sessions(path)
+            self.assertEqual(b''.join(data for _, data in session.events),
+                             b'HELO client\r\nNOOP\r\n')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_invalid_header(self):
+        self.connect(read_response=False)
+        with ExpectLog('tornado.general', 'Invalid PROXY protocol header'):
+            self.stream.write(b'HELO client\r\n')
+            self.stream.read_until_close(self.stop)
+            self.assertEqual(self.wait(), b'')
+
+
+class SMTPServerDrainTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.requests = []
+        super(SMTPServerDrainTest, self).setUp()
+
+    def get_request_callback(self):
+        return self.requests.append
+
+    def wait_until(self, condition):
+        while not condition():
+            self.io_loop.add_timeout(self.io_loop.time() + 0.01, self.stop)
+            self.wait()
+
+    def test_idle_connection(self):
+        self.connect()
+        future = self.smtp_server.drain()
+        self.assertEqual(self.read_response(), b'421 Service not available, '
+                                               b'closing transmission '
+                                               b'channel\r\n')
+        self.wait_until(future.done)
+        self.close()
+
+    def test_data_in_flight(self):
+        self.connect()
+        for line in (b'HELO client', b'MAIL FROM:mail@example.com',
+                     b'RCPT TO:rcpt@example.com', b'DATA'):
+            self.stream.write(line + b'\r\n')
+            self.read_response()
+        self.stream.write(b'This is')
+        future = self.smtp_server.drain()
+        self.stream.write(b' a message\r\n.\r\n')
+        self.wait_until(lambda: self.requests)
+        self.assertFalse(future.done())
+        self.requests[0].finish()
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertTrue(self.read_response().startswith(b'421 '))
+        self.wait_until(future.done)
+        self.close()
+
+    def test_timeout(self):
+        self.connect()
+        for line in (b'HELO client', b'MAIL FROM:mail@example.com',
+                     b'RCPT TO:rcpt@example.com', b'DATA'):
+            self.stream.write(line + b'\r\n')
+            self.read_response()
+        future = self.smtp_server.drain(timeout=0.01)
+        self.wait_until(future.done)
+        self.stream.read_until_close(self.stop)
+        self.assertEqual(self.wait(), b'')
+        self.close()
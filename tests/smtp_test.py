@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import socket
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
 from tornado import gen
-from tornado.testing import ExpectLog
+from tornado.escape import utf8
+from tornado.iostream import IOStream
+from tornado.testing import AsyncTestCase, ExpectLog
 from bonzo import errors
-from bonzo.smtp import Application, RequestHandler
+from bonzo.smtp import Application, BatchRequestHandler, RequestHandler
 from bonzo.testing import AsyncSMTPTestCase
 
 from tests import server_test
@@ -32,6 +43,22 @@ class HandlerSMTPRequestTest(server_test.SMTPRequestTest):
         return Application(Handler)
 
 
+class LoopbackHandlerSMTPConnectionTest(HandlerSMTPConnectionTest):
+
+    loopback = True
+
+
+class LoopbackHandlerSMTPRequestTest(HandlerSMTPRequestTest):
+
+    loopback = True
+
+
+class HandlerCoalescingTest(server_test.SMTPServerCoalescingTest):
+
+    def get_request_callback(self):
+        return Application(RequestHandler)
+
+
 class HandlerSMTPServerTest(server_test.SMTPServerTest):
 
     def get_request_callback(self):
@@ -137,3 +164,223 @@ class HandlerCoroutineTest(AsyncSMTPTestCase):
                        'This is a message')
         self.assertEqual(self.data_result, self.coroutine_result)
         self.close()
+
+
+class HandlerValidateRecipientTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.validated = []
+        super(HandlerValidateRecipientTest, self).setUp()
+
+    def get_request_callback(self):
+        class Handler(RequestHandler):
+
+            @classmethod
+            @gen.coroutine
+            def validate_recipient(cls, application, address):
+                self.validated.append(address)
+                raise gen.Return(address.startswith('valid'))
+
+        return Application(Handler)
+
+    def test_rcpt(self):
+        self.connect()
+        self.stream.write(b'HELO NameClient\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        for address in ['invalid@example.com', 'valid@example.com',
+                        '<valid@example.com>', 'invalid@example.com']:
+            self.stream.write(utf8('RCPT TO:%s\r\n' % address))
+            data = self.read_response()
+            if address.startswith('invalid'):
+                self.assertEqual(data, b'550 Requested action not taken: '
+                                       b'mailbox unavailable\r\n')
+            else:
+                self.assertEqual(data, b'250 Ok\r\n')
+        self.assertEqual(self.validated, ['invalid@example.com',
+                                          'valid@example.com'])
+        self.close()
+
+
+class HandlerRoutingTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.delivered = {}
+        super(HandlerRoutingTest, self).setUp()
+
+    def get_request_callback(self):
+        test = self
+
+        class Handler(RequestHandler):
+
+            def data(self):
+                test.delivered[self.name] = self.request.rcpt
+
+        class ExampleHandler(Handler):
+            name = 'example'
+
+        class TenantHandler(Handler):
+            name = 'tenant'
+
+        return Application(routes=[('example.com', ExampleHandler),
+                                   ('*.example.org', TenantHandler)])
+
+    def test_split_request(self):
+        self.connect()
+        data = self.send_mail('client', 'mail@example.com',
+                              ['a@example.com', 'b@x.example.org',
+                               'c@example.com'],
+                              'This is a message')
+        self.assertEqual(data, b'250 Ok\r\n')
+        self.assertEqual(self.delivered,
+                         {'example': ['a@example.com', 'c@example.com'],
+                          'tenant': ['b@x.example.org']})
+        self.close()
+
+    def test_unrouted_recipient(self):
+        self.connect()
+        self.stream.write(b'HELO NameClient\r\n')
+        self.read_response()
+        self.stream.write(b'MAIL FROM:mail@example.com\r\n')
+        self.read_response()
+        self.stream.write(b'RCPT TO:mail@example.org\r\n')
+        data = self.read_response()
+        self.assertEqual(data, b'550 Requested action not taken: mailbox '
+                               b'unavailable\r\n')
+        self.close()
+
+
+class HandlerLMTPTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def get_request_callback(self):
+
+        class Handler(RequestHandler):
+
+            @gen.coroutine
+            def data(self):
+                yield [self.deliver(rcpt) for rcpt in self.request.rcpt]
+
+            @gen.coroutine
+            def deliver(self, address):
+                yield gen.moment
+                if address.startswith('full'):
+                    self.fail_recipient(address, errors.InsufficientStorage())
+                else:
+                    self.finish_recipient(address)
+
+        class ExampleHandler(RequestHandler):
+
+            def data(self):
+                pass
+
+        return Application(Handler, routes=[('example.net', ExampleHandler)])
+
+    def get_smtpserver_options(self):
+        return {'lmtp': True}
+
+    def test_recipients(self):
+        self.connect()
+        rcpt = ['full@example.com', 'a@example.net', 'b@example.com']
+        commands = ['LHLO client', 'MAIL FROM:mail@example.com']
+        commands.extend('RCPT TO:%s' % address for address in rcpt)
+        commands.append('DATA')
+        for command in commands:
+            self.stream.write(utf8(command + '\r\n'))
+            self.read_response()
+        self.stream.write(b'This is a message\r\n.\r\n')
+        self.assertEqual(self.read_response(),
+                         b'452 Insufficient system storage\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.assertEqual(self.read_response(), b'250 Ok\r\n')
+        self.close()
+
+
+class BatchHandlerTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.batches = []
+        super(BatchHandlerTest, self).setUp()
+
+    def get_request_callback(self):
+        test = self
+
+        class Handler(BatchRequestHandler):
+
+            @gen.coroutine
+            def data_batch(self, requests):
+                test.batches.append([r.rcpt for r in requests])
+                for request in requests:
+                    if 'full@example.com' in request.rcpt:
+                        self.reject(request, errors.SMTPError(
+                            452, 'Insufficient system storage'))
+
+        return Application(Handler, batch_max_count=2, batch_max_wait=0.05)
+
+    def test_max_wait(self):
+        self.connect()
+        data = self.send_mail('client', 'mail@example.com',
+                              ['rcpt@example.com'], 'This is a message')
+        self.assertEqual(data, b'250 Ok\r\n')
+        self.assertEqual(self.batches, [[['rcpt@example.com']]])
+        self.close()
+
+    def test_max_count(self):
+        streams = []
+        for rcpt in ('rcpt@example.com', 'full@example.com'):
+            self.connect()
+            for line in ('HELO client', 'MAIL FROM:mail@example.com',
+                         'RCPT TO:%s' % rcpt, 'DATA'):
+                self.stream.write(utf8(line + '\r\n'))
+                self.read_response()
+            self.stream.write(b'This is a message\r\n.\r\n')
+            streams.append(self.stream)
+        replies = []
+        for stream in streams:
+            stream.read_until(b'\r\n', self.stop)
+            replies.append(self.wait())
+            stream.close()
+        self.assertEqual(replies, [b'250 Ok\r\n',
+                                   b'452 Insufficient system storage\r\n'])
+        self.assertEqual(self.batches, [[['rcpt@example.com'],
+                                         ['full@example.com']]])
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets required')
+class ApplicationListenUnixTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ApplicationListenUnixTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'smtp.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(ApplicationListenUnixTest, self).tearDown()
+
+    def read_response(self, stream):
+        stream.read_until(b'\r\n', self.stop)
+        return self.wait()
+
+    def test_listen_unix(self):
+        class Handler(RequestHandler):
+
+            def data(self):
+                pass
+
+        server = Application(Handler).listen_unix(self.path, max_recipients=1)
+        self.assertEqual(server.max_recipients, 1)
+        stream = IOStream(socket.socket(socket.AF_UNIX), io_loop=self.io_loop)
+        stream.connect(self.path, self.stop)
+        self.wait()
+        self.read_response(stream)
+        for line in (b'HELO localhost', b'MAIL FROM:mail@example.com',
+                     b'RCPT TO:rcpt@example.com', b'DATA'):
+            stream.write(line + b'\r\n')
+            self.read_response(stream)
+        stream.write(b'This is a message\r\n.\r\n')
+        self.assertEqual(self.read_response(stream), b'250 Ok\r\n')
+        stream.close()
+        server.stop()
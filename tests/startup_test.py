@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = ('email', 'email.parser', 'bonzo.mime', 'bonzo.handoff',
+                'tornado.autoreload')
+
+
+class StartupTest(unittest.TestCase):
+
+    def loaded_modules(self, statement):
+        code = ('import sys; sys.path.insert(0, %r); %s; '
+                'sys.stdout.write(" ".join(sys.modules))' % (ROOT, statement))
+        output = subprocess.check_output([sys.executable, '-c', code])
+        return set(output.decode('ascii').split())
+
+    def test_server_imports(self):
+        modules = self.loaded_modules('import bonzo.server')
+        self.assertEqual(modules.intersection(LAZY_MODULES), set())
+
+    def test_application_imports(self):
+        modules = self.loaded_modules('import bonzo.smtp; '
+                                      'bonzo.smtp.Application()')
+        self.assertEqual(modules.intersection(LAZY_MODULES), set())
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from bonzo.stats import Histogram, TopCounter
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_add(self):
+        histogram = Histogram((1, 2))
+        for value in (0.5, 1.5, 3):
+            histogram.add(value)
+        self.assertEqual(histogram.to_dict(), {
+            'buckets': [1, 2, '+Inf'],
+            'counts': [1, 1, 1],
+            'count': 3,
+            'total': 5.0,
+            'max': 3,
+        })
+
+
+class TopCounterTest(unittest.TestCase):
+
+    def test_top(self):
+        counter = TopCounter(2)
+        for key in ('a', 'a', 'a', 'b', 'c', 'a', 'd', 'b', 'b'):
+            counter.add(key)
+        # Counts are lower bounds, 'a' was added 4 times
+        self.assertEqual(counter.top(1), [('a', 2)])
+        self.assertTrue(len(counter.counts) <= 2)
+
+    def test_frequent_keys_kept(self):
+        counter = TopCounter(10)
+        for i in range(1000):
+            counter.add('frequent')
+            counter.add('rare-%d' % i)
+        self.assertEqual(counter.top(1)[0][0], 'frequent')
+        self.assertTrue(len(counter.counts) <= 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
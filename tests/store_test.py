@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tornado.testing import AsyncTestCase
+
+from bonzo.store import AsyncMessageStore, BlobStore, MessageStore
+
+
+def make_message(subject, attachment):
+    return (b'Subject: ' + subject + b'\r\n'
+            b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+            b'--b\r\nContent-Type: text/plain\r\n\r\nHello\r\n'
+            b'--b\r\nContent-Type: application/pdf\r\n'
+            b'Content-Transfer-Encoding: base64\r\n\r\n' + attachment +
+            b'\r\n--b--\r\n')
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = BlobStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_put(self):
+        digest = self.store.put(b'blob')
+        self.assertEqual(self.store.put(b'blob'), digest)
+        self.assertEqual(self.store.get(digest), b'blob')
+        self.assertEqual(self.store.refs[digest], 2)
+        self.assertEqual(b''.join(self.store.iter_blob(digest, 3)), b'blob')
+
+    def test_compression(self):
+        data = b'Hello world\r\n' * 1000
+        digest = self.store.put(data, 'text/plain')
+        self.assertEqual(self.store.get(digest), data)
+        path = self.store._blob_path(digest)
+        self.assertTrue(os.path.getsize(path) < len(data))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.readline(), b'zlib\n')
+
+    def test_compressed_types(self):
+        data = b'Hello world\r\n' * 1000
+        digest = self.store.put(data, 'image/png')
+        with open(self.store._blob_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), b'identity\n' + data)
+
+    def test_release(self):
+        digest = self.store.put(b'blob')
+        self.store.put(b'blob')
+        self.store.release(digest)
+        self.assertTrue(digest in self.store)
+        self.store.release(digest)
+        self.assertFalse(digest in self.store)
+        self.assertFalse(os.path.exists(self.store._blob_path(digest)))
+        self.assertRaises(KeyError, self.store.release, digest)
+
+    def test_journal(self):
+        first = self.store.put(b'first')
+        second = self.store.put(b'second')
+        self.store.put(b'second')
+        self.store.release(first)
+        self.store.close()
+        self.store = BlobStore(self.path)
+        self.assertEqual(self.store.refs, {second: 2})
+        self.store.compact()
+        self.store.close()
+        self.store = BlobStore(self.path)
+        self.assertEqual(self.store.refs, {second: 2})
+
+
+class MessageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = MessageStore(self.path, min_size=64)
+        self.attachment = b'QUJD' * 100
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_deduplication(self):
+        raws = [make_message(s, self.attachment) for s in (b'1', b'2')]
+        ids = [self.store.store(raw) for raw in raws]
+        self.assertEqual(len(self.store.blobs), 1)
+        digests = self.store.digests(ids[0])
+        self.assertEqual(digests, self.store.digests(ids[1]))
+        self.assertEqual(self.store.blobs.refs[digests[0]], 2)
+        for message_id, raw in zip(ids, raws):
+            self.assertEqual(self.store.read(message_id), raw)
+            self.assertEqual(
+                b''.join(self.store.iter_message(message_id, 7)), raw)
+
+    def test_small_parts_inline(self):
+        raw = make_message(b'1', b'QUJD')
+        message_id = self.store.store(raw)
+        self.assertEqual(self.store.digests(message_id), [])
+        self.assertEqual(self.store.read(message_id), raw)
+
+    def test_delete(self):
+        ids = [self.store.store(make_message(s, self.attachment))
+               for s in (b'1', b'2')]
+        self.store.delete(ids[0])
+        self.assertFalse(ids[0] in self.store)
+        self.assertEqual(len(self.store.blobs), 1)
+        self.store.delete(ids[1])
+        self.assertEqual(len(self.store.blobs), 0)
+
+
+class AsyncMessageStoreTest(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncMessageStoreTest, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.store = AsyncMessageStore(MessageStore(self.path, min_size=64),
+                                       io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+        super(AsyncMessageStoreTest, self).tearDown()
+
+    def test_store(self):
+        raw = make_message(b'1', b'QUJD' * 100)
+        self.store.store(raw).add_done_callback(self.stop)
+        message_id = self.wait().result()
+        self.store.read(message_id).add_done_callback(self.stop)
+        self.assertEqual(self.wait().result(), raw)
+        self.store.delete(message_id).add_done_callback(self.stop)
+        self.wait().result()
+        self.store.read(message_id).add_done_callback(self.stop)
+        self.assertRaises(IOError, self.wait().result)
@@ -4,7 +4,10 @@ try:
 except ImportError:
     import unittest
 
-from bonzo.testing import AsyncSMTPTestCase
+from tornado.iostream import StreamClosedError
+
+from bonzo.testing import (AsyncSMTPTestCase, latency_percentile, mail_script,
+                           throughput)
 
 
 def request_callback(message):
@@ -37,3 +40,68 @@ class AsyncSMTPTestCaseWrapperTest(unittest.TestCase):
         result = unittest.TestResult()
         test.run(result)
         self.assertRaises(NotImplementedError, test.get_request_callback)
+
+
+class SessionDriverTest(AsyncSMTPTestCase):
+
+    def setUp(self):
+        self.requests = []
+        super(SessionDriverTest, self).setUp()
+
+    def get_request_callback(self):
+
+        def request_callback(request):
+            self.requests.append(request)
+            request.finish()
+        return request_callback
+
+    def scripts(self, count):
+        return [mail_script('client', 'mail@example.com',
+                            ['rcpt%d@example.com' % i], 'Message %d' % i)
+                for i in range(count)]
+
+    def check_results(self, results):
+        self.assertEqual(len(results), 20)
+        for result in results:
+            self.assertEqual(result.error, None)
+            self.assertEqual(len(result.latencies), 6)
+            self.assertEqual(result.replies[-3:], [b'354 End data with '
+                                                   b'<CR><LF>.<CR><LF>\r\n',
+                                                   b'250 Ok\r\n',
+                                                   b'221 Bye\r\n'])
+        self.assertEqual(sorted(r.data for r in self.requests),
+                         sorted('Message %d' % i for i in range(20)))
+
+    def test_concurrent_sessions(self):
+        self.check_results(self.run_sessions(self.scripts(20)))
+
+    def test_pipelined_sessions(self):
+        self.check_results(self.run_sessions(self.scripts(20),
+                                             pipelined=True))
+
+    def test_transcript(self):
+        result, = self.run_sessions([['NOOP', 'QUIT']])
+        self.assertEqual(result.transcript[0][0], None)
+        self.assertTrue(result.transcript[0][1].startswith(b'220 '))
+        self.assertEqual(result.transcript[1:], [(b'NOOP', b'250 Ok\r\n'),
+                                                 (b'QUIT', b'221 Bye\r\n')])
+
+    def test_closed_session(self):
+        result, = self.run_sessions([['QUIT', 'NOOP']])
+        self.assertTrue(isinstance(result.error, StreamClosedError))
+        self.assertEqual(result.replies[-1], b'221 Bye\r\n')
+
+    def test_bounds(self):
+        results = self.run_sessions(self.scripts(20))
+        self.assertThroughput(results, 1)
+        self.assertLatency(results, 5)
+        self.assertRaises(AssertionError, self.assertThroughput, results, 1e9)
+        self.assertRaises(AssertionError, self.assertLatency, results, 0)
+        self.assertTrue(latency_percentile(results, 50) <=
+                        latency_percentile(results, 100))
+        self.assertTrue(throughput(results) > 0)
+
+
+class LoopbackSessionDriverTest(SessionDriverTest):
+
+    loopback = True
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import time
+
+from tornado.testing import AsyncTestCase, ExpectLog
+from bonzo.smtp import Application, RequestHandler
+from bonzo.testing import AsyncSMTPTestCase
+from bonzo.watchdog import LoopWatchdog
+
+
+class LoopWatchdogTest(AsyncTestCase):
+
+    def setUp(self):
+        super(LoopWatchdogTest, self).setUp()
+        self.watchdog = LoopWatchdog(threshold=0.05, interval=0.01,
+                                     io_loop=self.io_loop)
+        self.watchdog.start()
+
+    def tearDown(self):
+        self.watchdog.stop()
+        super(LoopWatchdogTest, self).tearDown()
+
+    def sleep(self, seconds):
+        self.io_loop.add_timeout(self.io_loop.time() + seconds, self.stop)
+        self.wait()
+
+    def test_lag(self):
+        self.sleep(0.05)
+        self.assertTrue(self.watchdog.lag.count > 0)
+        self.assertEqual(list(self.watchdog.stalls), [])
+
+    def test_stall(self):
+        def block():
+            time.sleep(0.2)
+        with ExpectLog('tornado.general', 'IOLoop blocked'):
+            self.io_loop.add_callback(block)
+            self.sleep(0.05)
+        stall = self.watchdog.stalls[0]
+        self.assertTrue(stall.duration >= 0.1)
+        self.assertIn('time.sleep(0.2)', ''.join(stall.stack))
+        stats = self.watchdog.to_dict()
+        self.assertEqual(len(stats['stalls']), 1)
+        self.assertEqual(stats['lag']['max'], stall.duration)
+
+
+class Handler(RequestHandler):
+
+    def data(self):
+        time.sleep(0.2)
+
+
+class WatchdogHandlerTest(AsyncSMTPTestCase):
+
+    def get_request_callback(self):
+        return Application(Handler)
+
+    def get_smtpserver_options(self):
+        self.watchdog = LoopWatchdog(threshold=0.05, interval=0.01,
+                                     io_loop=self.io_loop)
+        self.watchdog.start()
+        return {'watchdog': self.watchdog}
+
+    def tearDown(self):
+        self.watchdog.stop()
+        super(WatchdogHandlerTest, self).tearDown()
+
+    def test_handler_and_phase(self):
+        self.connect()
+        with ExpectLog('tornado.general', 'IOLoop blocked'):
+            self.send_mail('client', 'mail@example.com',
+                           ['rcpt@example.com'], 'This is a message')
+        self.close()
+        stall = self.smtp_server.get_stats()['loop']['stalls'][0]
+        self.assertEqual(stall['handler'], 'Handler')
+        self.assertEqual(stall['phase'], 'DATA')
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from tornado.testing import AsyncTestCase, ExpectLog, gen_test
+from bonzo import errors, workers
+from bonzo.server import SMTPRequest
+from bonzo.smtp import Application, WorkerRequestHandler
+from bonzo.testing import AsyncSMTPTestCase
+
+
+def check_subject(message):
+    if message.message['Subject'] == 'Reject':
+        raise errors.SMTPError(554, 'Rejected by %s' % message.hostname)
+    if message.message['Subject'] == 'Fail':
+        raise Exception('This is a custom exception')
+
+
+class Handler(WorkerRequestHandler):
+
+    @classmethod
+    def process(cls, message):
+        check_subject(message)
+
+
+class WorkerPoolTest(AsyncTestCase):
+
+    use_shared_memory = True
+
+    def setUp(self):
+        super(WorkerPoolTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.pool = workers.WorkerPool(
+            1, spool_path=self.directory,
+            use_shared_memory=self.use_shared_memory, io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+        super(WorkerPoolTest, self).tearDown()
+
+    def submit(self, subject):
+        request = SMTPRequest(None, '127.0.0.1', 'DATA', 'client',
+                              'mail@example.com', ['rcpt@example.com'],
+                              'Subject: %s\n\nThis is a message' % subject)
+        return self.pool.submit(check_subject, request)
+
+    @gen_test
+    def test_accept(self):
+        result = yield self.submit('Accept')
+        self.assertIsNone(result)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @gen_test
+    def test_smtp_error(self):
+        result = yield self.submit('Reject')
+        self.assertEqual(result.status_code, 554)
+        self.assertEqual(result.message, 'Rejected by client')
+
+    @gen_test
+    def test_exception(self):
+        with ExpectLog('tornado.application', 'Uncaught exception in worker'):
+            result = yield self.submit('Fail')
+        self.assertIsInstance(result, errors.InternalConfusion)
+
+    @gen_test
+    def test_dispatch_error(self):
+        request = SMTPRequest(None, '127.0.0.1', 'DATA', 'client',
+                              'mail@example.com', ['rcpt@example.com'],
+                              'This is a message')
+        with ExpectLog('tornado.application', 'Cannot send the function'):
+            # Functions must be pickled to be sent to the workers
+            result = yield self.pool.submit(lambda message: None, request)
+        self.assertIsInstance(result, errors.InternalConfusion)
+        self.assertEqual(self.pool.pending, 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class SpoolFileWorkerPoolTest(WorkerPoolTest):
+
+    use_shared_memory = False
+
+
+class WorkerHandlerTest(AsyncSMTPTestCase):
+
+    loopback = True
+
+    def get_request_callback(self):
+        self.application = Application(Handler, worker_processes=2)
+        return self.application
+
+    def tearDown(self):
+        self.application.close()
+        super(WorkerHandlerTest, self).tearDown()
+
+    def test_replies(self):
+        self.connect()
+        self.assertEqual(self.send_mail('client', 'mail@example.com',
+                                        ['rcpt@example.com'],
+                                        'Subject: Accept\r\n\r\nMessage'),
+                         b'250 Ok\r\n')
+        self.assertEqual(self.send_mail('client', 'mail@example.com',
+                                        ['rcpt@example.com'],
+                                        'Subject: Reject\r\n\r\nMessage'),
+                         b'554 Rejected by client\r\n')
+        self.close()
+
+
+class WorkerListenTest(AsyncTestCase):
+
+    def test_listen_starts_workers(self):
+        application = Application(routes=[('example.com', Handler)],
+                                  worker_processes=2)
+        children = len(multiprocessing.active_children())
+        server = application.listen(0, '127.0.0.1')
+        try:
+            # Forked before the IOLoop runs, not on the first message
+            self.assertIsNotNone(application._worker_pool)
+            self.assertEqual(len(multiprocessing.active_children()),
+                             children + 2)
+        finally:
+            server.stop()
+            application.close()
+
+    def test_listen_without_workers(self):
+        application = Application(routes=[('example.com', object)])
+        server = application.listen(0, '127.0.0.1')
+        server.stop()
+        self.assertIsNone(application._worker_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()